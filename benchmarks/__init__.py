@@ -0,0 +1,6 @@
+"""
+Benchmarks for the GtR client.  These are not installed with the library; run them
+from the root of the source tree, e.g.
+
+    python -m benchmarks.urls
+"""
@@ -0,0 +1,67 @@
+"""
+Behavioural checks of the client against the local stub server, for the things which the
+benchmarks rely on but do not measure.
+
+    python -m benchmarks.checks [check ...]
+
+Each check raises an AssertionError if it fails
+"""
+import argparse, sys
+
+from benchmarks.stub_server import StubServer
+
+def check_index_crawl(server):
+    """
+    a crawl into a search index (as a sink, with no callbacks or limits) fetches all of
+    the projects, and nothing else
+    """
+    from gtr import workflows, search
+    index = search.SearchIndex()
+    stats = workflows.crawl(server.base_url, sinks=[index], stats=True)
+    entities = stats.as_dict()["entities"]
+    projects = server.dataset.count("project")
+    assert len(index) == projects, "indexed %d of %d projects" % (len(index), projects)
+    for kind in ["person", "organisation", "publication"]:
+        assert kind not in entities, "made %d %s requests" % (entities[kind]["requests"], kind)
+
+def check_embedded_project_xml(server):
+    """
+    a project embedded in an organisation converts to XML with a single root element, and
+    back to the same data
+    """
+    from gtr import native, convert
+    from benchmarks.stub_server import uuid
+    client = native.GtRNative(server.base_url)
+    projects = client.organisation(uuid("organisation", 0)).projects()
+    assert len(projects) > 0, "the organisation has no projects"
+    for p in projects:
+        xml = p.xml()
+        assert xml.count("projectOverview") == 2, "nested root elements in " + xml
+        back = convert.to_dict(convert.etree.fromstring(xml), "project")
+        assert back == p.as_dict()["projectOverview"], "%r != %r" % (back, p.as_dict()["projectOverview"])
+
+CHECKS = ["index_crawl", "embedded_project_xml"]
+
+def run(checks):
+    server = StubServer(projects=200).start()
+    failed = 0
+    try:
+        for name in checks:
+            try:
+                globals()["check_" + name](server)
+                print("ok      " + name)
+            except AssertionError as e:
+                failed += 1
+                print("FAILED  " + name + ": " + str(e))
+    finally:
+        server.stop()
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("checks", nargs="*", metavar="check", help="checks to run (default: all of them)")
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error("unknown check " + name)
+    sys.exit(1 if run(args.checks or CHECKS) > 0 else 0)
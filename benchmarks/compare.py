@@ -0,0 +1,36 @@
+"""
+Compare two sets of saved benchmark results, scenario by scenario.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import json, sys
+
+METRICS = [("records_per_s", True), ("requests_per_s", True), ("latency_p50_ms", False),
+            ("latency_p99_ms", False), ("peak_rss_kb", False)]
+
+def _key(r):
+    return (r.get("scenario"), r.get("format"), r.get("workers"))
+
+def compare(before, after, out=sys.stdout):
+    old = dict([(_key(r), r) for r in before["results"] if "error" not in r])
+    for r in after["results"]:
+        if "error" in r or _key(r) not in old:
+            continue
+        o = old[_key(r)]
+        out.write("%s (%s, %s workers)\n" % _key(r))
+        for metric, higher_is_better in METRICS:
+            a, b = o.get(metric), r.get(metric)
+            if a is None or b is None:
+                continue
+            change = (b - a) / float(a) * 100 if a else 0.0
+            better = (change > 0) == higher_is_better
+            out.write("  %-16s %12.2f -> %12.2f  %+7.1f%% %s\n" % (metric, a, b, change, "" if change == 0 else ("better" if better else "worse")))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+    compare(before, after)
@@ -0,0 +1,66 @@
+"""
+Benchmark of the memory held by a set of fully fetched projects and their embedded
+organisations, funders and people, with and without an identity map, each time in a
+fresh interpreter against the local stub server.
+
+    python -m benchmarks.identity_memory [--projects N]
+"""
+import argparse, ast, os, subprocess, sys
+
+from benchmarks.stub_server import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# fetch the projects and build their embedded entities, keeping all of them, and report
+# the growth in the resident set and in the number of dicts
+SCRIPT = """
+import gc, sys
+from gtr import native
+from benchmarks.stub_server import uuid
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+client = native.GtRNative(%(base_url)r, identity_map=%(identity_map)r)
+uids = [uuid("project", i) for i in range(%(projects)d)]
+gc.collect()
+dicts = len([o for o in gc.get_objects() if type(o) is dict])
+before = rss()
+kept = []
+for uid in uids:
+    p = client.project(uid)
+    kept.append((p, p.funder(), p.lead(), p.orgs(), p.people(), p.collaborators()))
+gc.collect()
+after = rss()
+dicts = len([o for o in gc.get_objects() if type(o) is dict]) - dicts
+sys.stdout.write(repr({"rss" : after - before, "dicts" : dicts,
+                        "identities" : client.identities.stats() if client.identities else None}))
+"""
+
+def measure(base_url, projects, identity_map):
+    script = SCRIPT % {"base_url" : base_url, "projects" : projects, "identity_map" : identity_map}
+    out = subprocess.check_output([sys.executable, "-c", script], cwd=ROOT)
+    return ast.literal_eval(out.decode("utf-8"))
+
+def run(projects=5000):
+    server = StubServer(projects=projects).start()
+    try:
+        without = measure(server.base_url, projects, False)
+        with_map = measure(server.base_url, projects, True)
+    finally:
+        server.stop()
+    return {"projects" : projects, "without" : without, "with" : with_map}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--projects", type=int, default=5000, help="projects to fetch and keep")
+    args = parser.parse_args()
+    r = run(args.projects)
+    for name in ["without", "with"]:
+        m = r[name]
+        print("%-8s identity map: %6.1f MB, %8d dicts" % (name, m["rss"] / 1048576.0, m["dicts"]))
+    print("saving: %.0f%% of the memory, %.0f%% of the dicts" % (
+            100.0 * (1 - float(r["with"]["rss"]) / max(r["without"]["rss"], 1)),
+            100.0 * (1 - float(r["with"]["dicts"]) / max(r["without"]["dicts"], 1))))
+    print("identity map: " + str(r["with"]["identities"]))
@@ -0,0 +1,56 @@
+"""
+Benchmark of the time taken to import the client, each time in a fresh interpreter, and
+of which of the heavy dependencies the import loads.
+
+    python -m benchmarks.import_time [--number N] [--module gtr.native]
+"""
+import argparse, ast, os, subprocess, sys
+
+HEAVY = ["requests", "lxml.etree", "json", "copy", "tempfile", "multiprocessing.pool"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# time the import, then also the first use of the JSON and XML serialisations (without
+# making any requests), and report what was loaded at each point
+SCRIPT = """
+import sys, time
+before = set(sys.modules)
+start = time.time()
+import %(module)s
+imported = time.time() - start
+loaded = [m for m in %(heavy)r if m in sys.modules and m not in before]
+start = time.time()
+from gtr import convert
+convert.to_xml({"id" : "x"}, "project")
+first_xml = time.time() - start
+sys.stdout.write(repr({"import" : imported, "first_xml" : first_xml, "loaded" : loaded}))
+"""
+
+def measure(module="gtr.native"):
+    script = SCRIPT % {"module" : module, "heavy" : HEAVY}
+    out = subprocess.check_output([sys.executable, "-c", script], cwd=ROOT)
+    return ast.literal_eval(out.decode("utf-8"))
+
+def run(number=20, module="gtr.native"):
+    runs = [measure(module) for _ in range(number)]
+    imports = sorted([r["import"] for r in runs])
+    xmls = sorted([r["first_xml"] for r in runs])
+    return {
+        "module" : module,
+        "runs" : number,
+        "import_min" : imports[0],
+        "import_median" : imports[len(imports) // 2],
+        "first_xml_median" : xmls[len(xmls) // 2],
+        "loaded_on_import" : runs[-1]["loaded"]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--number", type=int, default=20, help="fresh interpreters to time")
+    parser.add_argument("--module", default="gtr.native", help="the module to import")
+    args = parser.parse_args()
+    r = run(args.number, args.module)
+    print("import %s: %.1f ms median, %.1f ms min (%d runs)" % (r["module"], r["import_median"] * 1000,
+            r["import_min"] * 1000, r["runs"]))
+    print("first XML conversion: %.1f ms median" % (r["first_xml_median"] * 1000))
+    print("heavy modules loaded by the import: " + (", ".join(r["loaded_on_import"]) or "none"))
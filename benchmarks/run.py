@@ -0,0 +1,333 @@
+"""
+Benchmark scenarios for the GtR client, run against the local stub server.
+
+    python -m benchmarks.run [scenario ...] [--projects N] [--records N] [--latency S]
+                             [--format json|xml] [--workers N] [--output results.json]
+
+Each scenario runs in its own process, so that its peak RSS is its own, and reports
+requests/s, records/s, p50/p99 request latency and peak RSS.  Results are printed, and
+saved as JSON if --output is given; use benchmarks.compare to compare two runs.
+"""
+import argparse, json, multiprocessing, platform, resource, sys, threading, time, traceback
+from multiprocessing.pool import ThreadPool
+
+from benchmarks.stub_server import StubServer, uuid
+
+SCENARIOS = ["paged", "crawl", "detail", "parse", "compression", "replay", "adaptive", "hedge"]
+
+## ----- request timing ----- ##
+
+class RequestTimer(object):
+    """
+    records the latency of every HTTP request made by the clients it is given to, via
+    an after_request hook
+    """
+    def __init__(self):
+        from gtr.instrument import Hooks
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.hooks = Hooks()
+        self.hooks.add("after_request", self._after_request)
+
+    def _after_request(self, info):
+        with self._lock:
+            self.latencies.append(info["elapsed"])
+            if info["status"] != 200:
+                self.errors += 1
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    k = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+## ----- scenarios ----- ##
+
+def scenario_paged(base_url, opts, hooks):
+    """iterate the project list with NativePaged.iterator, without fetching details"""
+    from gtr import native
+    client = native.GtRNative(base_url, page_size=100, serialisation=opts.format, hooks=hooks)
+    projects = client.projects()
+    records = 0
+    for p in projects.iterator():
+        p.id()
+        records += 1
+        if records >= opts.records:
+            break
+    return records
+
+def scenario_crawl(base_url, opts, hooks):
+    """workflows.crawl over projects, fetching each project's detail record"""
+    from gtr import workflows
+    counter = [0]
+    def callback(p):
+        p.title()
+        counter[0] += 1
+    workflows.crawl(base_url, project_callback=callback, project_limit=opts.records, workers=opts.workers, hooks=hooks)
+    return counter[0]
+
+def scenario_detail(base_url, opts, hooks):
+    """fetch individual project records by id, with opts.workers concurrent requests"""
+    from gtr import native
+    client = native.GtRNative(base_url, serialisation=opts.format, hooks=hooks)
+    ids = [uuid("project", i) for i in range(min(opts.records, opts.projects))]
+    def fetch(pid):
+        p = client.project(pid)
+        return 1 if p is not None else 0
+    if opts.workers > 1:
+        pool = ThreadPool(opts.workers)
+        try:
+            return sum(pool.map(fetch, ids))
+        finally:
+            pool.close()
+            pool.join()
+    return sum([fetch(pid) for pid in ids])
+
+def scenario_parse(base_url, opts, hooks):
+    """
+    parse a page of 100 projects repeatedly (no network after the first fetch), building
+    the Project objects and reading their fields, for the format given by opts.format
+    """
+    import requests as http
+    from gtr import native
+    from lxml import etree
+    client = native.GtRNative(base_url, serialisation=opts.format)
+    accept = client.mimetype
+    body = http.get(base_url + "/project/?page=1&fetchSize=100", headers={"Accept" : accept}).content
+    records = 0
+    while records < opts.records:
+        if opts.format == "xml":
+            data = etree.fromstring(body)
+        else:
+            data = json.loads(body)
+        for p in native.Projects(client, data, None, client.project_base).projects():
+            p.id()
+            p.title()
+            p.status()
+            records += 1
+    return records
+
+def scenario_compression(base_url, opts, hooks):
+    """
+    fetch list pages with and without compressed transfer, keeping the response bodies,
+    to show the bandwidth and memory saved
+    """
+    from gtr import native
+    from gtr.instrument import ClientStats
+    pages = max(opts.records // 100, 1)
+    extra = {}
+    records = 0
+    for compression in (False, True):
+        stats = ClientStats()
+        client = native.GtRNative(base_url, page_size=100, serialisation=opts.format, hooks=hooks, stats=stats,
+                                    compression=compression, keep_bodies=pages)
+        projects = client.projects()
+        for i in range(pages):
+            records += len(projects.list_elements())
+            if not projects.next_page():
+                break
+        label = "compressed" if compression else "uncompressed"
+        extra[label + "_wire_bytes"] = stats.bytes
+        extra[label + "_decoded_bytes"] = stats.decoded_bytes
+        extra[label + "_kept_bytes"] = client.bodies.compressed_size()
+    extra["kept_decompressed_bytes"] = client.bodies.decompressed_size()
+    return records, extra
+
+def scenario_replay(base_url, opts, hooks):
+    """
+    record a crawl of the stub server to a cassette, then replay the same crawl from the
+    cassette (with the stub's latency simulated); the timings are for the replay
+    """
+    import os, tempfile
+    from gtr import workflows, transport
+    fd, path = tempfile.mkstemp(suffix=".cassette")
+    os.close(fd)
+    try:
+        recorder = transport.RecordingTransport(path)
+        start = time.time()
+        workflows.crawl(base_url, project_callback=lambda p: p.title(), project_limit=opts.records, 
+                        workers=opts.workers, transport=recorder)
+        recorded = time.time() - start
+        recorder.close()
+        
+        replay = transport.ReplayTransport(path, latency=opts.latency, jitter=opts.jitter, seed=opts.seed)
+        counter = [0]
+        def callback(p):
+            p.title()
+            counter[0] += 1
+        start = time.time()
+        workflows.crawl(base_url, project_callback=callback, project_limit=opts.records, workers=opts.workers,
+                        hooks=hooks, transport=replay)
+        extra = {
+            "record_s" : recorded,
+            "replay_s" : time.time() - start,
+            "cassette_responses" : len(replay),
+            "cassette_bytes" : os.path.getsize(path),
+            "replay_misses" : replay.misses
+        }
+        return counter[0], extra
+    finally:
+        os.remove(path)
+
+def scenario_adaptive(base_url, opts, hooks):
+    """
+    workflows.crawl with opts.workers fetch workers, with the adaptive concurrency limiter
+    choosing how many of them may have a request in flight (run with --max-concurrency to
+    have the stub server refuse requests beyond its capacity)
+    """
+    from gtr import workflows, limiter
+    counter = [0]
+    def callback(p):
+        p.title()
+        counter[0] += 1
+    adaptive = limiter.AdaptiveLimiter(initial=2, maximum=max(opts.workers, 1))
+    stats = workflows.crawl(base_url, project_callback=callback, project_limit=opts.records, workers=opts.workers,
+                            hooks=hooks, stats=True, limiter=adaptive)
+    report = adaptive.report()
+    extra = {
+        "final_limit" : report["limit"],
+        "limit_changes" : len(report["history"]) - 1,
+        "throttled" : report["throttled"],
+        "status_codes" : stats.as_dict()["status_codes"]
+    }
+    return counter[0], extra
+
+def scenario_hedge(base_url, opts, hooks):
+    """
+    workflows.crawl with opts.workers fetch workers and hedged requests (run with 
+    --slow-rate to give the stub server's latency a long tail); compare its p99 with that
+    of the crawl scenario
+    """
+    from gtr import workflows, hedge
+    counter = [0]
+    def callback(p):
+        p.title()
+        counter[0] += 1
+    hedger = hedge.Hedger()
+    try:
+        stats = workflows.crawl(base_url, project_callback=callback, project_limit=opts.records, workers=opts.workers,
+                                hooks=hooks, stats=True, hedge=hedger)
+    finally:
+        hedger.close()
+    report = hedger.report()
+    extra = {
+        "hedge_delay_ms" : _ms(report["delay"]),
+        "hedges" : stats.as_dict()["hedges"]
+    }
+    return counter[0], extra
+
+## ----- running ----- ##
+
+def _run_scenario(name, base_url, opts, queue):
+    try:
+        timer = RequestTimer()
+        fn = globals()["scenario_" + name]
+        start = time.time()
+        records = fn(base_url, opts, timer.hooks)
+        elapsed = time.time() - start
+        extra = {}
+        if isinstance(records, tuple):
+            records, extra = records
+        requests = len(timer.latencies)
+        queue.put({
+            "extra" : extra,
+            "scenario" : name,
+            "format" : "json" if name == "crawl" else opts.format, # crawl always uses JSON
+            "workers" : opts.workers,
+            "elapsed_s" : elapsed,
+            "requests" : requests,
+            "errors" : timer.errors,
+            "records" : records,
+            "requests_per_s" : requests / elapsed if elapsed > 0 else None,
+            "records_per_s" : records / elapsed if elapsed > 0 else None,
+            "latency_p50_ms" : _ms(percentile(timer.latencies, 50)),
+            "latency_p99_ms" : _ms(percentile(timer.latencies, 99)),
+            "peak_rss_kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        })
+    except Exception:
+        queue.put({"scenario" : name, "error" : traceback.format_exc()})
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+def run(scenarios, opts):
+    server = StubServer(projects=opts.projects, latency=opts.latency, jitter=opts.jitter,
+                        error_rate=opts.error_rate, seed=opts.seed, max_concurrency=opts.max_concurrency,
+                        slow_rate=opts.slow_rate, slow=opts.slow)
+    server.start()
+    results = []
+    try:
+        for name in scenarios:
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_run_scenario, args=(name, server.base_url, opts, queue))
+            proc.start()
+            result = queue.get()
+            proc.join()
+            result["server_requests"] = server.requests
+            result["server_bytes"] = server.bytes_sent
+            server.reset_counters()
+            results.append(result)
+    finally:
+        server.stop()
+    return {
+        "meta" : {
+            "timestamp" : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "options" : vars(opts)
+        },
+        "results" : results
+    }
+
+def report(results, out=sys.stdout):
+    cols = ["scenario", "format", "workers", "records", "requests", "errors", "records_per_s",
+            "requests_per_s", "latency_p50_ms", "latency_p99_ms", "peak_rss_kb"]
+    out.write(" ".join(["%14s" % c[:14] for c in cols]) + "\n")
+    for r in results["results"]:
+        if "error" in r:
+            out.write("%14s failed:\n%s\n" % (r["scenario"], r["error"]))
+            continue
+        out.write(" ".join([_cell(r.get(c)) for c in cols]) + "\n")
+        for k, v in sorted(r.get("extra", {}).items()):
+            out.write("%14s %s: %s\n" % ("", k, v))
+
+def _cell(v):
+    if isinstance(v, float):
+        return "%14.2f" % v
+    if v is None:
+        return "%14s" % "-"
+    return "%14s" % v
+
+def options(argv=None):
+    parser = argparse.ArgumentParser(description="run the GtR client benchmarks against a local stub server")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help="scenarios to run, from " + ", ".join(SCENARIOS) + " (default: all)")
+    parser.add_argument("--projects", type=int, default=10000, help="size of the synthetic dataset (up to 1M or more)")
+    parser.add_argument("--records", type=int, default=1000, help="records to process in each scenario")
+    parser.add_argument("--format", choices=["json", "xml"], default="json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="mean of an exponential extra delay, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests which fail with a 503")
+    parser.add_argument("--max-concurrency", type=int, default=None, 
+                        help="requests the stub server handles at once, refusing any more with a 429")
+    parser.add_argument("--slow-rate", type=float, default=0, help="fraction of requests which take --slow seconds longer")
+    parser.add_argument("--slow", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to save the results to, as JSON")
+    opts = parser.parse_args(argv)
+    for name in opts.scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario " + name)
+    return opts
+
+if __name__ == "__main__":
+    opts = options()
+    scenarios = opts.scenarios if len(opts.scenarios) > 0 else SCENARIOS
+    results = run(scenarios, opts)
+    report(results)
+    if opts.output is not None:
+        with open(opts.output, "w") as f:
+            json.dump(results, f, indent=2)
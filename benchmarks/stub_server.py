@@ -0,0 +1,500 @@
+"""
+A local stand-in for the GtR API, serving synthetic records so that the client can be
+exercised (and timed) without touching the public service.
+
+Records are generated deterministically from their position in the dataset, so even a
+dataset of 1M projects costs nothing to "hold".  The server understands the native list
+and detail URLs for projects, organisations, people and publications, in JSON and XML,
+plus the CERIF project and class URLs used by the crawler.
+
+    >>> server = StubServer(projects=10000, latency=0.01, error_rate=0.01)
+    >>> server.start()
+    >>> client = GtRNative(server.base_url)
+    ...
+    >>> server.stop()
+"""
+import BaseHTTPServer, SocketServer
+import threading, random, time, json, re, urlparse, zlib, socket, sys
+from xml.sax.saxutils import escape, quoteattr
+
+GTR_NS = "http://gtr.rcuk.ac.uk/api"
+CERIF_NS = "{urn:xmlns:org:eurocris:cerif-1.5-1}"
+
+FUNDERS = ["AHRC", "BBSRC", "EPSRC", "ESRC", "MRC", "NERC", "STFC"]
+STATUSES = ["Active", "Closed"]
+CATEGORIES = ["Research Grant", "Fellowship", "Studentship", "Training Grant"]
+WORDS = ("anthropological investigation bird sound quantum materials climate ocean "
+            "carbon network graph language health cell protein galaxy energy storage "
+            "policy urban rural history music vision learning robot data").split()
+
+KIND_CODES = {"project" : 1, "organisation" : 2, "person" : 3, "publication" : 4, "funder" : 5, "class" : 6}
+
+# the element name used in the XML serialisation to contain each repeated JSON field
+XML_CONTAINERS = {
+    "organisation" : "organisations",
+    "projectPerson" : "projectPeople",
+    "collaborator" : "collaborations",
+    "projectComposition" : "projectCompositions",
+    "projectRole" : "projectRoles"
+}
+
+def uuid(kind, i):
+    return "%08X-0000-4000-8000-%012X" % (KIND_CODES[kind], i)
+
+def index_of(uid):
+    try:
+        return int(uid.split("-")[4], 16)
+    except (IndexError, ValueError):
+        return None
+
+class Dataset(object):
+    """
+    deterministic synthetic GtR records.  Popular organisations lead many projects, as
+    they do in the real data, so that lead organisations repeat heavily across a crawl
+    """
+    def __init__(self, projects=1000, organisations=None, people=None, publications=None, base_url=""):
+        self.base_url = base_url
+        self.counts = {
+            "project" : projects,
+            "organisation" : organisations if organisations is not None else max(projects // 20, 10),
+            "person" : people if people is not None else max(projects // 2, 10),
+            "publication" : publications if publications is not None else projects
+        }
+
+    def count(self, kind):
+        return self.counts[kind]
+
+    def url(self, kind, i):
+        return self.base_url + "/" + kind + "/" + uuid(kind, i)
+
+    def _words(self, i, n):
+        return " ".join([WORDS[(i * 7 + k * 13 + k * k) % len(WORDS)] for k in range(n)])
+
+    def _popular(self, i, n):
+        # skewed towards the low indices
+        r = ((i * 2654435761) % 4294967296) / 4294967296.0
+        return int(n * r * r * r)
+
+    def org_summary(self, i):
+        return {"id" : uuid("organisation", i), "url" : self.url("organisation", i),
+                "name" : "University of " + self._words(i, 2).title()}
+
+    def funder(self, i):
+        f = i % len(FUNDERS)
+        return {"id" : uuid("funder", f), "url" : self.url("organisation", f), "name" : FUNDERS[f]}
+
+    def person_summary(self, i):
+        return {"id" : uuid("person", i), "url" : self.url("person", i),
+                "firstName" : self._words(i, 1).title(), "surname" : self._words(i + 3, 1).title()}
+
+    def project_summary(self, i):
+        return {
+            "id" : uuid("project", i),
+            "url" : self.url("project", i),
+            "title" : self._words(i, 6).capitalize(),
+            "status" : STATUSES[i % len(STATUSES)],
+            "grantCategory" : CATEGORIES[i % len(CATEGORIES)],
+            "grantReference" : "GR/%07d/1" % i,
+            "abstractText" : self._words(i, 60).capitalize() + ".",
+            "fund" : {
+                "start" : "%04d-%02d-01" % (2000 + i % 14, 1 + i % 12),
+                "end" : "%04d-%02d-01" % (2003 + i % 14, 1 + i % 12),
+                "valuePounds" : 10000 + (i * 7919) % 2000000,
+                "funder" : self.funder(i)
+            }
+        }
+
+    def project_people(self, i):
+        people = []
+        n = self.counts["person"]
+        for k in range(1 + i % 3):
+            p = self.person_summary((i * 3 + k) % n)
+            role = "PRINCIPAL_INVESTIGATOR" if k == 0 else "CO_INVESTIGATOR"
+            p["projectRole"] = [role]
+            p["principalInvestigator"] = k == 0
+            p["coInvestigator"] = k != 0
+            people.append(p)
+        return people
+
+    def project(self, i):
+        n = self.counts["organisation"]
+        lead = self._popular(i, n)
+        orgs = [self.org_summary(lead)]
+        if i % n != lead:
+            orgs.append(self.org_summary(i % n))
+        collaborators = [self.org_summary((i * 31) % n)] if i % 4 == 0 else []
+        return {"projectComposition" : {
+            "project" : self.project_summary(i),
+            "leadResearchOrganisation" : self.org_summary(lead),
+            "organisation" : orgs,
+            "projectPerson" : self.project_people(i),
+            "collaborator" : collaborators
+        }}
+
+    def organisation(self, i, page, page_size):
+        # the organisation's own projects are those which list it as their second organisation
+        n = self.counts["organisation"]
+        total = len(range(i, self.counts["project"], n))
+        start = (page - 1) * page_size
+        projects = [self.project_summary(j) for j in range(i + start * n, self.counts["project"], n)[:page_size]]
+        return {"organisationOverview" : {"organisation" : self.org_summary(i), "project" : projects}}, total
+
+    def person(self, i):
+        p = self.person_summary(i)
+        p["otherNames"] = self._words(i + 5, 1).title()
+        return {"person" : p}
+
+    def publication(self, i):
+        return {"publication" : {"id" : uuid("publication", i), "url" : self.url("publication", i),
+                "title" : self._words(i + 11, 8).capitalize(), "type" : "Journal Article"}}
+
+    def detail(self, kind, i):
+        if kind == "project":
+            return self.project(i)
+        if kind == "person":
+            return self.person(i)
+        if kind == "publication":
+            return self.publication(i)
+
+    def summary(self, kind, i):
+        if kind == "project":
+            return self.project_summary(i)
+        if kind == "organisation":
+            return self.org_summary(i)
+        if kind == "person":
+            return self.person_summary(i)
+        if kind == "publication":
+            return self.publication(i)["publication"]
+
+    def cerif_project(self, i):
+        n = self.counts["organisation"]
+        lead = self._popular(i, n)
+        relations = [{"JAXBElement" : {"name" : CERIF_NS + "cfTitle", "value" : {"value" : self._words(i, 6).capitalize()}}},
+                     {"JAXBElement" : {"name" : CERIF_NS + "cfProj_OrgUnit",
+                            "value" : {"cfOrgUnitId" : uuid("organisation", lead), "cfClassId" : uuid("class", 0), "cfClassSchemeId" : uuid("class", 100)}}}]
+        if i % n != lead:
+            relations.append({"JAXBElement" : {"name" : CERIF_NS + "cfProj_OrgUnit",
+                            "value" : {"cfOrgUnitId" : uuid("organisation", i % n), "cfClassId" : uuid("class", 1), "cfClassSchemeId" : uuid("class", 100)}}})
+        return {"cfProj" : {"cfProjId" : uuid("project", i), "cfTitleOrCfAbstrOrCfKeyw" : relations}}
+
+    def cerif_classes(self):
+        terms = ["Lead Research Organisation", "Participating Organisation", "Collaborating Organisation", "Funder"]
+        return {"cfClassOrCfClassSchemeOrCfClassSchemeDescr" : [
+            {"cfClass" : {"cfClassId" : uuid("class", k), "cfClassSchemeId" : uuid("class", 100),
+                "cfDescrOrCfDescrSrcOrCfTerm" : [{"JAXBElement" : {"name" : CERIF_NS + "cfTerm", "value" : {"value" : t}}}]}}
+            for k, t in enumerate(terms)]}
+
+## ----- serialisation ------ ##
+
+def to_xml(root, d):
+    """
+    serialise one of the dataset's dicts in the style of the GtR XML API: urls become
+    attributes, and repeated fields are wrapped in a containing element
+    """
+    parts = ['<gtr:', root, ' xmlns:gtr="', GTR_NS, '">']
+    _xml_fields(d, parts)
+    parts.append('</gtr:' + root + '>')
+    return "".join(parts)
+
+def to_xml_list(root, name, items):
+    parts = ['<gtr:', root, ' xmlns:gtr="', GTR_NS, '">']
+    for item in items:
+        _xml_element(name, item, parts)
+    parts.append('</gtr:' + root + '>')
+    return "".join(parts)
+
+def _xml_element(name, value, parts):
+    if isinstance(value, dict):
+        attr = ""
+        if "url" in value:
+            attr = " url=" + quoteattr(value["url"])
+        parts.append("<gtr:" + name + attr + ">")
+        _xml_fields(value, parts)
+        parts.append("</gtr:" + name + ">")
+    else:
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        parts.append("<gtr:" + name + ">" + escape(unicode(value)) + "</gtr:" + name + ">")
+
+def _xml_fields(d, parts):
+    for k, v in d.iteritems():
+        if k == "url":
+            continue
+        if isinstance(v, list):
+            container = XML_CONTAINERS.get(k)
+            if container is not None:
+                parts.append("<gtr:" + container + ">")
+            for item in v:
+                _xml_element(k, item, parts)
+            if container is not None:
+                parts.append("</gtr:" + container + ">")
+        else:
+            _xml_element(k, v, parts)
+
+XML_ROOTS = {"project" : "projectOverview", "organisation" : "organisationOverview",
+                "person" : "personOverview", "publication" : "publicationOverview"}
+XML_LISTS = {"project" : "projects", "organisation" : "organisations", "person" : "people", "publication" : "publications"}
+
+## ----- HTTP ------ ##
+
+PATH_RX = re.compile(r"^/+(cerif/+)?([a-z]+)/*([^/]*)$")
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.stub
+        server._count_request()
+
+        if not server._enter():
+            headers = {"Retry-After" : str(server.retry_after)} if server.retry_after is not None else None
+            return self._send(429, "text/plain", "too many requests", headers)
+        try:
+            self._get(server)
+        finally:
+            server._exit()
+
+    def _get(self, server):
+        if server.latency > 0 or server.jitter > 0:
+            delay = server.latency
+            if server.jitter > 0:
+                delay += server.random.expovariate(1.0 / server.jitter)
+            time.sleep(delay)
+        if server.slow_rate > 0 and server.random.random() < server.slow_rate:
+            time.sleep(server.slow)
+
+        if server.error_rate > 0 and server.random.random() < server.error_rate:
+            return self._send(503, "text/plain", "unavailable", {"Retry-After" : "1"})
+
+        parsed = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(parsed.query))
+        m = PATH_RX.match(parsed.path)
+        if m is None:
+            return self._send(404, "text/plain", "not found")
+        cerif, kind, uid = m.groups()
+        xml = "xml" in self.headers.get("Accept", "")
+
+        if cerif:
+            return self._cerif(kind, uid)
+        if kind not in XML_ROOTS:
+            return self._send(404, "text/plain", "not found")
+
+        try:
+            page = max(int(params.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+        try:
+            page_size = min(max(int(params.get("fetchSize", 25)), 1), 100)
+        except ValueError:
+            page_size = 25
+
+        ds = server.dataset
+        if uid == "":
+            total = ds.count(kind)
+            start = (page - 1) * page_size
+            items = [ds.summary(kind, i) for i in range(start, min(start + page_size, total))]
+            if xml:
+                body = to_xml_list(XML_LISTS[kind], kind, items)
+            else:
+                body = json.dumps({kind : items, "page" : page, "size" : page_size,
+                                    "totalPages" : _pages(total, page_size), "totalSize" : total})
+            return self._send(200, "application/xml" if xml else "application/json", body,
+                                self._paging_headers(parsed.path, total, page, page_size))
+
+        i = index_of(uid)
+        if i is None or i >= ds.count(kind):
+            return self._send(404, "text/plain", "not found")
+
+        headers = {}
+        if kind == "organisation":
+            data, total = ds.organisation(i, page, page_size)
+            headers = self._paging_headers(parsed.path, total, page, page_size)
+        else:
+            data = ds.detail(kind, i)
+
+        if xml:
+            # the JSON project record has no overview wrapper; the XML one does
+            if kind == "project":
+                body = to_xml(XML_ROOTS[kind], data)
+            else:
+                body = to_xml(XML_ROOTS[kind], data.values()[0] if kind == "organisation" else data)
+            return self._send(200, "application/xml", body, headers)
+        return self._send(200, "application/json", json.dumps(data), headers)
+
+    def _cerif(self, kind, uid):
+        ds = self.server.stub.dataset
+        if kind == "cfclass":
+            return self._send(200, "application/json", json.dumps(ds.cerif_classes()))
+        if kind == "cfproj":
+            if uid == "":
+                # listing of CERIF projects
+                parsed = urlparse.urlparse(self.path)
+                params = dict(urlparse.parse_qsl(parsed.query))
+                page = max(int(params.get("page", 1)), 1)
+                page_size = min(max(int(params.get("fetchSize", 25)), 1), 100)
+                total = ds.count("project")
+                start = (page - 1) * page_size
+                data = {"cfClassOrCfClassSchemeOrCfClassSchemeDescr" :
+                            [ds.cerif_project(i) for i in range(start, min(start + page_size, total))]}
+                return self._send(200, "application/json", json.dumps(data),
+                                    self._paging_headers(parsed.path, total, page, page_size))
+            i = index_of(uid)
+            if i is None or i >= ds.count("project"):
+                return self._send(404, "text/plain", "not found")
+            data = {"cfClassOrCfClassSchemeOrCfClassSchemeDescr" : [ds.cerif_project(i)]}
+            return self._send(200, "application/json", json.dumps(data))
+        return self._send(404, "text/plain", "not found")
+
+    def _paging_headers(self, path, total, page, page_size):
+        pages = _pages(total, page_size)
+        base = self.server.stub.base_url + path
+        def link(p, rel):
+            return "<" + base + "?page=" + str(p) + "&fetchSize=" + str(page_size) + ">; rel=" + rel
+        links = [link(1, "first")]
+        if page > 1:
+            links.append(link(page - 1, "previous"))
+        if page < pages:
+            links.append(link(page + 1, "next"))
+        links.append(link(pages, "last"))
+        return {"link" : ", ".join(links), "link-records" : str(total), "link-pages" : str(pages)}
+
+    def _send(self, status, content_type, body, headers=None):
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        encoding = None
+        if self.server.stub.compress:
+            accepted = [e.split(";")[0].strip() for e in self.headers.get("Accept-Encoding", "").split(",")]
+            if "gzip" in accepted:
+                encoding = "gzip"
+                c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                body = c.compress(body) + c.flush()
+            elif "deflate" in accepted:
+                encoding = "deflate"
+                body = zlib.compress(body, 6)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        for k, v in (headers or {}).iteritems():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stub._count_bytes(len(body))
+
+def _pages(total, page_size):
+    return max((total + page_size - 1) // page_size, 1)
+
+class _ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients hang up on responses they no longer want (e.g. the losers of hedged
+        # requests), which is not worth a traceback; nor is an error while the interpreter
+        # is shutting down (when the modules have gone)
+        if sys is None or isinstance(sys.exc_info()[1], socket.error):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+class StubServer(object):
+    """
+    run the stub API in a background thread.  latency is added to every response, plus
+    (if jitter is set) an exponentially distributed extra delay with that mean, and
+    error_rate is the fraction of requests which fail with a 503.  Responses are gzip or
+    deflate compressed if the client asks for it, unless compress is False.
+
+    If max_concurrency is set, requests beyond that many at once are refused with a 429,
+    with a Retry-After of retry_after seconds if that is given.  slow_rate is the fraction
+    of requests which take slow seconds longer, to give the latency a long tail
+    """
+    def __init__(self, projects=1000, organisations=None, people=None, publications=None,
+                    latency=0, jitter=0, error_rate=0, host="127.0.0.1", port=0, seed=0, compress=True,
+                    max_concurrency=None, retry_after=None, slow_rate=0, slow=2.0):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow = slow
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.throttled = 0
+        self.compress = compress
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._httpd = _ThreadedServer((host, port), _Handler)
+        self._httpd.stub = self
+        self.base_url = "http://%s:%d" % self._httpd.server_address
+        self.dataset = Dataset(projects, organisations, people, publications, self.base_url)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.throttled = 0
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _count_bytes(self, n):
+        with self._lock:
+            self.bytes_sent += n
+
+    def _enter(self):
+        with self._lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.throttled += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="serve synthetic GtR data locally")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--slow-rate", type=float, default=0)
+    parser.add_argument("--slow", type=float, default=2.0)
+    args = parser.parse_args()
+    server = StubServer(projects=args.projects, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, port=args.port, max_concurrency=args.max_concurrency,
+                        slow_rate=args.slow_rate, slow=args.slow)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,49 @@
+"""
+Micro-benchmark of the URL handling on the request hot path: building the paged request
+url in GtR._api, extracting the paging information from the response headers, and
+working out the current page and page size from it.
+
+    python -m benchmarks.urls [--number N]
+"""
+import argparse, timeit
+from gtr import urler
+from gtr.common import GtR
+
+LIST_URL = "http://gtr.rcuk.ac.uk/project/"
+
+class _Response(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+def _link(page, rel):
+    return "<" + LIST_URL + "?page=" + str(page) + "&fetchSize=100>; rel=" + rel
+
+RESPONSE = _Response({
+    "link-records" : "31151",
+    "link-pages" : "312",
+    "link" : ", ".join([_link(1, "first"), _link(40, "previous"), _link(42, "next"), _link(312, "last")])
+})
+
+def run(number=100000):
+    client = GtR("http://gtr.rcuk.ac.uk")
+    paging = client._extract_paging(RESPONSE)
+    cases = [
+        ("set_query_params", lambda: urler.set_query_params(LIST_URL, [("page", 41), ("fetchSize", 100)])),
+        ("set_query_param x2", lambda: urler.set_query_param(urler.set_query_param(LIST_URL, "page", 41), "fetchSize", 100)),
+        ("_extract_paging", lambda: client._extract_paging(RESPONSE)),
+        ("current_page (cached)", lambda: paging.current_page()),
+        ("current_page (fresh)", lambda: client._extract_paging(RESPONSE).current_page()),
+        ("current_page_size (fresh)", lambda: client._extract_paging(RESPONSE).current_page_size())
+    ]
+    results = {}
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=3))
+        results[name] = best / number * 1e6
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--number", type=int, default=100000, help="calls per timing run")
+    args = parser.parse_args()
+    for name, usec in sorted(run(args.number).items()):
+        print("%-28s %8.2f us/call" % (name, usec))
@@ -1,9 +1,21 @@
-from common import GtR, Paging, MIME_MAP
+from common import GtR, Paging, Paged, MIME_MAP
 import urler
+import os, threading, time
+from lazy import LazyModule
+
+json = LazyModule("json")
+tempfile = LazyModule("tempfile")
+
+CERIF_NS = "{urn:xmlns:org:eurocris:cerif-1.5-1}"
+TERM_RELATION = CERIF_NS + "cfTerm"
+PROJ_ORGUNIT_RELATION = CERIF_NS + "cfProj_OrgUnit"
 
 class GtRCerif(GtR):
-    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None):
-        super(GtRCerif, self).__init__(base_url, page_size, serialisation, username, password)
+    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None,
+                    class_cache_path=None, class_cache_ttl=86400, warm_class_cache=True, stats=None, hooks=None,
+                    compression=True, keep_bodies=0, transport=None, limiter=None, hedge=None):
+        super(GtRCerif, self).__init__(base_url, page_size, serialisation, username, password, stats, hooks,
+                                        compression, keep_bodies, transport, limiter, hedge)
         
         self.factory = CerifDAOFactory()
         
@@ -19,9 +31,27 @@ class GtRCerif(GtR):
         self.product_base = self.base_url + "/cerif/cfresprod/"
         self.publications_base = self.base_url + "/cerif/cfrespubl/"
         
-        self.class_cache = None
+        # the class cache is warmed in the background when the client is first used, rather
+        # than when it is made, so that a client which is never used makes no requests
+        self.class_cache = CerifClassCache(self._load_classes, class_cache_path, class_cache_ttl)
+        self._warm_pending = warm_class_cache
+    
+    def _first_use(self):
+        if self._warm_pending:
+            self._warm_pending = False
+            self.class_cache.warm()
         
+    def projects(self, page=None, page_size=None):
+        self._first_use()
+        page_size = self._constrain_page_size(page_size)
+        page_size = page_size if page_size is not None else self.page_size
+        data, paging = self._api(self.project_base, page=page, page_size=page_size)
+        if data is not None and paging is not None:
+            return Projects(self, data, paging, self.project_base)
+        return None
+    
     def project(self, uuid):
+        self._first_use()
         url = self.project_base + uuid
         raw, _ = self._api(url)
         if raw is not None:
@@ -29,27 +59,172 @@ class GtRCerif(GtR):
         return None
         
     def cerif_class(self, uuid):
-        # load the class cache if necessary
-        if self.class_cache is None:
-            classes, _ = self._api(self.class_base)
-            cs = [c.get("cfClass") for c in classes.get("cfClassOrCfClassSchemeOrCfClassSchemeDescr", [])]
-            self.class_cache = {}
-            for c in cs:
-                self.class_cache[c.get("cfClassId")] = c
-            
-        # check the cache
-        if uuid in self.class_cache:
-            return CerifClass(self, self.class_cache[uuid])
+        raw = self.class_cache.get(uuid)
+        if raw is not None:
+            return CerifClass(self, raw)
         return None
+    
+    def cerif_term(self, uuid):
+        return self.class_cache.term(uuid)
         
     def cerif_classes(self):
-        if self.class_cache is None:
-            classes, _ = self._api(self.class_base)
-            cs = [c.get("cfClass") for c in classes.get("cfClassOrCfClassSchemeOrCfClassSchemeDescr", [])]
-            self.class_cache = {}
+        return self.class_cache.classes()
+    
+    def _load_classes(self):
+        classes, _ = self._api(self.class_base)
+        if classes is None:
+            return None
+        return [c.get("cfClass") for c in classes.get("cfClassOrCfClassSchemeOrCfClassSchemeDescr", [])]
+
+class CerifClassCache(object):
+    """
+    Thread-safe cache of the full CERIF class listing, indexed by class id, along with
+    the precomputed term for each class.
+    
+    If a path is provided the cache is persisted there, and subsequent processes will
+    use the file rather than the API until it is older than the ttl (in seconds)
+    
+    If the listing cannot be loaded, no further attempt is made for retry_delay seconds,
+    doubling with each failure up to max_retry_delay, and lookups are answered from any
+    stale data in the meantime (or with None)
+    """
+    
+    version = 1
+    
+    def __init__(self, loader, path=None, ttl=86400, retry_delay=5, max_retry_delay=300):
+        self.loader = loader
+        self.path = path
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._classes = None
+        self._terms = None
+        self._created = None
+        self._retry_at = 0
+        self._failures = 0
+    
+    def warm(self):
+        """
+        populate the cache in a background thread, so that it is (usually) ready
+        by the time the first lookup is made
+        """
+        t = threading.Thread(target=self._warm)
+        t.daemon = True
+        t.start()
+        return t
+    
+    def _warm(self):
+        try:
+            self._ensure()
+        except Exception:
+            pass # the failure is remembered, and the first lookup will try again when it is due
+    
+    def get(self, uuid):
+        self._ensure()
+        if self._classes is None:
+            return None
+        return self._classes.get(uuid)
+    
+    def term(self, uuid):
+        self._ensure()
+        if self._terms is None:
+            return None
+        return self._terms.get(uuid)
+    
+    def classes(self):
+        self._ensure()
+        return self._classes
+    
+    def invalidate(self):
+        with self._lock:
+            self._classes = None
+            self._terms = None
+            self._created = None
+            self._retry_at = 0
+            self._failures = 0
+    
+    def _expired(self, created):
+        if created is None:
+            return True
+        return self.ttl is not None and created + self.ttl < time.time()
+    
+    def _fresh(self):
+        if self._classes is not None and not self._expired(self._created):
+            return True
+        # after a failed load, make do with what we have until the next attempt is due
+        return time.time() < self._retry_at
+    
+    def _ensure(self):
+        if self._fresh():
+            return
+        with self._lock:
+            # another thread may have loaded the cache while we waited for the lock
+            if self._fresh():
+                return
+            if self._read():
+                return
+            try:
+                cs = self.loader()
+            except Exception:
+                self._failed()
+                raise
+            if cs is None:
+                self._failed() # leave any stale data in place, and try again later
+                return
+            self._failures = 0
+            self._retry_at = 0
+            classes = {}
             for c in cs:
-                self.class_cache[c.get("cfClassId")] = c
-        return self.class_cache
+                if c is not None:
+                    classes[c.get("cfClassId")] = c
+            self._set(classes, dict([(k, _class_term(v)) for k, v in classes.iteritems()]), time.time())
+            self._write()
+    
+    def _failed(self):
+        self._failures += 1
+        delay = min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+        self._retry_at = time.time() + delay
+    
+    def _set(self, classes, terms, created):
+        # classes last, so that a lock-free reader never sees classes without terms
+        self._terms = terms
+        self._created = created
+        self._classes = classes
+    
+    def _read(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if data.get("version") != self.version or self._expired(data.get("created", 0)):
+            return False
+        self._set(data.get("classes", {}), data.get("terms", {}), data.get("created"))
+        return True
+    
+    def _write(self):
+        if self.path is None:
+            return
+        data = {"version" : self.version, "created" : self._created, "classes" : self._classes, "terms" : self._terms}
+        # write to a temporary file and move it into place, so readers never see a partial cache
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+def _class_term(raw):
+    for data in raw.get("cfDescrOrCfDescrSrcOrCfTerm", []):
+        rel = data.get("JAXBElement", {})
+        if rel.get("name") == TERM_RELATION:
+            return rel.get("value", {}).get("value")
+    return None
 
 class CerifDAOFactory(object):
     def __init__(self):
@@ -65,7 +240,7 @@ class CerifDAOFactory(object):
             #    "publication" : PublicationXMLDAO
             },
             "application/json" : {
-            #    "projects" : ProjectsJSONDAO,
+                "projects" : ProjectsJSONDAO,
             #    "organisations" : OrganisationsJSONDAO,
             #    "people" : PeopleJSONDAO,
             #    "publications" : PublicationsJSONDAO,
@@ -118,6 +293,37 @@ class CerifObject(object):
     def as_dict(self):
         return self.dao.raw
 
+class CerifPaged(CerifObject, Paged):
+    def __init__(self, client, paging):
+        self.client = client
+        self.dao = None
+        self.paging = paging
+
+class Projects(CerifPaged):
+    def __init__(self, client, raw, paging, url, dao=None):
+        super(Projects, self).__init__(client, paging)
+        self.dao = dao if dao is not None else client.factory.projects(client, raw)
+        self._url = url
+    
+    def url(self):
+        return self._url
+    
+    def projects(self):
+        return self.dao.projects(self.client)
+    
+    def list_elements(self):
+        return self.projects()
+
+class ProjectsJSONDAO(object):
+    def __init__(self, raw):
+        self.raw = raw
+    
+    def projects(self, client):
+        # each project in the listing is re-rooted so that it looks like an individual project record
+        return [Project(client, {"cfClassOrCfClassSchemeOrCfClassSchemeDescr" : [data]})
+                    for data in self.raw.get("cfClassOrCfClassSchemeOrCfClassSchemeDescr", [])
+                    if "cfProj" in data]
+
 class Project(CerifObject):
     def __init__(self, client, raw, dao=None):
         # super(Project, self).__init__(client)
@@ -128,7 +334,7 @@ class Project(CerifObject):
     def url(self): return self.dao.url()
     
     def org_cerif_relations(self, org_id=None):
-        return self.dao.cerif_relations(self.client, name="{urn:xmlns:org:eurocris:cerif-1.5-1}cfProj_OrgUnit", cfOrgUnitId=org_id)
+        return self.dao.cerif_relations(self.client, name=PROJ_ORGUNIT_RELATION, cfOrgUnitId=org_id)
         
 
 class ProjectXMLDAO(object):
@@ -138,6 +344,7 @@ class ProjectXMLDAO(object):
 class ProjectJSONDAO(object):
     def __init__(self, raw):
         self.raw = raw
+        self._index = None
     
     def id(self):
         return self.raw.get("cfClassOrCfClassSchemeOrCfClassSchemeDescr", [{}])[0].get("cfProj", {}).get("cfProjId")
@@ -154,24 +361,16 @@ class ProjectJSONDAO(object):
         if len(root) == 0:
             return None
         
-        proj = root[0].get("cfProj", {})
-        
-        def member(data, name, cfOrgUnitId=None):
-            name_match = False
-            if data.get("JAXBElement", {}).get("name") == name:
-                name_match = True
-            
-            org_match = False
-            if cfOrgUnitId is not None and data.get("JAXBElement", {}).get("value", {}).get("cfOrgUnitId") == cfOrgUnitId:
-                org_match = True
-            elif cfOrgUnitId is None:
-                org_match = True
-            
-            return name_match and org_match
-            
-        return [CerifRelation(client, data.get("JAXBElement", {})) 
-                    for data in proj.get("cfTitleOrCfAbstrOrCfKeyw", []) 
-                    if member(data, name, cfOrgUnitId)]
+        index = self._relation_index(client, root[0].get("cfProj", {}))
+        return index.lookup(name, cfOrgUnitId)
+    
+    def _relation_index(self, client, proj):
+        # built once per record; rebuilt only if the raw data is replaced
+        index = self._index
+        if index is None or index.source is not self.raw:
+            index = RelationIndex(client, self.raw, proj.get("cfTitleOrCfAbstrOrCfKeyw", []), "cfOrgUnitId")
+            self._index = index
+        return index
 
 class CerifRelation(CerifObject):
     def __init__(self, client, raw, dao=None):
@@ -214,17 +413,22 @@ class CerifClass(CerifObject):
     def id(self): return self.dao.id()
     
     def term(self):
+        # the client's class cache holds precomputed terms for all known classes
+        term = self.client.cerif_term(self.id())
+        if term is not None:
+            return term
         rels = self.term_cerif_relations()
         if len(rels) == 0:
             return None
         return rels[0].value()
     
     def term_cerif_relations(self):
-        return self.dao.cerif_relations(self.client, name="{urn:xmlns:org:eurocris:cerif-1.5-1}cfTerm")
+        return self.dao.cerif_relations(self.client, name=TERM_RELATION)
     
 class CerifClassJSONDAO(object):
     def __init__(self, raw):
         self.raw = raw
+        self._index = None
       
     def id(self):
         return self.raw.get("cfClassId")
@@ -236,9 +440,37 @@ class CerifClassJSONDAO(object):
         if name is None:
             return None
         
-        return [CerifRelation(client, data.get("JAXBElement", {})) 
-                    for data in self.raw.get("cfDescrOrCfDescrSrcOrCfTerm", []) 
-                    if data.get("JAXBElement", {}).get("name") == name]
+        index = self._index
+        if index is None or index.source is not self.raw:
+            index = RelationIndex(client, self.raw, self.raw.get("cfDescrOrCfDescrSrcOrCfTerm", []))
+            self._index = index
+        return index.lookup(name)
+
+class RelationIndex(object):
+    """
+    index of the CerifRelation objects in a record's list of JAXB elements, by
+    relation name and (optionally) by the value of one of the relations' fields
+    """
+    def __init__(self, client, source, elements, key_field=None):
+        self.source = source
+        self.by_name = {}
+        self.by_key = {}
+        for data in elements:
+            rel = data.get("JAXBElement")
+            if rel is None:
+                continue
+            wrapper = CerifRelation(client, rel)
+            name = rel.get("name")
+            self.by_name.setdefault(name, []).append(wrapper)
+            if key_field is not None:
+                key = rel.get("value", {}).get(key_field)
+                if key is not None:
+                    self.by_key.setdefault((name, key), []).append(wrapper)
+    
+    def lookup(self, name, key=None):
+        if key is None:
+            return list(self.by_name.get(name, []))
+        return list(self.by_key.get((name, key), []))
 
     
     
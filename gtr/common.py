@@ -1,54 +1,216 @@
-import requests, json
+import threading, time
 import urler
+from lazy import LazyModule
+from instrument import Hooks, ClientStats
+from compression import ACCEPT_ENCODING, BodyCache
+from transport import RequestsTransport
+from limiter import AdaptiveLimiter
+from hedge import Hedger
+
+# the XML stack is loaded on the first XML response
+json = LazyModule("json")
+etree = LazyModule("lxml.etree")
+copy = LazyModule("copy")
 
 MIME_MAP = {"xml" : "application/xml", "json" : "application/json"}
 
 class GtR(object):
     
-    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None):
+    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None,
+                    stats=None, hooks=None, compression=True, keep_bodies=0, transport=None, limiter=None,
+                    hedge=None):
         self.base_url = base_url
         self.username = username
         self.password = password
         self.page_size = self._constrain_page_size(page_size)
         self.serialisation = serialisation if serialisation in ["xml", "json"] else "xml"
         self.mimetype = MIME_MAP.get(self.serialisation, "application/xml")
+        
+        # instrumentation: stats may be True, or a ClientStats object to share between clients
+        self.stats = ClientStats() if stats is True else (stats if stats else None)
+        self.hooks = hooks if hooks is not None else Hooks()
+        
+        self.inflight = SingleFlight(on_shared=self._coalesced)
+        
+        # negotiate compressed transfer, and optionally keep the most recent response bodies
+        # (compressed) for caching, mirroring or export
+        self.compression = compression
+        self.bodies = BodyCache(keep_bodies) if keep_bodies > 0 else None
+        
+        # the requests are made by the transport, which may record or replay them
+        self.transport = transport if transport is not None else RequestsTransport()
+        
+        # limiter may be True, or an AdaptiveLimiter to share between clients, in which case
+        # the number of requests in flight is adjusted to the API's latency and errors
+        self.limiter = AdaptiveLimiter() if limiter is True else (limiter if limiter else None)
+        if self.limiter is not None and self.limiter.stats is None:
+            self.limiter.stats = self.stats
+        
+        # hedge may be True, or a Hedger to share between clients, in which case a request
+        # which runs long is sent again, and the first response is used.  A shared hedger is
+        # closed by its owner, rather than by close()
+        self.hedger = Hedger() if hedge is True else (hedge if hedge else None)
+        self._own_hedger = hedge is True
+        if self.hedger is not None and self.hedger.stats is None:
+            self.hedger.stats = self.stats
     
-    def _api(self, rest_url, mimetype=None, page=None, page_size=None):
-        accept = self.mimetype
+    def close(self):
+        """
+        stop the threads of the hedger which this client created, if it did
+        """
+        if self._own_hedger:
+            self.hedger.close()
+    
+    def _coalesced(self):
+        if self.stats is not None:
+            self.stats.record_coalesced()
+    
+    def entity_type(self, url):
+        """
+        the type of entity addressed by an API url, as used to break down the client statistics
+        """
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else urler.URL(url).parsed_url.path
+        segments = [seg for seg in path.split("?", 1)[0].split("/") if seg != ""]
+        if len(segments) == 0:
+            return "unknown"
+        if segments[0] == "cerif" and len(segments) > 1:
+            return "cerif_" + segments[1]
+        return segments[0]
+    
+    def coalesced_requests(self):
+        """
+        the number of network requests which were saved by merging identical
+        in-flight calls to the API
+        """
+        return self.inflight.saved
+    
+    def raw_body(self, rest_url, mimetype=None, page=None, page_size=None):
+        """
+        the CompressedBody of a kept response (see keep_bodies), or None if it is not held
+        """
+        if self.bodies is None:
+            return None
+        return self.bodies.get((self._request_url(rest_url, page, page_size), self._accept(mimetype)))
+    
+    def _accept(self, mimetype):
         if mimetype is not None and mimetype in MIME_MAP.values():
-            accept = mimetype
-        headers = {"Accept" : accept}
-        
+            return mimetype
+        return self.mimetype
+    
+    def _request_url(self, rest_url, page, page_size):
+        params = []
         if page is not None:
-            rest_url = urler.set_query_param(rest_url, "page", page)
-        
+            params.append(("page", page))
         if page_size is not None:
-            rest_url = urler.set_query_param(rest_url, "fetchSize", page_size)
+            params.append(("fetchSize", page_size))
+        if len(params) > 0:
+            rest_url = urler.set_query_params(rest_url, params)
+        return rest_url
+    
+    def _api(self, rest_url, mimetype=None, page=None, page_size=None):
+        accept = self._accept(mimetype)
+        headers = {"Accept" : accept, "Accept-Encoding" : ACCEPT_ENCODING if self.compression else "identity"}
+        rest_url = self._request_url(rest_url, page, page_size)
+        
+        # identical concurrent requests share a single network call, and each gets its own
+        # copy of the parsed result, which the DAOs may change
+        return self.inflight.do((rest_url, accept), lambda: self._request(rest_url, headers, accept), _copy_parsed)
+    
+    def _api_body(self, rest_url, mimetype=None, page=None, page_size=None):
+        """
+        as _api, but returns the decoded body of the response unparsed, with its paging
+        """
+        accept = self._accept(mimetype)
+        headers = {"Accept" : accept, "Accept-Encoding" : ACCEPT_ENCODING if self.compression else "identity"}
+        rest_url = self._request_url(rest_url, page, page_size)
+        return self.inflight.do((rest_url, accept, "body"), lambda: self._request(rest_url, headers, accept, False))
+    
+    def _request(self, rest_url, headers, accept, parse=True):
+        # only pay for timing when somebody is listening
+        instrumented = self.stats is not None or self.hooks.active
+        if instrumented:
+            entity = self.entity_type(rest_url)
+            self.hooks.fire("before_request", {"url" : rest_url, "entity" : entity, "headers" : headers})
         
-        #print headers
-        #print rest_url
+        # wait for the concurrency limiter (if there is one) after the hooks, which may raise,
+        # and before the request is timed; _send releases the token
+        token = self.limiter.acquire() if self.limiter is not None else None
+        if instrumented:
+            start = time.time()
         
-        resp = None
-        if self.username is None:
-            resp = requests.get(rest_url, headers=headers)
-        else:
-            resp = requests.get(rest_url, headers=headers, auth=(self.username, self.password))
+        auth = (self.username, self.password) if self.username is not None else None
+        resp = self._send(rest_url, headers, auth, token)
         
-        #print resp
-        #print resp.status_code
+        body, content = None, ""
+        if resp is not None:
+            body, content = resp.body, resp.content
+        
+        if instrumented:
+            elapsed = time.time() - start
+            status = resp.status_code if resp is not None else None
+            nbytes = len(body) if body is not None else 0
+            if self.stats is not None:
+                self.stats.record_request(entity, status, nbytes, elapsed, len(content))
+            self.hooks.fire("after_request", {"url" : rest_url, "entity" : entity, "status" : status, 
+                                "bytes" : nbytes, "elapsed" : elapsed, "response" : resp, "body" : body})
         
         if resp is None or resp.status_code != 200:
             return None, None # FIXME: maybe raise an exception?
         
+        if self.bodies is not None:
+            self.bodies.put((rest_url, accept), body)
+        
+        if not parse:
+            return content, self._extract_paging(resp)
+        
+        if instrumented:
+            start = time.time()
+        
         data = None
         if accept == "application/xml":
-            data = etree.fromstring(resp.text.encode("utf-8"))
+            data = etree.fromstring(content)
         elif accept == "application/json":
-            data = json.loads(resp.text)
+            data = json.loads(content)
         
         paging = self._extract_paging(resp)
+        
+        if instrumented:
+            elapsed = time.time() - start
+            if self.stats is not None:
+                self.stats.record_parse(entity, elapsed)
+            self.hooks.fire("after_parse", {"url" : rest_url, "entity" : entity, "elapsed" : elapsed, "data" : data})
+        
         return data, paging
     
+    def _send(self, rest_url, headers, auth, token=None):
+        if self.hedger is None:
+            return self._attempt(rest_url, headers, auth, token)
+        # a hedge is only sent if the limiter will let it through straight away
+        permit = self.limiter.try_acquire if self.limiter is not None else None
+        return self.hedger.call(lambda t: self._attempt(rest_url, headers, auth, t), token, permit)
+    
+    def _attempt(self, rest_url, headers, auth, token=None):
+        if self.limiter is None:
+            return self.transport.get(rest_url, headers, auth)
+        start = time.time()
+        try:
+            resp = self.transport.get(rest_url, headers, auth)
+        except Exception:
+            self.limiter.release(token, None, time.time() - start)
+            raise
+        status = resp.status_code if resp is not None else None
+        retry_after = resp.headers.get("retry-after") if resp is not None else None
+        self.limiter.release(token, status, time.time() - start, retry_after)
+        return resp
+    
+    def record_callback(self, entity, record, elapsed):
+        """
+        report the time spent in a callback handling a record fetched by this client
+        """
+        if self.stats is not None:
+            self.stats.record_callback(entity, elapsed)
+        self.hooks.fire("after_callback", {"entity" : entity, "record" : record, "elapsed" : elapsed})
+    
     def _extract_paging(self, resp):
         try:
             record_count = int(resp.headers.get("link-records"))
@@ -64,19 +226,13 @@ class GtR(object):
         if record_count is None or pages is None or link_header is None:
             return None
         
-        bits = [tuple(p.split(";")) for p in link_header.split(",")]
-        fpnl = [None]*4
-        for bit in bits:
-            if bit[1].strip() == "rel=first":
-                fpnl[0] = bit[0].strip()[1:-1]
-            elif bit[1].strip() == "rel=previous":
-                fpnl[1] = bit[0].strip()[1:-1]
-            elif bit[1].strip() == "rel=next":
-                fpnl[2] = bit[0].strip()[1:-1]
-            elif bit[1].strip() == "rel=last":
-                fpnl[3] = bit[0].strip()[1:-1]
+        links = {}
+        for bit in link_header.split(","):
+            url, _, rel = bit.partition(";")
+            links[rel.strip()] = url.strip()[1:-1]
         
-        return Paging(record_count, pages, fpnl[0], fpnl[1], fpnl[2], fpnl[3])
+        return Paging(record_count, pages, links.get("rel=first"), links.get("rel=previous"), 
+                        links.get("rel=next"), links.get("rel=last"))
     
     def _constrain_page_size(self, page_size):
         if page_size is None:
@@ -87,6 +243,208 @@ class GtR(object):
             return 100
         return page_size
         
+class Paged(object):
+    """
+    paging behaviour shared by all the paged list objects.  Extending classes must
+    provide self.client, self.dao (with a raw attribute) and self.paging, and 
+    implement url() and list_elements()
+    """
+    
+    def record_count(self):
+        return self.paging.record_count
+    
+    def pages(self):
+        return self.paging.pages
+        
+    def next_page(self):
+        if self.paging.next is None or self.paging.next == "":
+            return False
+        raw, paging = self.client._api(self.paging.next)
+        if raw is not None and paging is not None:
+            self.dao.raw = raw
+            self.paging = paging
+            return True
+        return False
+    
+    def previous_page(self):
+        if self.paging.previous is None or self.paging.previous == "":
+            return False
+        raw, paging = self.client._api(self.paging.previous)
+        if raw is not None and paging is not None:
+            self.dao.raw = raw
+            self.paging = paging
+            return True
+        return False
+        
+    def first_page(self):
+        if self.paging.first is None or self.paging.first == "":
+            return False
+        raw, paging = self.client._api(self.paging.first)
+        if raw is not None and paging is not None:
+            self.dao.raw = raw
+            self.paging = paging
+            return True
+        return False
+        
+    def last_page(self):
+        if self.paging.last is None or self.paging.last == "":
+            return False
+        raw, paging = self.client._api(self.paging.last)
+        if raw is not None and paging is not None:
+            self.dao.raw = raw
+            self.paging = paging
+            return True
+        return False
+    
+    def skip_to_page(self, page):
+        if self.paging.last is None or self.paging.last == "":
+            return False
+        if page > self.paging.pages:
+            return False
+        if page < 1:
+            return False
+        raw, paging = self.client._api(self.url(), page=page)
+        if raw is not None and paging is not None:
+            self.dao.raw = raw
+            self.paging = paging
+            return True
+        return False
+    
+    def current_page(self):
+        return self.paging.current_page()
+        
+    def current_page_size(self):
+        return self.paging.current_page_size()
+        
+    def list_elements(self):
+        """
+        subclass should implement this to return a list of Native objects.
+        It will be used to run the iterator
+        """
+        raise NotImplementedError("list_elements has not been implemented")
+    
+    def __iter__(self):
+        return self.iterator()
+    
+    def iterator(self, reset_pages=True, stop_at_page_boundary=False):
+        pages = self.page_iterator(reset_pages, stop_at_page_boundary)
+        def f():
+            for elements in pages:
+                for p in elements:
+                    yield p
+        return f()
+    
+    def page_iterator(self, reset_pages=True, stop_at_page_boundary=False):
+        """
+        iterate over the list a page at a time, yielding the list of elements on each page
+        """
+        if reset_pages:
+            self.first_page()
+        def f():
+            while True:
+                yield self.list_elements()
+                if stop_at_page_boundary:
+                    break
+                if not self.next_page():
+                    break
+        return f()
+        
+    def iter_raw_pages(self, reset_pages=True, stop_at_page_boundary=False):
+        """
+        iterate over the raw data (a dict or an XML element) of each page of the list, with
+        the page's Paging.  Nothing is built from the data, and the list object stays on the
+        page it was on, so no reference is kept to a page once the next one is requested
+        """
+        if reset_pages and self.current_page() != 1 and self.paging.first:
+            raw, paging = self.client._api(self.paging.first)
+        else:
+            raw, paging = self.dao.raw, self.paging
+        while raw is not None and paging is not None:
+            next_url = paging.next
+            yield raw, paging
+            raw, paging = None, None
+            if stop_at_page_boundary or next_url is None or next_url == "":
+                break
+            raw, paging = self.client._api(next_url)
+    
+    def __len__(self):
+        return self.record_count()
+
+class SingleFlight(object):
+    """
+    coalesces identical in-flight calls: while a call for a given key is running, any
+    other thread asking for the same key waits for it and receives its result, rather
+    than making the call again.
+
+    If do() is given a copy function, each of the waiters receives its own copy of the
+    result, so that none of them sees another's changes to it.  The copies are taken from
+    one made before the caller gets the result, and only when there are waiters
+    """
+    def __init__(self, on_shared=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.saved = 0
+        self.on_shared = on_shared
+    
+    def do(self, key, fn, copy=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+                self.saved += 1
+        
+        if not leader:
+            if self.on_shared is not None:
+                self.on_shared()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy(call.result) if copy is not None else call.result
+        
+        result = None
+        try:
+            result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            # the waiters copy from a copy of their own, which the caller cannot change
+            if waiters > 0 and copy is not None and call.error is None:
+                try:
+                    call.result = copy(result)
+                except Exception as e:
+                    call.error = e
+            else:
+                call.result = result
+            call.done.set()
+        return result
+    
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+def _copy_parsed(result):
+    """
+    a copy of the parsed data of an _api result (the paging is not changed by its users,
+    so is shared)
+    """
+    data, paging = result
+    return copy.deepcopy(data), paging
+
 class Paging(object):
     def __init__(self, record_count, pages, first, previous, next, last):
         self.record_count = record_count
@@ -96,7 +454,21 @@ class Paging(object):
         self.next = next
         self.last = last
         
+        # the page number and page size are worked out from the links on first request
+        self._page = None
+        self._page_size = None
+        
     def current_page(self):
+        if self._page is None:
+            self._page = self._current_page()
+        return self._page
+    
+    def current_page_size(self):
+        if self._page_size is None:
+            self._page_size = self._current_page_size()
+        return self._page_size
+    
+    def _current_page(self):
         # oddly, we have to work this out by looking at the previous and next pages
         # although the JSON serialisation does actually provide this as part of
         # the data, the XML serialisation does not, so this is suitably general
@@ -119,7 +491,7 @@ class Paging(object):
         
         return -1
         
-    def current_page_size(self):
+    def _current_page_size(self):
         try:
             if self.first is not None and self.first != "":
                 fetch_size = urler.get_query_param(self.first, "fetchSize")
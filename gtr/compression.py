@@ -0,0 +1,142 @@
+import zlib, threading
+from collections import OrderedDict
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+class CompressedBody(object):
+    """
+    A response body held in compressed form, and only decompressed when it is accessed
+    """
+    __slots__ = ("data", "encoding", "size")
+
+    def __init__(self, data, encoding="identity", size=None):
+        self.data = data
+        self.encoding = encoding
+        self.size = size
+
+    @classmethod
+    def compress(cls, content, level=6):
+        """
+        compress a decoded body (with zlib, which is cheaper to undo than gzip)
+        """
+        return cls(zlib.compress(content, level), "deflate", len(content))
+
+    def bytes(self):
+        if self.encoding == "identity":
+            return self.data
+        return decompress(self.data, self.encoding)
+
+    def text(self, charset="utf-8"):
+        return self.bytes().decode(charset)
+
+    def compressed(self):
+        """
+        this body, compressed if it is not already
+        """
+        if self.encoding != "identity":
+            return self
+        return CompressedBody.compress(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+class BodyCache(object):
+    """
+    A thread-safe LRU cache of compressed response bodies, keyed by request url and
+    Accept type
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, body):
+        body = body.compressed()
+        with self._lock:
+            self._bodies.pop(key, None)
+            self._bodies[key] = body
+            while len(self._bodies) > self.capacity:
+                self._bodies.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.pop(key, None)
+            if body is not None:
+                self._bodies[key] = body
+            return body
+
+    def compressed_size(self):
+        with self._lock:
+            return sum([len(b) for b in self._bodies.values()])
+
+    def decompressed_size(self):
+        with self._lock:
+            return sum([b.size if b.size is not None else len(b.bytes()) for b in self._bodies.values()])
+
+    def __len__(self):
+        return len(self._bodies)
+
+def decoder(encoding):
+    """
+    an incremental decompressor for the given content-encoding, or None for identity
+    """
+    if encoding == "gzip" or encoding == "x-gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _DeflateDecoder()
+    return None
+
+def decompress(data, encoding):
+    d = decoder(encoding)
+    if d is None:
+        return data
+    return d.decompress(data) + d.flush()
+
+class _DeflateDecoder(object):
+    """
+    "deflate" bodies are meant to be zlib-wrapped, but some servers send raw deflate
+    streams; decide which from the first bytes
+    """
+    def __init__(self):
+        self._d = None
+        self._head = ""
+
+    def decompress(self, chunk):
+        if self._d is None:
+            self._head += chunk
+            if len(self._head) < 2:
+                return ""
+            b0, b1 = ord(self._head[0]), ord(self._head[1])
+            zlib_wrapped = b0 & 0x0f == 8 and (b0 * 256 + b1) % 31 == 0
+            self._d = zlib.decompressobj(zlib.MAX_WBITS if zlib_wrapped else -zlib.MAX_WBITS)
+            chunk, self._head = self._head, ""
+        return self._d.decompress(chunk)
+
+    def flush(self):
+        if self._d is None:
+            return ""
+        return self._d.flush()
+
+def read_response(resp, chunk_size=65536):
+    """
+    read the body of a streamed requests response, decompressing it as it arrives.
+
+    returns a CompressedBody of the bytes as they came over the wire, and the decoded bytes
+    """
+    encoding = (resp.headers.get("content-encoding") or "identity").strip().lower()
+    d = decoder(encoding)
+    raw = []
+    content = []
+    while True:
+        chunk = resp.raw.read(chunk_size, decode_content=False)
+        if not chunk:
+            break
+        raw.append(chunk)
+        if d is not None:
+            content.append(d.decompress(chunk))
+    if d is None:
+        decoded = "".join(raw)
+        return CompressedBody(decoded, "identity", len(decoded)), decoded
+    content.append(d.flush())
+    decoded = "".join(content)
+    return CompressedBody("".join(raw), encoding, len(decoded)), decoded
@@ -0,0 +1,180 @@
+"""
+Local conversion between the native JSON structure of the GtR API and its gtr: XML
+namespace, so that either serialisation can be produced from data which has already
+been loaded, without going back to the API.
+"""
+from lazy import LazyModule
+
+etree = LazyModule("lxml.etree")
+
+GTR_NS = "http://gtr.rcuk.ac.uk/api"
+NSMAP = {"gtr" : GTR_NS}
+_NS = "{" + GTR_NS + "}"
+
+# the XML element which contains each repeated field
+CONTAINERS = {
+    "organisation" : "organisations",
+    "projectPerson" : "projectPeople",
+    "collaborator" : "collaborations",
+    "projectComposition" : "projectCompositions",
+    "projectRole" : "projectRoles"
+}
+_CONTAINED = dict([(v, k) for k, v in CONTAINERS.items()])
+
+# (parent, field) pairs which are lists, but which have no containing element in the XML
+UNCONTAINED_LISTS = set([("organisationOverview", "project")])
+
+# the XML root element for each type of entity, and whether the JSON also has it as its root key
+ROOTS = {
+    "project" : ("projectOverview", False),
+    "organisation" : ("organisationOverview", True),
+    "person" : ("personOverview", False),
+    "publication" : ("publicationOverview", False)
+}
+
+# the XML root element for each type of list, and the name of its members
+LISTS = {
+    "projects" : ("projects", "project"),
+    "organisations" : ("organisations", "organisation"),
+    "people" : ("people", "person"),
+    "publications" : ("publications", "publication")
+}
+
+# fields whose values are numeric in the JSON serialisation
+NUMERIC = set(["valuePounds", "page", "size", "totalPages", "totalSize"])
+
+ATTRIBUTES = set(["url"])
+
+## ------ JSON to XML ------- ##
+
+def to_xml(data, kind):
+    """
+    convert the raw JSON data for an entity (or a list page) of the given kind ("project",
+    "projects", ...) into a gtr: XML element
+    """
+    if kind in LISTS:
+        return page_to_xml(data, kind)
+    root_name, wrapped = ROOTS[kind]
+    root = _element(root_name)
+    if wrapped or (len(data) == 1 and root_name in data):
+        # records embedded in others (e.g. an organisation's projects) may also be rooted
+        # at the root element's name, when their type's JSON usually is not
+        content = data.get(root_name, {})
+    else:
+        content = data
+    _fields(root, root_name, content)
+    return root
+
+def page_to_xml(data, kind):
+    """
+    convert a whole page of a list in one go; scalar fields of the page (such as its size)
+    become attributes of the root element
+    """
+    root_name, member = LISTS[kind]
+    root = _element(root_name)
+    for k, v in data.items():
+        if k == member:
+            continue
+        if not isinstance(v, (dict, list)) and v is not None:
+            root.set(k, _text(v))
+    for item in data.get(member, []):
+        _add(root, root_name, member, item)
+    return root
+
+def _element(name):
+    return etree.Element(_NS + name, nsmap=NSMAP)
+
+def _fields(el, name, d):
+    for k, v in d.items():
+        if k in ATTRIBUTES and not isinstance(v, (dict, list)):
+            if v is not None:
+                el.set(k, _text(v))
+            continue
+        if isinstance(v, list):
+            parent = el
+            container = CONTAINERS.get(k)
+            if container is not None:
+                parent = etree.SubElement(el, _NS + container)
+            for item in v:
+                _add(parent, name, k, item)
+        else:
+            _add(el, name, k, v)
+
+def _add(parent, parent_name, name, value):
+    if value is None:
+        return
+    el = etree.SubElement(parent, _NS + name)
+    if isinstance(value, dict):
+        _fields(el, name, value)
+    else:
+        el.text = _text(value)
+
+def _text(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, basestring):
+        return value
+    return unicode(value)
+
+## ------ XML to JSON ------- ##
+
+def to_dict(el, kind):
+    """
+    convert a gtr: XML element for an entity (or a list page) of the given kind into the
+    structure of the native JSON serialisation
+    """
+    if kind in LISTS:
+        return page_to_dict(el, kind)
+    root_name, wrapped = ROOTS[kind]
+    content = _children(el, root_name)
+    if wrapped:
+        return {root_name : content}
+    return content
+
+def page_to_dict(el, kind):
+    _, member = LISTS[kind]
+    d = dict([(k, _value(k, v)) for k, v in el.attrib.items()])
+    d[member] = [_convert(child, member) for child in el if _local(child.tag) == member]
+    return d
+
+def _local(tag):
+    if not isinstance(tag, basestring):
+        return None # comments and processing instructions
+    return tag[tag.find("}") + 1:]
+
+def _convert(el, name):
+    if len(el) == 0 and len(el.attrib) == 0:
+        return _value(name, el.text)
+    return _children(el, name)
+
+def _children(el, name):
+    d = dict([(k, _value(k, v)) for k, v in el.attrib.items()])
+    for child in el:
+        child_name = _local(child.tag)
+        if child_name is None:
+            continue
+        member = _CONTAINED.get(child_name)
+        if member is not None:
+            d.setdefault(member, []).extend([_convert(c, member) for c in child if _local(c.tag) == member])
+        elif (name, child_name) in UNCONTAINED_LISTS:
+            d.setdefault(child_name, []).append(_convert(child, child_name))
+        else:
+            d[child_name] = _convert(child, child_name)
+    return d
+
+def _value(name, text):
+    if text is None:
+        return None
+    if text == "true":
+        return True
+    if text == "false":
+        return False
+    if name in NUMERIC:
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                pass
+    return text
@@ -0,0 +1,92 @@
+from collections import namedtuple
+import threading
+
+class FieldSet(object):
+    """
+    The named fields which can be extracted from one type of record, each described
+    by its path of keys from the root of the raw (JSON) data.
+
+    Extractors are compiled (and cached) for any subset of the fields, and will also
+    accept dotted paths (e.g. "projectComposition.project.fund.funder.name") in place
+    of field names; see record_type() for how they are named in the records
+    """
+    def __init__(self, record_name, fields):
+        self.record_name = record_name
+        self.fields = dict([(name, tuple(path)) for name, path in fields])
+        self.names = tuple([name for name, _ in fields])
+        self._extractors = {}
+        self._lock = threading.Lock()
+
+    def extractor(self, names=None):
+        key = self.names if names is None else tuple(names)
+        ex = self._extractors.get(key)
+        if ex is None:
+            with self._lock:
+                ex = self._extractors.get(key)
+                if ex is None:
+                    paths = [(name, self.fields.get(name, tuple(name.split(".")))) for name in key]
+                    ex = Extractor(self.record_name, paths)
+                    self._extractors[key] = ex
+        return ex
+
+    def extract(self, raw, names=None):
+        return self.extractor(names).extract(raw)
+
+class Extractor(object):
+    """
+    Pulls a fixed list of paths out of a nested dict in a single pass, into a compact
+    record (a namedtuple, so the values are available by name or by position).
+
+    The paths are compiled into a tree, so that paths which share a prefix only walk
+    that prefix once.  Any path which cannot be followed yields None
+    """
+    def __init__(self, record_name, paths):
+        self.names = tuple([name for name, _ in paths])
+        self.record = record_type(record_name, self.names)
+        self._size = len(paths)
+        self._tree = _compile([(i, path) for i, (_, path) in enumerate(paths)])
+
+    def extract(self, raw):
+        values = [None] * self._size
+        if isinstance(raw, dict):
+            _walk(self._tree, raw, values)
+        return self.record._make(values)
+
+def record_type(record_name, names):
+    """
+    the namedtuple class of the records with the given field names.  The dots in a dotted
+    path are replaced with underscores (so "lead.name" is the record's lead_name field), and
+    a ValueError is raised for any name which is still not a valid field name, or which
+    clashes with another
+    """
+    return namedtuple(record_name + "Record", [name.replace(".", "_") for name in names])
+
+def _compile(indexed_paths):
+    """
+    turn a list of (value index, path) into a tree of (key, indices of values which end at
+    this key, subtree) tuples
+    """
+    keys = []
+    grouped = {}
+    for i, path in indexed_paths:
+        if len(path) == 0:
+            continue
+        if path[0] not in grouped:
+            keys.append(path[0])
+            grouped[path[0]] = ([], [])
+        leaves, rest = grouped[path[0]]
+        if len(path) == 1:
+            leaves.append(i)
+        else:
+            rest.append((i, path[1:]))
+    return tuple([(k, tuple(grouped[k][0]), _compile(grouped[k][1])) for k in keys])
+
+def _walk(tree, data, values):
+    for key, leaves, subtree in tree:
+        v = data.get(key)
+        if v is None:
+            continue
+        for i in leaves:
+            values[i] = v
+        if subtree and isinstance(v, dict):
+            _walk(subtree, v, values)
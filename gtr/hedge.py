@@ -0,0 +1,269 @@
+import threading, time, Queue, atexit, weakref
+from collections import deque
+
+class Hedger(object):
+    """
+    Hedged requests, to cut the tail of the request latency: a request which has not been
+    answered after the given percentile of the recent request latencies (but at least
+    min_delay seconds) is sent again, and whichever response arrives first is used.  The
+    other request cannot be stopped once it is on the wire, so it is abandoned: its
+    response is thrown away when it arrives.
+
+    Hedges come out of a budget: each request earns budget hedges (so 0.1 allows at most
+    one hedge for every ten requests, give or take a burst of up to burst hedges), and a
+    hedge must also be let through by the client's limiter, if it has one, without waiting.
+    There is no hedging until min_samples latencies have been seen.
+
+    The requests (and their hedges) are run by a pool of up to workers threads, which 
+    should be at least twice the number of requests made at once; close() stops them, and
+    any hedger which is still open is closed at exit.
+
+    A hedge is won if its response is the one used, and lost otherwise; a hedge which was
+    due but refused by the budget or the limiter is counted as denied
+    """
+    def __init__(self, percentile=95, min_delay=0.05, budget=0.1, burst=10, history=1000, min_samples=20,
+                    stats=None, workers=32):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.stats = stats
+        self._latencies = deque([], history)
+        self._delay = None
+        self._stale = 0
+        self._credit = float(burst)
+        self._lock = threading.Lock()
+        self._workers = _Workers(workers)
+        self.requests = 0
+        self.sent = 0
+        self.won = 0
+        self.lost = 0
+        self.denied = 0
+
+    def delay(self):
+        """
+        how long a request may run before it is hedged, or None if there is not enough
+        history yet
+        """
+        with self._lock:
+            return self._current_delay()
+
+    def _current_delay(self):
+        if len(self._latencies) < max(self.min_samples, 1):
+            return None
+        # the percentile is recomputed as the history turns over, rather than on every request
+        if self._delay is None or self._stale >= max(len(self._latencies) // 20, 1):
+            ordered = sorted(self._latencies)
+            i = min(int(len(ordered) * self.percentile / 100.0), len(ordered) - 1)
+            self._delay = max(ordered[i], self.min_delay)
+            self._stale = 0
+        return self._delay
+
+    def _record(self, elapsed):
+        with self._lock:
+            self._latencies.append(elapsed)
+            self._stale += 1
+
+    def call(self, attempt, token=None, permit=None):
+        """
+        make a request with attempt(token), hedging it with attempt(permit()) if it runs
+        long.  permit (e.g. a limiter's try_acquire) returns the token for the hedge, or
+        None if it may not be sent; with no permit, only the budget applies
+        """
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self._credit + self.budget, self.burst)
+            delay = self._current_delay()
+        if delay is None:
+            start = time.time()
+            resp = attempt(token)
+            self._record(time.time() - start)
+            return resp
+
+        results = Queue.Queue()
+        self._start(attempt, token, results, False)
+        try:
+            return self._take(results, 1, delay)
+        except Queue.Empty:
+            pass
+
+        hedge_token = self._permit(permit)
+        if hedge_token is _DENIED:
+            return self._take(results, 1, None)
+        self._start(attempt, hedge_token, results, True)
+        return self._take(results, 2, None, hedged=True)
+
+    def _permit(self, permit):
+        with self._lock:
+            if self._credit < 1:
+                self._deny()
+                return _DENIED
+            token = permit() if permit is not None else None
+            if permit is not None and token is None:
+                self._deny()
+                return _DENIED
+            self._credit -= 1
+            self.sent += 1
+        return token
+
+    def _deny(self):
+        self.denied += 1
+        if self.stats is not None:
+            self.stats.record_hedge("denied")
+
+    def _start(self, attempt, token, results, hedge):
+        def run():
+            start = time.time()
+            try:
+                resp = attempt(token)
+            except Exception as e:
+                results.put((hedge, False, e))
+                return
+            self._record(time.time() - start)
+            results.put((hedge, True, resp))
+        self._workers.submit(run)
+
+    def _take(self, results, outstanding, timeout, hedged=False):
+        """
+        the first successful response of the outstanding requests, waiting at most timeout
+        seconds for the first of them (for ever if it is None).  If they all fail, the
+        first exception is raised
+        """
+        error = None
+        while outstanding > 0:
+            hedge, ok, value = _get(results, timeout)
+            timeout = None
+            outstanding -= 1
+            if ok:
+                if hedged:
+                    self._outcome("won" if hedge else "lost")
+                return value
+            if error is None:
+                error = value
+        if hedged:
+            self._outcome("lost")
+        raise error
+
+    def _outcome(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        if self.stats is not None:
+            self.stats.record_hedge(outcome)
+
+    def close(self):
+        """
+        stop the worker threads, once they have finished their requests
+        """
+        self._workers.close()
+    
+    def report(self):
+        with self._lock:
+            return {
+                "delay" : self._delay,
+                "requests" : self.requests,
+                "sent" : self.sent,
+                "won" : self.won,
+                "lost" : self.lost,
+                "denied" : self.denied
+            }
+
+# returned by _permit when a hedge may not be sent (None is a valid token)
+_DENIED = object()
+
+# the longest single wait on a queue, so that a waiting thread still sees KeyboardInterrupt
+_POLL = 0.5
+
+def _get(q, timeout=None):
+    """
+    the next item on the queue, waiting at most timeout seconds (for ever if it is None)
+    a little at a time; raises Queue.Empty if the time runs out
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        wait = _POLL if deadline is None else min(_POLL, deadline - time.time())
+        if wait <= 0:
+            raise Queue.Empty()
+        try:
+            return q.get(timeout=wait)
+        except Queue.Empty:
+            pass
+
+class _Workers(object):
+    """
+    a bounded pool of daemon threads to run the hedged requests, kept between requests
+    rather than started for each one.  Threads are started as they are needed, up to size
+    of them; beyond that, requests wait for a thread.  The threads run until close(), which
+    is also called at exit
+    """
+    def __init__(self, size=32):
+        self.size = max(size, 1)
+        self._tasks = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+        self._queued = 0
+        self._closed = False
+        _open.add(self)
+    
+    def submit(self, fn):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the hedger has been closed")
+            self._queued += 1
+            # each queued task needs a thread which is, or will soon be, waiting for it
+            if self._queued > self._idle and len(self._threads) < self.size:
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+                self._threads.append(t)
+                self._idle += 1
+                t.start()
+        self._tasks.put(fn)
+    
+    def close(self, timeout=None):
+        """
+        stop the threads, once they have finished the requests already submitted, waiting
+        at most timeout seconds (for ever if it is None) for them
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for t in threads:
+            self._tasks.put(_STOP)
+        deadline = time.time() + timeout if timeout is not None else None
+        current = threading.current_thread()
+        for t in threads:
+            if t is not current:
+                t.join(max(deadline - time.time(), 0) if deadline is not None else None)
+        _open.discard(self)
+    
+    def _run(self):
+        while True:
+            # a blocking get, with no timeout to poll, so the waiting threads are left alone
+            # (not woken to fail on a half torn down interpreter) at exit
+            fn = self._tasks.get()
+            if fn is _STOP:
+                return
+            with self._lock:
+                self._idle -= 1
+                self._queued -= 1
+            try:
+                fn()
+            finally:
+                with self._lock:
+                    self._idle += 1
+
+# put on the queue to stop a worker thread
+_STOP = object()
+
+# the pools which are still running, to close at exit (without waiting long for any 
+# requests which are still running)
+_open = weakref.WeakSet()
+
+def _close_all():
+    for workers in list(_open):
+        workers.close(timeout=5)
+
+atexit.register(_close_all)
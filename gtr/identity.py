@@ -0,0 +1,133 @@
+import threading
+
+class IdentityMap(object):
+    """
+    A thread-safe map of canonical entities, one per (type, id, fingerprint of the embedded
+    data), to be shared by every record which embeds the same entity (e.g. the funder or
+    lead organisation of a project).
+
+    An entity is only shared between records which embed identical data for it (so, for
+    example, a person who has different roles on two projects is not shared between
+    them).  When a record is built, intern() swaps each of its embedded dicts for the
+    canonical copy, so the records hold one copy of the data between them, and the
+    canonical entity is then found by the identity of that copy, without comparing or
+    fingerprinting the data again.
+
+    The canonical data and entities are held until clear(), so they are shared across
+    calls and clients for as long as the map is.
+
+    A shared entity is the same object for every record which holds it, so anything which
+    changes it is seen by all of them: in particular, fetch() on a shared entity gives
+    every holder the fetched data (without the relation information from their own
+    records).  Once it has been fetched (or its data otherwise replaced), it is no longer
+    handed out, and the next record to ask gets a new entity built from the embedded data
+    """
+    def __init__(self):
+        # key -> [data, entity, the entity's raw data when it was built]
+        self._canonical = {}
+        # id() of each canonical dict -> its key; the dicts are held, so the ids are stable
+        self._keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.interned = 0
+
+    def intern(self, kind, data):
+        """
+        the canonical copy of the given embedded data (which is equal to it), to use in
+        its place
+        """
+        if not isinstance(data, dict) or data.get("id") is None:
+            return data
+        with self._lock:
+            key, slot = self._slot(kind, data)
+            if key is None:
+                return data
+            if slot is None:
+                self._add(key, data)
+                return data
+            if slot[0] is not data:
+                self.interned += 1
+            return slot[0]
+
+    def get(self, kind, id, data, build):
+        """
+        the canonical entity of the given kind and id for the given data; if there is none
+        (or it has been fetched since), build() a new one, which becomes canonical
+        """
+        if id is None or not isinstance(data, dict):
+            return build()
+        with self._lock:
+            key, slot = self._slot(kind, data)
+            if key is None:
+                return build()
+            if slot is not None and _current(slot):
+                self.hits += 1
+                return slot[1]
+            self.misses += 1
+
+        entity = build()
+        with self._lock:
+            slot = self._canonical.get(key)
+            if slot is None:
+                slot = self._add(key, data)
+            elif _current(slot):
+                return slot[1]
+            slot[1] = entity
+            slot[2] = _raw(entity)
+        return entity
+
+    def _slot(self, kind, data):
+        """
+        the key and slot (None if there is none yet) for the data: found by identity if it
+        is a canonical copy, and otherwise by fingerprint.  The key is None if the data
+        clashes with the canonical data for its fingerprint, and so cannot be shared
+        """
+        key = self._keys.get(id(data))
+        if key is not None:
+            return key, self._canonical[key]
+        key = (kind, data.get("id"), _fingerprint(data))
+        slot = self._canonical.get(key)
+        if slot is not None and slot[0] != data:
+            return None, None
+        return key, slot
+
+    def _add(self, key, data):
+        slot = [data, None, None]
+        self._canonical[key] = slot
+        self._keys[id(data)] = key
+        return slot
+
+    def clear(self):
+        with self._lock:
+            self._canonical.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entities" : len(self._canonical), "hits" : self.hits, "misses" : self.misses,
+                    "interned" : self.interned}
+
+    def __len__(self):
+        return len(self._canonical)
+
+def _current(slot):
+    # whether the slot's entity still has the raw data it was built with
+    return slot[1] is not None and _raw(slot[1]) is slot[2]
+
+def _raw(entity):
+    dao = getattr(entity, "dao", None)
+    return getattr(dao, "raw", None)
+
+def _fingerprint(data):
+    """
+    a hash of the embedded data, which does not depend on the order of its keys
+    """
+    return hash(_frozen(data))
+
+def _frozen(value):
+    if isinstance(value, dict):
+        return frozenset([(k, _frozen(v)) for k, v in value.items()])
+    if isinstance(value, list):
+        return tuple([_frozen(v) for v in value])
+    return value
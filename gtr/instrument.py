@@ -0,0 +1,178 @@
+import threading
+from collections import deque
+
+EVENTS = ("before_request", "after_request", "after_parse", "after_callback")
+
+class Hooks(object):
+    """
+    Registry of instrumentation hooks.  Each hook is a callable which is passed a dict of
+    information about the event:
+
+    before_request: url, entity, headers
+    after_request: url, entity, status, bytes, elapsed, response (a transport.Response, which
+        has already been read), body (a CompressedBody of the response as it came over the wire)
+    after_parse: url, entity, elapsed, data
+    after_callback: entity, record, elapsed
+
+    When no hooks are registered, firing an event costs a single attribute check
+    """
+    def __init__(self):
+        self._hooks = {}
+        self.active = False
+
+    def add(self, event, fn):
+        if event not in EVENTS:
+            raise ValueError("unknown hook event " + str(event))
+        self._hooks.setdefault(event, []).append(fn)
+        self.active = True
+
+    def remove(self, event, fn):
+        fns = self._hooks.get(event, [])
+        if fn in fns:
+            fns.remove(fn)
+        self.active = any([len(hooked) > 0 for hooked in self._hooks.values()])
+
+    def fire(self, event, info):
+        if not self.active:
+            return
+        for fn in self._hooks.get(event, []):
+            fn(info)
+
+class ClientStats(object):
+    """
+    Thread-safe statistics aggregated across all the requests made by one or more clients,
+    broken down by entity type (project, organisation, person, publication, cerif_cfproj, ...)
+    """
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._history = history
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+            self.decoded_bytes = 0
+            self.network_time = 0.0
+            self.parse_time = 0.0
+            self.callback_time = 0.0
+            self.coalesced = 0
+            self.status_codes = {}
+            self.entities = {}
+            self.concurrency_limit = None
+            self.concurrency_history = deque([], self._history)
+            self.hedges = {"sent" : 0, "won" : 0, "lost" : 0, "denied" : 0}
+
+    def _entity(self, entity):
+        e = self.entities.get(entity)
+        if e is None:
+            e = {"requests" : 0, "bytes" : 0, "decoded_bytes" : 0, "network_time" : 0.0, "parse_time" : 0.0,
+                    "callbacks" : 0, "callback_time" : 0.0}
+            self.entities[entity] = e
+        return e
+
+    def record_request(self, entity, status, nbytes, elapsed, decoded_bytes=None):
+        if decoded_bytes is None:
+            decoded_bytes = nbytes
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.decoded_bytes += decoded_bytes
+            self.network_time += elapsed
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+            e = self._entity(entity)
+            e["requests"] += 1
+            e["bytes"] += nbytes
+            e["decoded_bytes"] += decoded_bytes
+            e["network_time"] += elapsed
+
+    def record_parse(self, entity, elapsed):
+        with self._lock:
+            self.parse_time += elapsed
+            self._entity(entity)["parse_time"] += elapsed
+
+    def record_callback(self, entity, elapsed):
+        with self._lock:
+            self.callback_time += elapsed
+            e = self._entity(entity)
+            e["callbacks"] += 1
+            e["callback_time"] += elapsed
+
+    def record_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+    
+    def record_limit(self, limit, when):
+        """
+        record a change to the adaptive concurrency limit (see limiter.AdaptiveLimiter)
+        """
+        with self._lock:
+            self.concurrency_limit = limit
+            self.concurrency_history.append((when, limit))
+    
+    def record_hedge(self, outcome):
+        """
+        record the outcome of a hedged request (see hedge.Hedger): "won", "lost" or "denied"
+        """
+        with self._lock:
+            if outcome != "denied":
+                self.hedges["sent"] += 1
+            self.hedges[outcome] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests" : self.requests,
+                "bytes" : self.bytes,
+                "decoded_bytes" : self.decoded_bytes,
+                "network_time" : self.network_time,
+                "parse_time" : self.parse_time,
+                "callback_time" : self.callback_time,
+                "coalesced" : self.coalesced,
+                "status_codes" : dict(self.status_codes),
+                "entities" : dict([(k, dict(v)) for k, v in self.entities.items()]),
+                "concurrency_limit" : self.concurrency_limit,
+                "concurrency_history" : list(self.concurrency_history),
+                "hedges" : dict(self.hedges)
+            }
+
+    def prometheus(self, prefix="gtr"):
+        """
+        a snapshot of the statistics in the Prometheus text exposition format
+        """
+        d = self.as_dict()
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append("# HELP " + prefix + "_" + name + " " + help)
+            lines.append("# TYPE " + prefix + "_" + name + " " + kind)
+            for labels, value in samples:
+                label = ""
+                if len(labels) > 0:
+                    label = "{" + ",".join([k + '="' + str(v) + '"' for k, v in labels]) + "}"
+                lines.append(prefix + "_" + name + label + " " + repr(value))
+
+        entities = sorted(d["entities"].items())
+        metric("requests_total", "counter", "Requests made to the GtR API",
+                [((("entity", k),), v["requests"]) for k, v in entities])
+        metric("responses_total", "counter", "Responses from the GtR API by status code",
+                [((("code", k),), v) for k, v in sorted(d["status_codes"].items())])
+        metric("response_bytes_total", "counter", "Bytes received from the GtR API",
+                [((("entity", k),), v["bytes"]) for k, v in entities])
+        metric("response_decoded_bytes_total", "counter", "Bytes received from the GtR API, after decompression",
+                [((("entity", k),), v["decoded_bytes"]) for k, v in entities])
+        metric("network_seconds_total", "counter", "Time spent waiting on the GtR API",
+                [((("entity", k),), v["network_time"]) for k, v in entities])
+        metric("parse_seconds_total", "counter", "Time spent parsing responses",
+                [((("entity", k),), v["parse_time"]) for k, v in entities])
+        metric("callbacks_total", "counter", "Records passed to crawl callbacks",
+                [((("entity", k),), v["callbacks"]) for k, v in entities])
+        metric("callback_seconds_total", "counter", "Time spent in crawl callbacks",
+                [((("entity", k),), v["callback_time"]) for k, v in entities])
+        metric("coalesced_requests_total", "counter", "Requests saved by merging identical in-flight requests",
+                [((), d["coalesced"])])
+        if d["concurrency_limit"] is not None:
+            metric("concurrency_limit", "gauge", "The adaptive limit on concurrent requests to the GtR API",
+                    [((), d["concurrency_limit"])])
+        metric("hedged_requests_total", "counter", "Hedged requests to the GtR API by outcome",
+                [((("outcome", k),), v) for k, v in sorted(d["hedges"].items()) if k != "sent"])
+        return "\n".join(lines) + "\n"
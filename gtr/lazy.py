@@ -0,0 +1,56 @@
+import sys, threading
+
+class LazyModule(object):
+    """
+    Stands in for a module which is only imported when one of its attributes is first
+    used, so that (for example) JSON-only users never load the XML stack, and nothing
+    loads the HTTP transport until the first request is made.
+
+    Every attribute is looked up on the module when it is used, so a patch of the module
+    (e.g. mock.patch("requests.get")) is seen through the stand-in.  Once the module is
+    loaded, the stand-in puts it in its own place in the globals of the module which made
+    the stand-in, so the code there uses the module directly from then on, at no extra cost
+    """
+    def __init__(self, name):
+        # set through __dict__, as __setattr__ is passed on to the module
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+        # the globals of the module which made the stand-in
+        self.__dict__["_owner"] = sys._getframe(1).f_globals
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    __import__(self._name)
+                    module = sys.modules[self._name]
+                    self.__dict__["_module"] = module
+                    self._replace(module)
+        return module
+
+    def _replace(self, module):
+        """
+        bind the module in place of the stand-in in its owner's globals
+        """
+        owner = self._owner
+        for name, value in list(owner.items()):
+            if value is self:
+                owner[name] = module
+
+    def loaded(self):
+        """
+        whether the module has been imported yet (by anybody, not just by this stand-in)
+        """
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module '" + self._name + "'" + (" (loaded)" if self._module is not None else "") + ">"
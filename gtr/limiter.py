@@ -0,0 +1,130 @@
+import threading, time
+from collections import deque
+from email.utils import parsedate_tz, mktime_tz
+
+# responses which mean the API wants us to back off
+THROTTLED = (429, 503)
+
+class AdaptiveLimiter(object):
+    """
+    An adaptive limit on the number of requests in flight at once, shared by all the threads
+    (and clients) which use it, in the manner of TCP's congestion control (AIMD):
+
+    each successful response raises the limit by increase / limit (so, by about increase for
+    each limit's worth of responses), and a throttled (429 or 503) or failed (5xx, or no
+    response at all) response, or one slower than latency_target (if given), cuts it by the
+    factor decrease.  Only one cut is made for the requests which were already in flight
+    when the limit was cut.  The limit stays between minimum and maximum.
+
+    A Retry-After header on a throttled response holds back all new requests until then.
+    The limit is recorded (with the time) each time its whole-number value changes
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5, latency_target=None,
+                    history=1000, stats=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.stats = stats
+        self._limit = float(max(min(initial, maximum), minimum))
+        self._in_flight = 0
+        self._cut_at = 0.0
+        self._held_until = 0.0
+        self._cond = threading.Condition(threading.Lock())
+        self.history = deque([(time.time(), self.limit())], history)
+        self.increases = 0
+        self.decreases = 0
+        self.throttled = 0
+        self.held = 0.0
+
+    def limit(self):
+        return int(self._limit)
+
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        """
+        wait until a request may be made, and return a token to pass to release()
+        """
+        with self._cond:
+            while True:
+                wait = self._held_until - time.time()
+                if wait > 0:
+                    self.held += wait
+                    self._cond.wait(wait)
+                    continue
+                if self._in_flight < self.limit():
+                    break
+                self._cond.wait()
+            self._in_flight += 1
+            return time.time()
+
+    def try_acquire(self):
+        """
+        as acquire(), but without waiting: returns None if a request may not be made now
+        """
+        with self._cond:
+            if self._held_until > time.time() or self._in_flight >= self.limit():
+                return None
+            self._in_flight += 1
+            return time.time()
+
+    def release(self, token, status, elapsed, retry_after=None):
+        """
+        report the outcome of a request: its status (None if it failed without a response),
+        how long it took, and the value of any Retry-After header
+        """
+        with self._cond:
+            self._in_flight -= 1
+            before = self.limit()
+            throttled = status in THROTTLED
+            if throttled:
+                self.throttled += 1
+                until = _retry_at(retry_after)
+                if until is not None and until > self._held_until:
+                    self._held_until = until
+            slow = self.latency_target is not None and elapsed > self.latency_target
+            if throttled or status is None or status >= 500 or slow:
+                if token >= self._cut_at:
+                    self._limit = max(self._limit * self.decrease, self.minimum)
+                    self._cut_at = time.time()
+                    self.decreases += 1
+            elif self._limit < self.maximum:
+                self._limit = min(self._limit + self.increase / self._limit, self.maximum)
+                self.increases += 1
+            after = self.limit()
+            if after != before:
+                now = time.time()
+                self.history.append((now, after))
+                if self.stats is not None:
+                    self.stats.record_limit(after, now)
+            self._cond.notify_all()
+
+    def report(self):
+        with self._cond:
+            return {
+                "limit" : self.limit(),
+                "in_flight" : self._in_flight,
+                "increases" : self.increases,
+                "decreases" : self.decreases,
+                "throttled" : self.throttled,
+                "held" : self.held,
+                "history" : list(self.history)
+            }
+
+def _retry_at(retry_after):
+    """
+    the time given by a Retry-After header, which may be in seconds or an HTTP date
+    """
+    if retry_after is None:
+        return None
+    try:
+        return time.time() + float(retry_after)
+    except ValueError:
+        pass
+    parsed = parsedate_tz(retry_after)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
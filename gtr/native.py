@@ -1,19 +1,33 @@
-import requests, json
 import urler
-from lxml import etree
-from copy import deepcopy
-from common import GtR, Paging, MIME_MAP
+from common import GtR, Paging, Paged, MIME_MAP
+from fields import FieldSet, record_type
+from lazy import LazyModule
+from identity import IdentityMap
+import convert
+
+# only loaded when they are first needed
+json = LazyModule("json")
+etree = LazyModule("lxml.etree")
+copy = LazyModule("copy")
+multiprocessing_pool = LazyModule("multiprocessing.pool")
 
 NSMAP = {"gtr" : "http://gtr.rcuk.ac.uk/api"}
 GTR_PREFIX = "gtr"
 
 class GtRNative(GtR):
     
-    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None):
-        super(GtRNative, self).__init__(base_url, page_size, serialisation, username, password)
+    def __init__(self, base_url, page_size=25, serialisation="json", username=None, password=None,
+                    stats=None, hooks=None, compression=True, keep_bodies=0, identity_map=False, transport=None,
+                    limiter=None, hedge=None):
+        super(GtRNative, self).__init__(base_url, page_size, serialisation, username, password, stats, hooks,
+                                            compression, keep_bodies, transport, limiter, hedge)
         
         self.factory = GtRDAOFactory()
         
+        # identity_map may be True, or an IdentityMap to share between clients, in which case
+        # the organisations, funders and people embedded in projects are shared canonical objects
+        self.identities = IdentityMap() if identity_map is True else (identity_map if identity_map else None)
+        
         self.project_base = self.base_url + "/project/"
         self.org_base = self.base_url + "/organisation/"
         self.person_base = self.base_url + "/person/"
@@ -59,7 +73,7 @@ class GtRNative(GtR):
         url = self.project_base + uuid
         raw, _ = self._api(url)
         if raw is not None:
-            return Project(self, raw)
+            return _fetched(Project(self, raw))
         return None
 
     def organisation(self, uuid, page_size=None):
@@ -68,23 +82,133 @@ class GtRNative(GtR):
         page_size = page_size if page_size is not None else self.page_size
         raw, paging = self._api(url, page_size=page_size)
         if raw is not None and paging is not None:
-            return Organisation(self, raw, paging)
+            return _fetched(Organisation(self, raw, paging))
         return None
         
     def person(self, uuid):
         url = self.person_base + uuid
         raw, _ = self._api(url)
         if raw is not None:
-            return Person(self, raw)
+            return _fetched(Person(self, raw))
         return None
 
     def publication(self, uuid):
         url = self.publication_base + uuid
         raw, _ = self._api(url)
         if raw is not None:
-            return Publication(self, raw)
+            return _fetched(Publication(self, raw))
         return None
+    
+    def record(self, kind, uuid, fields=None):
+        """
+        fetch the entity of the given kind ("project", "organisation", "person" or 
+        "publication"), and extract the given fields (or all of its fields) from the response
+        as a compact record (as from extract()), without building the entity.  returns None
+        if the entity could not be fetched
+        """
+        base = {"project" : self.project_base, "organisation" : self.org_base, 
+                "person" : self.person_base, "publication" : self.publication_base}.get(kind)
+        if base is None:
+            raise ValueError("unknown kind " + str(kind))
+        # an organisation is requested as organisation() requests it, with its projects paged
+        page_size = self.page_size if kind == "organisation" else None
+        raw, _ = self._api(base + uuid, page_size=page_size)
+        if raw is None:
+            return None
+        dao_class = self.factory.class_map[self.mimetype][kind]
+        if getattr(dao_class, "field_set", None) is not None:
+            return dao_class.field_set.extract(raw, fields)
+        return dao_class(raw).extract(fields)
+    
+    ## Relationship expansion ##
+    
+    # the kind of entity which each relation leads to
+    relations = {
+        "people" : "person",
+        "orgs" : "organisation",
+        "collaborators" : "organisation",
+        "lead" : "organisation",
+        "funder" : "organisation",
+        "projects" : "project"
+    }
+    
+    def expand(self, entities, relation, workers=8, cache=None):
+        """
+        follow the named relation (e.g. "people") from each of the entities (e.g. projects),
+        and fetch the related entities in full.  Each related entity is fetched only once,
+        however many of the entities it is related to, and the fetches are made with up 
+        to workers requests at a time.
+        
+        The relations are only known for entities which have been fetched in full, so any
+        of the entities which have not been (such as those from a list page) are fetched
+        first, in the same way.
+        
+        cache is an optional dict of id to fully fetched entity, which is consulted before
+        fetching and updated afterwards, so that it can be shared between calls (e.g. for
+        the second hop of a graph).  An entity which could not be fetched is not cached,
+        so it is tried again by the next call.
         
+        returns a dict of the id of each entity to the list of its related entities (leaving 
+        out any which could not be fetched).  An entity which could not itself be fetched 
+        is left out of the dict
+        """
+        kind = self.relations.get(relation)
+        if kind is None:
+            raise ValueError("unknown relation " + str(relation))
+        fetch = {"project" : self.project, "organisation" : self.organisation, "person" : self.person}[kind]
+        if cache is None:
+            cache = {}
+        
+        entities = list(entities)
+        stubs = [e for e in entities if not e.fetched]
+        unfetched = set([id(e) for e, ok in zip(stubs, self._map(_fetch, stubs, workers)) if not ok])
+        
+        links = []
+        wanted = []
+        seen = set()
+        for entity in entities:
+            if id(entity) in unfetched:
+                continue
+            related = getattr(entity, relation)()
+            if related is None:
+                related = []
+            elif not isinstance(related, list):
+                related = [related]
+            ids = [r.id() for r in related]
+            ids = [i for i in ids if i is not None]
+            links.append((entity.id(), ids))
+            for i in ids:
+                if i not in seen and i not in cache:
+                    seen.add(i)
+                    wanted.append(i)
+        
+        for i, e in zip(wanted, self._map(fetch, wanted, workers)):
+            if e is not None:
+                cache[i] = e
+        
+        return dict([(eid, [cache[rid] for rid in related_ids if rid in cache])
+                        for eid, related_ids in links])
+    
+    def _map(self, fn, items, workers):
+        """
+        fn applied to each of the items, with up to workers calls at a time
+        """
+        if len(items) <= 1 or workers <= 1:
+            return [fn(item) for item in items]
+        pool = multiprocessing_pool.ThreadPool(min(workers, len(items)))
+        try:
+            return pool.map(fn, items)
+        finally:
+            pool.terminate()
+            pool.join()
+
+def _fetch(entity):
+    return entity.fetch()
+
+def _fetched(entity):
+    entity.fetched = True
+    return entity
+
 class GtRDAOFactory(object):
     def __init__(self):
         self.class_map = {
@@ -141,9 +265,16 @@ class GtRDAOFactory(object):
         return None
 
 class Native(object):
+    
+    # the type of entity (or list), as understood by the convert module
+    kind = None
+    
     def __init__(self, client):
         self.client = client
         self.dao = None
+        # whether the entity has been fetched in full, rather than built from a list page
+        # or from the data embedded in another entity
+        self.fetched = False
     
     def url(self):
         raise NotImplementedError()
@@ -155,10 +286,9 @@ class Native(object):
         if hasattr(self.dao, "xml"):
             return self.dao.xml(pretty_print)
         
-        xml, _ = self.client._api(self.url(), mimetype="application/xml")
-        if xml is not None:
-            return etree.tostring(xml, pretty_print=pretty_print)
-        return None
+        # convert the data we already have, rather than fetching it again
+        xml = convert.to_xml(self.dao.as_dict(), self.kind)
+        return etree.tostring(xml, pretty_print=pretty_print)
         
     def as_dict(self):
         if self.dao is None:
@@ -167,16 +297,28 @@ class Native(object):
         if hasattr(self.dao, "as_dict"):
             return self.dao.as_dict()
         
-        j, _ = self.client._api(self.url(), mimetype="application/json")
-        return j
+        return convert.to_dict(self.dao.raw, self.kind)
         
     def json(self, pretty_print=True):
         d = self.as_dict()
         if pretty_print:
             return json.dumps(d, indent=2)
         return json.dumps(d)
+    
+    def extract(self, fields=None):
+        """
+        get the requested fields (or all of the entity's fields) as a compact record,
+        extracted in a single pass over the data
+        """
+        if self.dao is None:
+            return None
+        return self.dao.extract(fields)
 
 class NativeXMLDAO(object):
+    
+    # the names of the fields which extract() provides by default; each must have
+    # a corresponding <name>_xpath
+    fields = ()
 
     def __init__(self, raw):
         self.raw = raw
@@ -224,7 +366,7 @@ class NativeXMLDAO(object):
         for el in self.raw.xpath(xp, namespaces=NSMAP): 
             root = self._gtr_element(new_root)
             for child in el:
-                root.append(deepcopy(child))
+                root.append(copy.deepcopy(child))
             ports.append(root)
         return ports
     
@@ -246,7 +388,7 @@ class NativeXMLDAO(object):
             elements.append(element)
         
         if clone:
-            source = deepcopy(source)
+            source = copy.deepcopy(source)
         
         # now add the elements to eachother in reverse
         for i in range(len(elements) - 1, -1, -1):
@@ -267,9 +409,42 @@ class NativeXMLDAO(object):
     def xml(self, pretty_print=True):
         return etree.tostring(self.raw, pretty_print=pretty_print)
     
+    def extract(self, fields=None):
+        """
+        extract the named fields (by default all of the DAO's fields) into a compact record
+        """
+        fields = tuple(fields) if fields is not None else self.fields
+        values = [self._from_xpath(getattr(self, f + "_xpath")) if hasattr(self, f + "_xpath") else None for f in fields]
+        return _xml_record(type(self).__name__[:-6], fields)._make(values)
+
+_xml_records = {}
+def _xml_record(name, fields):
+    record = _xml_records.get((name, fields))
+    if record is None:
+        record = record_type(name, fields)
+        _xml_records[(name, fields)] = record
+    return record
+    
 class NativeJSONDAO(object):
+    
+    # the FieldSet describing where each of the entity's fields lives in the raw data
+    field_set = None
+    
     def __init__(self, raw):
         self.raw = raw
+        self._record = None
+        self._record_source = None
+    
+    def extract(self, fields=None):
+        return self.field_set.extract(self.raw, fields)
+    
+    def _field(self, name):
+        # all of the fields are extracted together on first access, and again only if
+        # the raw data is replaced
+        if self._record is None or self._record_source is not self.raw:
+            self._record = self.field_set.extract(self.raw)
+            self._record_source = self.raw
+        return getattr(self._record, name)
     
     def as_dict(self):
         return self.raw
@@ -280,110 +455,80 @@ class NativeJSONDAO(object):
             return json.dumps(d, indent=2)
         return json.dumps(d)
 
-class NativePaged(Native):
+class NativePaged(Native, Paged):
     def __init__(self, client, paging):
         super(NativePaged, self).__init__(client)
         self.paging = paging
 
-    def record_count(self):
-        return self.paging.record_count
-    
-    def pages(self):
-        return self.paging.pages
-        
-    def next_page(self):
-        if self.paging.next is None or self.paging.next == "":
-            return False
-        raw, paging = self.client._api(self.paging.next)
-        if raw is not None and paging is not None:
-            self.dao.raw = raw
-            self.paging = paging
-            return True
-        return False
+class NativeList(NativePaged):
+    """
+    the paged lists of entities (Projects, Organisations, ...), whose records can be read
+    without building entity objects.  Other paged objects, such as an Organisation paged
+    over its projects, do not have a list of records
+    """
     
-    def previous_page(self):
-        if self.paging.previous is None or self.paging.previous == "":
-            return False
-        raw, paging = self.client._api(self.paging.previous)
-        if raw is not None and paging is not None:
-            self.dao.raw = raw
-            self.paging = paging
-            return True
-        return False
-        
-    def first_page(self):
-        if self.paging.first is None or self.paging.first == "":
-            return False
-        raw, paging = self.client._api(self.paging.first)
-        if raw is not None and paging is not None:
-            self.dao.raw = raw
-            self.paging = paging
-            return True
-        return False
-        
-    def last_page(self):
-        if self.paging.last is None or self.paging.last == "":
-            return False
-        raw, paging = self.client._api(self.paging.last)
-        if raw is not None and paging is not None:
-            self.dao.raw = raw
-            self.paging = paging
-            return True
-        return False
-    
-    def skip_to_page(self, page):
-        if self.paging.last is None or self.paging.last == "":
-            return False
-        if page > self.paging.last:
-            return False
-        if page < 1:
-            return False
-        raw, paging = self.client._api(self.url(), page=page)
-        if raw is not None and paging is not None:
-            self.dao.raw = raw
-            self.paging = paging
-            return True
-        return False
-    
-    def current_page(self):
-        return self.paging.current_page()
-        
-    def current_page_size(self):
-        return self.paging.current_page_size()
-        
-    def list_elements(self):
+    def iter_raw_records(self, reset_pages=True, stop_at_page_boundary=False):
         """
-        subclass should implement this to return a list of Native objects.
-        It will be used to run the iterator
+        iterate over the raw data of each record in the list (a dict, or an XML element in
+        its page's tree), without wrapping them in entity objects
         """
-        raise NotImplementedError("list_elements has not been implemented")
-    
-    def __iter__(self):
-        return self.iterator()
+        for raw, _ in self.iter_raw_pages(reset_pages, stop_at_page_boundary):
+            for record in self.client.factory._load(self.client, raw, self.kind).records():
+                yield record
     
-    def iterator(self, reset_pages=True, stop_at_page_boundary=False):
+    def iter_records(self, fields=None, reset_pages=True):
+        """
+        iterate over the compact records (as from extract()) of every entity in the list,
+        without building any entity objects
+        """
+        mimetype = self.client.mimetype
+        fields = tuple(fields) if fields is not None else None
+        record = record_class(mimetype, self.kind, fields)
+        
         if reset_pages:
-            self.first_page()
-        def f():
-            while True:
-                elements = self.list_elements()
-                for p in elements:
-                    yield p
-                if stop_at_page_boundary:
-                    break
-                if not self.next_page():
-                    break
-        return f()
-        
-    def __len__(self):
-        return self.record_count()
-
+            url = self.paging.first
+        else:
+            # the page size is -1 when the paging links do not give it
+            page_size = self.current_page_size()
+            if page_size is None or page_size <= 0:
+                page_size = self.client.page_size
+            url = self.client._request_url(self.url(), self.current_page(), page_size)
+        
+        while url is not None and url != "":
+            content, paging = self.client._api_body(url)
+            if content is None:
+                break
+            parsed = parse_records(content, mimetype, self.kind, fields)
+            content = None
+            for values in parsed:
+                yield record._make(values)
+            url = paging.next if paging is not None else None
+
+def parse_records(content, mimetype, kind, fields=None):
+    """
+    parse the body of a page of a list of the given kind ("projects", ...), and extract the
+    fields of each of its records as plain tuples
+    """
+    data = etree.fromstring(content) if mimetype == "application/xml" else json.loads(content)
+    list_dao = GtRDAOFactory().class_map[mimetype][kind](data)
+    return [tuple(dao.extract(fields)) for dao in list_dao.record_daos()]
+
+def record_class(mimetype, kind, fields=None):
+    """
+    the namedtuple class of the records extracted from a list of the given kind
+    """
+    dao_class = GtRDAOFactory().class_map[mimetype][convert.LISTS[kind][1]]
+    if mimetype == "application/xml":
+        return _xml_record(dao_class.__name__[:-6], fields if fields is not None else dao_class.fields)
+    return dao_class.field_set.extractor(fields).record
 
 #### List Objects ####
 
 ## ------ Projects ------- ##
 
-class Projects(NativePaged):
+class Projects(NativeList):
+    
+    kind = "projects"
 
     def __init__(self, client, raw, paging, url, dao=None):
         super(Projects, self).__init__(client, paging)
@@ -411,6 +556,12 @@ class ProjectsXMLDAO(NativeXMLDAO):
     def projects(self, client):
         raws = self._do_xpath(self.project_xpath)
         return [Project(client, self._wrap(raw, self.project_wrapper)) for raw in raws]
+    
+    def records(self):
+        return self._do_xpath(self.project_xpath)
+    
+    def record_daos(self):
+        return [ProjectXMLDAO(self._wrap(raw, self.project_wrapper)) for raw in self.records()]
 
 class ProjectsJSONDAO(NativeJSONDAO):
     def __init__(self, raw):
@@ -418,12 +569,20 @@ class ProjectsJSONDAO(NativeJSONDAO):
     
     def projects(self, client):
         return [Project(client, {"projectComposition" : {"project" : data}}) for data in self.raw.get('project', [])]
+    
+    def records(self):
+        return self.raw.get('project', [])
+    
+    def record_daos(self):
+        return [ProjectJSONDAO({"projectComposition" : {"project" : data}}) for data in self.records()]
 
 ### -------- End Projects -------- ###
 
 ### ------- Organisations -------- ###
 
-class Organisations(NativePaged):
+class Organisations(NativeList):
+    
+    kind = "organisations"
 
     def __init__(self, client, raw, paging, url, dao=None):
         super(Organisations, self).__init__(client, paging)
@@ -451,6 +610,12 @@ class OrganisationsXMLDAO(NativeXMLDAO):
     def organisations(self):
         raws = self._do_xpath(self.organisation_xpath)
         return [Organisation(self.client, self._wrap(raw, self.organisation_wrapper), None) for raw in raws]
+    
+    def records(self):
+        return self._do_xpath(self.organisation_xpath)
+    
+    def record_daos(self):
+        return [OrganisationXMLDAO(self._wrap(raw, self.organisation_wrapper)) for raw in self.records()]
 
 class OrganisationsJSONDAO(NativeJSONDAO):
     def __init__(self, raw):
@@ -459,13 +624,21 @@ class OrganisationsJSONDAO(NativeJSONDAO):
     def organisations(self, client):
         return [Organisation(client, {"organisationOverview" : {"organisation" : data}}, None) 
                     for data in self.raw.get('organisation', [])]
+    
+    def records(self):
+        return self.raw.get('organisation', [])
+    
+    def record_daos(self):
+        return [OrganisationJSONDAO({"organisationOverview" : {"organisation" : data}}) for data in self.records()]
 
 
 ## ---- End Organisations ---- ##
 
 ## ----- People ------ ##
 
-class People(NativePaged):
+class People(NativeList):
+    
+    kind = "people"
 
     def __init__(self, client, raw, paging, url, dao=None):
         super(People, self).__init__(client, paging)
@@ -493,6 +666,12 @@ class PeopleXMLDAO(NativeXMLDAO):
     def people(self, client):
         raws = self._do_xpath(self.person_xpath)
         return [Person(client, None, self._wrap(raw, self.person_wrapper)) for raw in raws]
+    
+    def records(self):
+        return self._do_xpath(self.person_xpath)
+    
+    def record_daos(self):
+        return [PersonXMLDAO(self._wrap(raw, self.person_wrapper)) for raw in self.records()]
 
 class PeopleJSONDAO(NativeJSONDAO):
     def __init__(self, raw):
@@ -501,12 +680,20 @@ class PeopleJSONDAO(NativeJSONDAO):
     def people(self, client):
         return [Person(client, {"person" :  data})
                     for data in self.raw.get("person", [])]
+    
+    def records(self):
+        return self.raw.get("person", [])
+    
+    def record_daos(self):
+        return [PersonJSONDAO({"person" : data}) for data in self.records()]
 
 ## ----- End People ------ ##
 
 ## ------ Publications ------ ##
 
-class Publications(NativePaged):
+class Publications(NativeList):
+    
+    kind = "publications"
 
     def __init__(self, client, raw, paging, url, dao=None):
         super(Publications, self).__init__(client, paging)
@@ -534,6 +721,12 @@ class PublicationsXMLDAO(NativeXMLDAO):
     def publications(self, client):
         raws = self._do_xpath(self.publication_xpath)
         return [Publication(client, self._wrap(raw, self.publication_wrapper)) for raw in raws]
+    
+    def records(self):
+        return self._do_xpath(self.publication_xpath)
+    
+    def record_daos(self):
+        return [PublicationXMLDAO(self._wrap(raw, self.publication_wrapper)) for raw in self.records()]
 
 class PublicationsJSONDAO(NativeJSONDAO):
 
@@ -543,6 +736,12 @@ class PublicationsJSONDAO(NativeJSONDAO):
     def publications(self, client):
         return [Publication(client, { "publication" : data })
                         for data in self.raw.get("publication", [])]
+    
+    def records(self):
+        return self.raw.get("publication", [])
+    
+    def record_daos(self):
+        return [PublicationJSONDAO({"publication" : data}) for data in self.records()]
 
 ## ------- End Publications ------ ##
 
@@ -551,9 +750,17 @@ class PublicationsJSONDAO(NativeJSONDAO):
 ## ------ Project ------- ##
 
 class Project(Native):
+    
+    kind = "project"
+    
     def __init__(self, client, raw, dao=None):
         super(Project, self).__init__(client)
         self.dao = dao if dao is not None else client.factory.project(client, raw)
+        # the embedded entities' data is swapped for the canonical copies, if the client
+        # shares them
+        identities = getattr(client, "identities", None)
+        if identities is not None and hasattr(self.dao, "intern"):
+            self.dao.intern(identities)
 
     def url(self): return self.dao.url()
     def id(self): return self.dao.id()
@@ -583,6 +790,7 @@ class Project(Native):
         updated_proj = self.client.project(self.id())
         if updated_proj is not None:
             self.dao.raw = updated_proj.dao.raw
+            self.fetched = True
             return True
         return False
 
@@ -602,8 +810,12 @@ class ProjectXMLDAO(NativeXMLDAO):
     value_xpath = project_base + "/gtr:fund/gtr:valuePounds"
     category_xpath = project_base + "/gtr:grantCategory"
     reference_xpath = project_base + "/gtr:grantReference"
+    funder_id_xpath = project_base + "/gtr:fund/gtr:funder/gtr:id"
+    funder_name_xpath = funder_xpath
     
     lead_xpath = composition_base + "/gtr:leadResearchOrganisation"
+    lead_id_xpath = lead_xpath + "/gtr:id"
+    lead_name_xpath = lead_xpath + "/gtr:name"
     orgs_xpath = composition_base + "/gtr:organisations/gtr:organisation"
     person_xpath = composition_base + "/gtr:projectPeople/gtr:projectPerson"
     collaborator_xpath = composition_base + "/gtr:collaborations/gtr:collaborator"
@@ -613,6 +825,9 @@ class ProjectXMLDAO(NativeXMLDAO):
     
     organisation_element = "organisation"
     person_element = "person"
+    
+    fields = ("url", "id", "title", "start", "status", "end", "abstract", "value", "category", "reference",
+                "funder_id", "funder_name", "lead_id", "lead_name")
 
     def __init__(self, raw):
         super(ProjectXMLDAO, self).__init__(raw)
@@ -670,72 +885,124 @@ class ProjectXMLDAO(NativeXMLDAO):
         return [Organisation(client, self._wrap(raw, self.organisation_wrapper), None) for raw in raws]
 
 class ProjectJSONDAO(NativeJSONDAO):
+    
+    field_set = FieldSet("Project", [
+        ("url", ("projectComposition", "project", "url")),
+        ("id", ("projectComposition", "project", "id")),
+        ("title", ("projectComposition", "project", "title")),
+        ("start", ("projectComposition", "project", "fund", "start")),
+        ("status", ("projectComposition", "project", "status")),
+        ("end", ("projectComposition", "project", "fund", "end")),
+        ("abstract", ("projectComposition", "project", "abstractText")),
+        ("value", ("projectComposition", "project", "fund", "valuePounds")),
+        ("category", ("projectComposition", "project", "grantCategory")),
+        ("reference", ("projectComposition", "project", "grantReference")),
+        ("funder", ("projectComposition", "project", "fund", "funder")),
+        ("funder_id", ("projectComposition", "project", "fund", "funder", "id")),
+        ("funder_name", ("projectComposition", "project", "fund", "funder", "name")),
+        ("lead", ("projectComposition", "leadResearchOrganisation")),
+        ("lead_id", ("projectComposition", "leadResearchOrganisation", "id")),
+        ("lead_name", ("projectComposition", "leadResearchOrganisation", "name")),
+        ("orgs", ("projectComposition", "organisation")),
+        ("people", ("projectComposition", "projectPerson")),
+        ("collaborators", ("projectComposition", "collaborator"))
+    ])
+    
     def __init__(self, raw):
         super(ProjectJSONDAO, self).__init__(raw)
 
-    def _composition(self):
-        return (self.raw.get("projectComposition", {}))
-
-    def _project(self):
-        return (self.raw.get("projectComposition", {})
-                        .get("project", {}))
-
     def url(self):
-        return self._project().get("url")
+        return self._field("url")
 
     def id(self):
-        return self._project().get("id")
+        return self._field("id")
     
     def title(self):
-        return self._project().get("title")
+        return self._field("title")
     
     def start(self):
-        return self._project().get("fund", {}).get("start")
+        return self._field("start")
     
     def status(self):
-        return self._project().get("status")
+        return self._field("status")
     
     def end(self):
-        return self._project().get("fund", {}).get("end")
+        return self._field("end")
     
     def abstract(self):
-        return self._project().get("abstractText")
+        return self._field("abstract")
     
     def funder(self, client):
-        return Organisation(client, {"organisationOverview" : {"organisation" : self._project().get("fund", {}).get("funder", {})}}, None)
+        funder = self._field("funder")
+        if funder is None:
+            return Organisation(client, {"organisationOverview" : {"organisation" : {}}}, None)
+        return _embedded(client, "funder", funder, 
+                    lambda: Organisation(client, {"organisationOverview" : {"organisation" : funder}}, None))
     
     def value(self):
-        return self._project().get("fund", {}).get("valuePounds")
+        return self._field("value")
     
     def category(self):
-        return self._project().get("grantCategory")
+        return self._field("category")
     
     def reference(self):
-        return self._project().get("grantReference")
+        return self._field("reference")
     
     def lead(self, client):
-        lro = self._composition().get("leadResearchOrganisation")
+        lro = self._field("lead")
         if lro is not None:
-            return Organisation(client, {"organisationOverview" : {"organisation" : lro}}, None)
+            return self._organisation(client, lro)
         return None
         
     def orgs(self, client):
-        return [Organisation(client, {"organisationOverview" : {"organisation" : data}}, None) 
-                    for data in self._composition().get("organisation", [])]
+        return [self._organisation(client, data) for data in self._field("orgs") or []]
         
     def people(self, client):
-        return [Person(client, {"person" : data })
-                    for data in self._composition().get("projectPerson", [])]
+        return [_embedded(client, "person", data, lambda: Person(client, {"person" : data }))
+                    for data in self._field("people") or []]
     
     def collaborators(self, client):
-        return [Organisation(client, {"organisationOverview" : {"organisation" : data}}, None)
-                    for data in self._composition().get("collaborator", [])]
+        return [self._organisation(client, data) for data in self._field("collaborators") or []]
+    
+    def _organisation(self, client, data):
+        return _embedded(client, "organisation", data, 
+                    lambda: Organisation(client, {"organisationOverview" : {"organisation" : data}}, None))
+    
+    def intern(self, identities):
+        """
+        replace the embedded organisations, funder and people in the raw data with the
+        identity map's canonical copies of them
+        """
+        composition = self.raw.get("projectComposition") if isinstance(self.raw, dict) else None
+        if not isinstance(composition, dict):
+            return
+        fund = (composition.get("project") or {}).get("fund")
+        if isinstance(fund, dict) and "funder" in fund:
+            fund["funder"] = identities.intern("funder", fund["funder"])
+        if "leadResearchOrganisation" in composition:
+            composition["leadResearchOrganisation"] = identities.intern("organisation", composition["leadResearchOrganisation"])
+        for key, kind in [("organisation", "organisation"), ("collaborator", "organisation"), ("projectPerson", "person")]:
+            embedded = composition.get(key)
+            if isinstance(embedded, list):
+                composition[key] = [identities.intern(kind, data) for data in embedded]
+
+def _embedded(client, kind, data, build):
+    """
+    build the object for an entity embedded in another, or get the shared one from the
+    client's identity map if it has one
+    """
+    identities = getattr(client, "identities", None)
+    if identities is None or not isinstance(data, dict):
+        return build()
+    return identities.get(kind, data.get("id"), data, build)
 
 ## ------ End Project -------- ##
 
 ## -------- Organisation -------- ##
 
 class Organisation(NativePaged):
+    
+    kind = "organisation"
 
     def __init__(self, client, raw, paging, dao=None):
         super(Organisation, self).__init__(client, paging)
@@ -763,7 +1030,7 @@ class Organisation(NativePaged):
         if raw is not None:
             interim_dao = None
             if self.custom_dao:
-                interim_dao = deepcopy(self.dao)
+                interim_dao = copy.deepcopy(self.dao)
                 interim_dao.raw = raw
             else:
                 interim_dao = client.factory.organisation(client, raw)
@@ -783,6 +1050,7 @@ class Organisation(NativePaged):
         if updated_org is not None:
             self.dao.raw = updated_org.dao.raw
             self.paging = updated_org.paging
+            self.fetched = True
             return True
         return False
 
@@ -793,6 +1061,8 @@ class OrganisationXMLDAO(NativeXMLDAO):
     url_xpath = overview_base + "/gtr:organisation/@url"
     id_xpath = overview_base + "/gtr:organisation/gtr:id"
     name_xpath = overview_base + "/gtr:organisation/gtr:name"
+    
+    fields = ("url", "id", "name")
 
     def __init__(self, raw):
         super(OrganisationXMLDAO, self).__init__(raw)
@@ -807,29 +1077,29 @@ class OrganisationXMLDAO(NativeXMLDAO):
         return self._from_xpath(self.name_xpath)
     
 class OrganisationJSONDAO(NativeJSONDAO):
+    
+    field_set = FieldSet("Organisation", [
+        ("url", ("organisationOverview", "organisation", "url")),
+        ("id", ("organisationOverview", "organisation", "id")),
+        ("name", ("organisationOverview", "organisation", "name")),
+        ("projects", ("organisationOverview", "project"))
+    ])
 
     def __init__(self, raw):
         super(OrganisationJSONDAO, self).__init__(raw)
     
-    def _overview(self):
-        return self.raw.get("organisationOverview", {})
-    
-    def _org(self):
-        return (self.raw.get("organisationOverview", {})
-                        .get("organisation", {}))
-    
     def url(self):
-        return self._org().get("url")
+        return self._field("url")
     
     def id(self):
-        return self._org().get("id")
+        return self._field("id")
         
     def name(self):
-        return self._org().get("name")
+        return self._field("name")
         
     def projects(self, client):
         return [Project(client, {"projectOverview" : {"project" : data}})
-                        for data in self._overview().get("project", [])]
+                        for data in self._field("projects") or []]
                         
     def add_projects(self, projects):
         project_raw = [p.dao.raw['projectOverview']['project'] for p in projects]
@@ -841,6 +1111,8 @@ class OrganisationJSONDAO(NativeJSONDAO):
 ## -------- Person -------------- ##
 
 class Person(Native):
+    
+    kind = "person"
 
     def __init__(self, client, raw, dao=None):
         super(Person, self).__init__(client)
@@ -869,6 +1141,7 @@ class Person(Native):
         updated_person = self.client.person(self.id())
         if updated_person is not None:
             self.dao.raw = updated_person.dao.raw
+            self.fetched = True
             return True
         return False
         
@@ -886,6 +1159,8 @@ class PersonXMLDAO(NativeXMLDAO):
     projects_xpath = overview_base + "/gtr:projectCompositions/gtr:projectComposition"
     
     project_wrapper = "projectOverview"
+    
+    fields = ("url", "id")
 
     def __init__(self, raw):
         super(PersonXMLDAO, self).__init__(raw)
@@ -901,37 +1176,49 @@ class PersonXMLDAO(NativeXMLDAO):
         return [Project(client, self._wrap(raw, self.project_wrapper)) for raw in raws]
         
 class PersonJSONDAO(NativeJSONDAO):
+    
+    field_set = FieldSet("Person", [
+        ("url", ("person", "url")),
+        ("id", ("person", "id")),
+        ("project_roles", ("person", "projectRole")),
+        ("principal_investigator", ("person", "principalInvestigator")),
+        ("co_investigator", ("person", "coInvestigator")),
+        ("projects", ("projectComposition",))
+    ])
 
     def __init__(self, raw):
         super(PersonJSONDAO, self).__init__(raw)
     
-    def _person(self):
-        return self.raw.get("person", {})
-    
     def url(self):
-        return self._person().get("url")
+        return self._field("url")
     
     def id(self):
-        return self._person().get("id")
+        return self._field("id")
     
     def get_project_roles(self):
-        return self._person().get("projectRole", [])
+        roles = self._field("project_roles")
+        return roles if roles is not None else []
     
     def principal_investigator(self):
-        return self._person().get("principalInvestigator", False)
+        pi = self._field("principal_investigator")
+        return pi if pi is not None else False
         
     def co_investigator(self):
-        return self._person().get("coInvestigator", False)
+        ci = self._field("co_investigator")
+        return ci if ci is not None else False
     
     def projects(self, client):
         return [Project(client, {"projectOverview" : {"project" : data}})
-                        for data in self._overview().get("projectComposition", [])]
+                        for data in self._field("projects") or []]
 
 ## --------- End Person ----------- ##
 
 ## -------- Publication ----------- ##
 
 class Publication(Native):
+    
+    kind = "publication"
+    
     def __init__(self, client, raw, dao=None):
         super(Publication, self).__init__(client)
         self.dao = dao if dao is not None else client.factory.publication(client, raw)
@@ -944,6 +1231,7 @@ class Publication(Native):
         updated_pub = self.client.publication(self.id())
         if updated_pub is not None:
             self.dao.raw = updated_pub.dao.raw
+            self.fetched = True
             return True
         return False
 
@@ -955,6 +1243,8 @@ class PublicationXMLDAO(NativeXMLDAO):
     id_xpath = publication_base + "/gtr:id"
     title_xpath = publication_base + "/gtr:title"
     
+    fields = ("url", "id", "title")
+    
     def __init__(self, raw):
         super(PublicationXMLDAO, self).__init__(raw)
     
@@ -968,20 +1258,24 @@ class PublicationXMLDAO(NativeXMLDAO):
         return self._from_xpath(self.title_xpath)
     
 class PublicationJSONDAO(NativeJSONDAO):
+    
+    field_set = FieldSet("Publication", [
+        ("url", ("publication", "url")),
+        ("id", ("publication", "id")),
+        ("title", ("publication", "title"))
+    ])
+    
     def __init__(self, raw):
         super(PublicationJSONDAO, self).__init__(raw)
     
-    def _publication(self):
-        return self.raw.get("publication", {})
-    
     def url(self):
-        return self._publication().get("url")
+        return self._field("url")
     
     def id(self):
-        return self._publication().get("id")
+        return self._field("id")
         
     def title(self):
-        return self._publication().get("title")
+        return self._field("title")
         
 ## ---------- End Publication -------- ##
 
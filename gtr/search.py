@@ -0,0 +1,279 @@
+"""
+A local full-text index over project titles and abstracts, ranked with BM25, which can
+be fed by workflows.crawl (as a sink), saved, and searched offline.
+
+Postings are held per term as a byte string of varint-encoded (document number delta,
+term frequency) pairs, so the index stays compact in memory and on disk
+"""
+import re, math, struct, threading, time, heapq, zlib
+from array import array
+from lazy import LazyModule
+
+json = LazyModule("json")
+
+MAGIC = "GTRINDX1"
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their this
+to was were which with within will we our these those been not also can such using use
+""".split())
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def tokenise(text):
+    """
+    the lower-cased words of the text, leaving out stopwords, single characters and numbers
+    """
+    if text is None:
+        return []
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS and not t.isdigit()]
+
+## ------ postings encoding ------ ##
+
+def _varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _decode(data):
+    """
+    iterate over the (document number, term frequency) pairs in an encoded postings list
+    (a bytearray)
+    """
+    doc = 0
+    values = []
+    n, shift = 0, 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(n)
+        n, shift = 0, 0
+        if len(values) == 2:
+            doc += values[0]
+            yield doc, values[1]
+            values = []
+
+class SearchIndex(object):
+    """
+    An inverted index of projects.  Adding a project which is already in the index
+    replaces it if its title or abstract has changed (and does nothing otherwise), so the
+    index can be kept up to date from delta crawls.  Replaced and removed documents are
+    skipped when searching, and dropped for good by compact()
+
+    The title is counted title_weight times, so that matches in the title rank higher
+    """
+    # as a crawl sink, the index only takes (and so only asks the crawl for) projects
+    kinds = ("project",)
+    
+    def __init__(self, k1=1.2, b=0.75, title_weight=2):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self._lock = threading.Lock()
+        self._clear()
+        self.queries = 0
+        self.query_time = 0.0
+
+    def _clear(self):
+        self._ids = []
+        self._titles = []
+        self._lengths = array("I")
+        self._fingerprints = array("l")
+        self._docs = {}
+        self._deleted = set()
+        self._postings = {}
+        self._last = {}
+        self._total_length = 0
+
+    ## ------ building ------ ##
+
+    def add(self, kind, entity):
+        """
+        crawl sink interface: index projects, and ignore everything else
+        """
+        if kind != "project":
+            return
+        self.add_document(entity.id(), entity.title(), entity.abstract())
+
+    def add_document(self, uuid, title, abstract):
+        """
+        add or replace a document; returns whether the index changed
+        """
+        fingerprint = zlib.crc32(((title or u"") + u"\x00" + (abstract or u"")).encode("utf-8"))
+        tokens = tokenise(title) * self.title_weight + tokenise(abstract)
+        counts = {}
+        for t in tokens:
+            counts[t] = counts.get(t, 0) + 1
+        with self._lock:
+            existing = self._docs.get(uuid)
+            if existing is not None:
+                if self._fingerprints[existing] == fingerprint:
+                    return False
+                self._delete(existing)
+            doc = len(self._ids)
+            self._ids.append(uuid)
+            self._titles.append(title)
+            self._lengths.append(len(tokens))
+            self._fingerprints.append(fingerprint)
+            self._docs[uuid] = doc
+            self._total_length += len(tokens)
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = bytearray()
+                    self._postings[term] = postings
+                _varint(doc - self._last.get(term, 0), postings)
+                _varint(tf, postings)
+                self._last[term] = doc
+        return True
+
+    def remove(self, uuid):
+        with self._lock:
+            doc = self._docs.get(uuid)
+            if doc is None:
+                return False
+            self._delete(doc)
+            return True
+
+    def _delete(self, doc):
+        del self._docs[self._ids[doc]]
+        self._deleted.add(doc)
+        self._total_length -= self._lengths[doc]
+
+    def compact(self):
+        """
+        rebuild the postings without the replaced and removed documents
+        """
+        with self._lock:
+            if len(self._deleted) == 0:
+                return
+            renumber = {}
+            ids, titles, lengths, fingerprints = [], [], array("I"), array("l")
+            for doc in range(len(self._ids)):
+                if doc in self._deleted:
+                    continue
+                renumber[doc] = len(ids)
+                ids.append(self._ids[doc])
+                titles.append(self._titles[doc])
+                lengths.append(self._lengths[doc])
+                fingerprints.append(self._fingerprints[doc])
+            postings, last = {}, {}
+            for term, data in self._postings.items():
+                encoded = bytearray()
+                previous = 0
+                for doc, tf in _decode(data):
+                    if doc in self._deleted:
+                        continue
+                    new = renumber[doc]
+                    _varint(new - previous, encoded)
+                    _varint(tf, encoded)
+                    previous = new
+                if len(encoded) > 0:
+                    postings[term] = encoded
+                    last[term] = previous
+            self._ids, self._titles, self._lengths, self._fingerprints = ids, titles, lengths, fingerprints
+            self._docs = dict([(uuid, doc) for doc, uuid in enumerate(ids)])
+            self._deleted = set()
+            self._postings, self._last = postings, last
+
+    ## ------ searching ------ ##
+
+    def search(self, query, limit=10):
+        """
+        the best matching projects for the query, as a list of (uuid, title, score)
+        """
+        start = time.time()
+        terms = set(tokenise(query))
+        with self._lock:
+            n = len(self._docs)
+            results = []
+            if n > 0 and len(terms) > 0:
+                average = float(self._total_length) / n
+                scores = {}
+                for term in terms:
+                    data = self._postings.get(term)
+                    if data is None:
+                        continue
+                    postings = [(doc, tf) for doc, tf in _decode(data) if doc not in self._deleted]
+                    if len(postings) == 0:
+                        continue
+                    df = len(postings)
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    for doc, tf in postings:
+                        norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / average)
+                        scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                best = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+                results = [(self._ids[doc], self._titles[doc], score) for doc, score in best]
+            self.queries += 1
+            self.query_time += time.time() - start
+        return results
+
+    ## ------ reporting ------ ##
+
+    def __len__(self):
+        return len(self._docs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents" : len(self._docs),
+                "deleted" : len(self._deleted),
+                "terms" : len(self._postings),
+                "postings_bytes" : sum([len(p) for p in self._postings.values()]),
+                "queries" : self.queries,
+                "mean_query_ms" : self.query_time / self.queries * 1000 if self.queries > 0 else None
+            }
+
+    ## ------ persistence ------ ##
+
+    def save(self, path):
+        """
+        write the index to a file: MAGIC, the length of a JSON header, the header (the
+        documents and the terms, with the length of each term's postings) and then the
+        postings themselves
+        """
+        self.compact()
+        with self._lock:
+            terms = sorted(self._postings.keys())
+            meta = json.dumps({
+                "k1" : self.k1, "b" : self.b, "title_weight" : self.title_weight,
+                "ids" : self._ids, "titles" : self._titles, "lengths" : list(self._lengths),
+                "fingerprints" : list(self._fingerprints),
+                "terms" : terms, "sizes" : [len(self._postings[t]) for t in terms],
+                "last" : [self._last[t] for t in terms]
+            }, separators=(",", ":"))
+            if isinstance(meta, unicode):
+                meta = meta.encode("utf-8")
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<I", len(meta)))
+                f.write(meta)
+                for t in terms:
+                    f.write(self._postings[t])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " is not a search index")
+        offset = len(MAGIC)
+        meta_length = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+        meta = json.loads(data[offset:offset + meta_length])
+        offset += meta_length
+        index = cls(meta["k1"], meta["b"], meta["title_weight"])
+        index._ids = meta["ids"]
+        index._titles = meta["titles"]
+        index._lengths = array("I", meta["lengths"])
+        index._fingerprints = array("l", meta["fingerprints"])
+        index._docs = dict([(uuid, doc) for doc, uuid in enumerate(index._ids)])
+        index._total_length = sum(index._lengths)
+        for term, size, last in zip(meta["terms"], meta["sizes"], meta["last"]):
+            index._postings[term] = bytearray(data[offset:offset + size])
+            index._last[term] = last
+            offset += size
+        return index
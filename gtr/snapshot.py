@@ -0,0 +1,310 @@
+"""
+A compact binary snapshot of crawled GtR records, which can be opened instantly and
+shared between processes through the OS page cache.
+
+The file is laid out as:
+
+    header:  MAGIC
+    records: (kind code, length) then the record's native JSON, for each record in the
+             order it was added
+    index:   (kind code, uuid, offset, length) for each record, sorted by kind and uuid
+    footer:  (index offset, index entries, MAGIC)
+
+The reader memory-maps the file, so lookups by uuid are a binary search over the index
+and scans read the records straight out of the map
+"""
+import struct, mmap, os, threading
+import urler
+from lazy import LazyModule
+from common import Paging
+from native import GtRNative
+
+json = LazyModule("json")
+
+MAGIC = "GTRSNAP1"
+
+KINDS = {"project" : 1, "organisation" : 2, "person" : 3, "publication" : 4}
+_KIND_NAMES = dict([(v, k) for k, v in KINDS.items()])
+
+# where the entity's own record lives in its native JSON, for building list pages
+RECORD_PATHS = {
+    "project" : ("projectComposition", "project"),
+    "organisation" : ("organisationOverview", "organisation"),
+    "person" : ("person",),
+    "publication" : ("publication",)
+}
+
+UUID_SIZE = 36
+_RECORD = struct.Struct("<BI")
+_ENTRY = struct.Struct("<B" + str(UUID_SIZE) + "sQI")
+_FOOTER = struct.Struct("<QQ8s")
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotWriter(object):
+    """
+    Writes records to a snapshot file, append-only.  It can be passed to workflows.crawl
+    as a sink, which adds each entity as it is crawled (of the given kinds, or if kinds is
+    None, of the types the crawl was asked for, so that a crawl with no callbacks or limits
+    is refused rather than writing an empty snapshot); close() must be called to write the
+    index.
+    If the same record is added more than once, the last one wins
+    """
+    def __init__(self, path, kinds=None):
+        self.path = path
+        self.kinds = tuple(kinds) if kinds is not None else None
+        self._f = open(path, "wb")
+        self._f.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, entity):
+        """
+        add an entity object (anything with id() and as_dict())
+        """
+        self.add_raw(kind, entity.id(), entity.as_dict())
+
+    def add_raw(self, kind, uuid, raw):
+        code = KINDS.get(kind)
+        if code is None:
+            raise SnapshotError("unknown kind " + str(kind))
+        if uuid is None or len(uuid) != UUID_SIZE:
+            raise SnapshotError("not a uuid: " + str(uuid))
+        data = json.dumps(raw, separators=(",", ":"))
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        with self._lock:
+            self._f.write(_RECORD.pack(code, len(data)))
+            self._f.write(data)
+            self._index[(code, str(uuid))] = (self._offset + _RECORD.size, len(data))
+            self._offset += _RECORD.size + len(data)
+
+    def close(self):
+        with self._lock:
+            if self._f is None:
+                return
+            index_offset = self._offset
+            for (code, uuid), (offset, length) in sorted(self._index.items()):
+                self._f.write(_ENTRY.pack(code, uuid, offset, length))
+            self._f.write(_FOOTER.pack(index_offset, len(self._index), MAGIC))
+            self._f.close()
+            self._f = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SnapshotReader(object):
+    """
+    Read-only access to a snapshot file, via a memory map
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) + _FOOTER.size:
+                raise SnapshotError(path + " is not a snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, entries, magic = _FOOTER.unpack(self._map[size - _FOOTER.size:])
+        if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise SnapshotError(path + " is not a snapshot")
+        self._index_offset = index_offset
+        self._entries = entries
+        self._kinds = {}
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._entries
+
+    ## index ##
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._map, self._index_offset + i * _ENTRY.size)
+
+    def _key(self, i):
+        start = self._index_offset + i * _ENTRY.size
+        return self._map[start:start + 1 + UUID_SIZE]
+
+    def _search(self, key):
+        # the first index entry whose key is not less than the key
+        lo, hi = 0, self._entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _kind_range(self, kind):
+        """
+        the range of index entries for the given kind
+        """
+        r = self._kinds.get(kind)
+        if r is None:
+            code = KINDS[kind]
+            r = (self._search(chr(code)), self._search(chr(code + 1)))
+            self._kinds[kind] = r
+        return r
+
+    def count(self, kind):
+        start, end = self._kind_range(kind)
+        return end - start
+
+    def raw_bytes(self, kind, uuid):
+        """
+        the stored JSON of the record, or None if it is not in the snapshot
+        """
+        key = chr(KINDS[kind]) + str(uuid)
+        i = self._search(key)
+        if i >= self._entries or self._key(i) != key:
+            return None
+        _, _, offset, length = self._entry(i)
+        return self._map[offset:offset + length]
+
+    def get(self, kind, uuid):
+        """
+        the native JSON of the record, or None if it is not in the snapshot
+        """
+        data = self.raw_bytes(kind, uuid)
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def uuids(self, kind, start=0, end=None):
+        """
+        the uuids of the records of the given kind, in order, from position start to end
+        """
+        first, last = self._kind_range(kind)
+        end = last - first if end is None else min(end, last - first)
+        return [self._entry(first + i)[1] for i in range(start, end)]
+
+    def records(self, kind, start=0, end=None):
+        """
+        the native JSON of the records of the given kind, in uuid order, from position
+        start to end
+        """
+        first, last = self._kind_range(kind)
+        end = last - first if end is None else min(end, last - first)
+        out = []
+        for i in range(start, end):
+            _, _, offset, length = self._entry(first + i)
+            out.append(json.loads(self._map[offset:offset + length]))
+        return out
+
+    ## sequential scans ##
+
+    def scan_raw(self, kind=None):
+        """
+        iterate over (kind, buffer) for each record in the order it was written, where the
+        buffer is a view of the record's JSON in the map (so nothing is copied until it is
+        read).  A record which was added more than once appears each time
+        """
+        code = KINDS[kind] if kind is not None else None
+        offset = len(MAGIC)
+        while offset < self._index_offset:
+            record_code, length = _RECORD.unpack_from(self._map, offset)
+            offset += _RECORD.size
+            if code is None or record_code == code:
+                yield _KIND_NAMES.get(record_code), buffer(self._map, offset, length)
+            offset += length
+
+    def scan(self, kind=None):
+        """
+        iterate over (kind, native JSON) for each record in the order it was written
+        """
+        for k, data in self.scan_raw(kind):
+            yield k, json.loads(data[:])
+
+class SnapshotClient(GtRNative):
+    """
+    A native client which serves its data from a snapshot rather than from the API, so
+    that everything built on GtRNative (the list objects, paging, fetch(), expand())
+    works offline.  The snapshot only holds the native JSON, so the client is always
+    JSON, and list pages are sorted by uuid
+    """
+    def __init__(self, snapshot, base_url="http://gtr.rcuk.ac.uk", page_size=25, stats=None, hooks=None,
+                    identity_map=False):
+        super(SnapshotClient, self).__init__(base_url, page_size, "json", stats=stats, hooks=hooks,
+                                                identity_map=identity_map)
+        self.snapshot = SnapshotReader(snapshot) if isinstance(snapshot, basestring) else snapshot
+        self._bases = [
+            (self.project_base, "project"),
+            (self.org_base, "organisation"),
+            (self.person_base, "person"),
+            (self.publication_base, "publication")
+        ]
+
+    def close(self):
+        self.snapshot.close()
+
+    def _request(self, rest_url, headers, accept, parse=True):
+        data, paging = self._lookup(rest_url)
+        if not parse and data is not None:
+            data = json.dumps(data)
+        return data, paging
+
+    def _lookup(self, rest_url):
+        url = urler.URL(rest_url)
+        path = url.parsed_url.scheme + "://" + url.parsed_url.netloc + url.parsed_url.path
+        for base, kind in self._bases:
+            if not path.startswith(base):
+                continue
+            uuid = path[len(base):].strip("/")
+            if uuid == "":
+                return self._list(kind, urler.get_query_param(rest_url, "page"),
+                                    urler.get_query_param(rest_url, "fetchSize"))
+            raw = self.snapshot.get(kind, uuid)
+            if raw is None:
+                return None, None
+            if kind == "organisation":
+                # the organisation's projects are not paged in the snapshot
+                n = len(raw.get("organisationOverview", {}).get("project", []))
+                return raw, self._paging(base + uuid, 1, max(n, 1), 1, n)
+            return raw, None
+        return None, None
+
+    def _list(self, kind, page, page_size):
+        page = _int(page, 1)
+        # as the API does, including for a page size of 0
+        page_size = self._constrain_page_size(_int(page_size, self.page_size))
+        total = self.snapshot.count(kind)
+        pages = max((total + page_size - 1) // page_size, 1)
+        if page < 1 or page > pages:
+            return None, None
+        records = []
+        for raw in self.snapshot.records(kind, (page - 1) * page_size, page * page_size):
+            for key in RECORD_PATHS[kind]:
+                raw = raw.get(key, {})
+            records.append(raw)
+        data = {kind : records, "page" : page, "size" : page_size, "totalPages" : pages, "totalSize" : total}
+        base = dict([(k, b) for b, k in self._bases])[kind]
+        return data, self._paging(base, page, page_size, pages, total)
+
+    def _paging(self, base, page, page_size, pages, total):
+        def link(p):
+            return urler.set_query_params(base, [("page", p), ("fetchSize", page_size)])
+        previous = link(page - 1) if page > 1 else None
+        next = link(page + 1) if page < pages else None
+        return Paging(total, pages, link(1), previous, next, link(pages))
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
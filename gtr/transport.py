@@ -0,0 +1,171 @@
+"""
+The HTTP transports which sit underneath GtR._api.  A transport has a single method,
+
+    get(url, headers, auth=None) -> Response
+
+RequestsTransport talks to the API; RecordingTransport wraps another transport and
+writes every response to a cassette file; ReplayTransport serves the responses in a
+cassette, in any order, without touching the network
+"""
+import struct, threading, time, random
+from lazy import LazyModule
+from compression import CompressedBody, decompress, read_response
+
+requests = LazyModule("requests")
+json = LazyModule("json")
+
+# the response headers which are kept in a cassette
+RECORDED_HEADERS = ("link", "link-records", "link-pages", "content-type", "content-encoding", "retry-after")
+
+_FRAME = struct.Struct("<II")
+
+class TransportError(Exception):
+    pass
+
+class Headers(dict):
+    """
+    response headers, looked up without regard to case
+    """
+    def __init__(self, headers=None):
+        super(Headers, self).__init__()
+        for k, v in (headers or {}).items():
+            self[k] = v
+
+    def __setitem__(self, key, value):
+        super(Headers, self).__setitem__(key.lower(), value)
+
+    def __getitem__(self, key):
+        return super(Headers, self).__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super(Headers, self).__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super(Headers, self).get(key.lower(), default)
+
+class Response(object):
+    """
+    a response which has been read in full: body is a CompressedBody of the bytes as they
+    came over the wire, and content is the decoded bytes
+    """
+    def __init__(self, url, status_code, headers, body, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.content = content
+
+class RequestsTransport(object):
+    """
+    requests made to the API with the requests library, streaming and decompressing the
+    body as it arrives
+    """
+    def get(self, url, headers, auth=None):
+        if auth is None:
+            resp = requests.get(url, headers=headers, stream=True)
+        else:
+            resp = requests.get(url, headers=headers, auth=auth, stream=True)
+        body, content = read_response(resp)
+        return Response(url, resp.status_code, resp.headers, body, content)
+
+class RecordingTransport(object):
+    """
+    passes every request on to another transport (by default, the API), and appends the
+    response to a cassette.  Bodies are recorded as they came over the wire (so compressed,
+    if the client negotiates compression), along with the paging headers
+    """
+    def __init__(self, path, transport=None, append=False):
+        self.path = path
+        self.transport = transport if transport is not None else RequestsTransport()
+        self._f = open(path, "ab" if append else "wb")
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def get(self, url, headers, auth=None):
+        resp = self.transport.get(url, headers, auth)
+        meta = {
+            "url" : url,
+            "accept" : headers.get("Accept"),
+            "status" : resp.status_code,
+            "headers" : dict([(h, resp.headers.get(h)) for h in RECORDED_HEADERS if resp.headers.get(h) is not None]),
+            "encoding" : resp.body.encoding,
+            "size" : resp.body.size
+        }
+        meta = json.dumps(meta, separators=(",", ":"))
+        with self._lock:
+            self._f.write(_FRAME.pack(len(meta), len(resp.body.data)))
+            self._f.write(meta)
+            self._f.write(resp.body.data)
+            self._f.flush()
+            self.recorded += 1
+        return resp
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+class ReplayTransport(object):
+    """
+    serves the responses recorded in a cassette, looked up by url and Accept type, so
+    requests may be replayed in any order and from any number of threads.
+
+    latency (in seconds) is added to every response, plus an exponentially distributed
+    jitter with the given mean.  A request which is not in the cassette raises a
+    TransportError, unless strict is False, in which case it gets a 404
+    """
+    def __init__(self, path, latency=0.0, jitter=0.0, strict=True, seed=None):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.strict = strict
+        self._random = random.Random(seed)
+        self._responses = {}
+        self._lock = threading.Lock()
+        self.replayed = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            meta_length, body_length = _FRAME.unpack_from(data, offset)
+            offset += _FRAME.size
+            meta = json.loads(data[offset:offset + meta_length])
+            offset += meta_length
+            body = CompressedBody(data[offset:offset + body_length], meta.get("encoding", "identity"), meta.get("size"))
+            offset += body_length
+            # if a request was recorded more than once, the last response wins
+            self._responses[(meta["url"], meta.get("accept"))] = (meta["status"], meta.get("headers", {}), body)
+
+    def __len__(self):
+        return len(self._responses)
+
+    def urls(self):
+        return [url for url, _ in self._responses.keys()]
+
+    def get(self, url, headers, auth=None):
+        recorded = self._responses.get((url, headers.get("Accept")))
+        self._delay()
+        with self._lock:
+            if recorded is None:
+                self.misses += 1
+            else:
+                self.replayed += 1
+        if recorded is None:
+            if self.strict:
+                raise TransportError("no recorded response for " + url)
+            return Response(url, 404, Headers(), CompressedBody("", "identity", 0), "")
+        status, recorded_headers, body = recorded
+        return Response(url, status, Headers(recorded_headers), body, decompress(body.data, body.encoding))
+
+    def _delay(self):
+        delay = self.latency
+        if self.jitter > 0:
+            with self._lock:
+                delay += self._random.expovariate(1.0 / self.jitter)
+        if delay > 0:
+            time.sleep(delay)
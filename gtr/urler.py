@@ -5,6 +5,14 @@ def set_query_param(url, param, value):
     urld.set_query_param(param, value)
     return urld.url()
 
+def set_query_params(url, params):
+    """
+    set several query parameters (a dict, or a list of (param, value) tuples) in a single pass
+    """
+    urld = URL(url)
+    urld.set_query_params(params)
+    return urld.url()
+
 def get_query_param(url, param):
     urld = URL(url)
     return urld.get_query_param(param)
@@ -20,9 +28,15 @@ class URL(object):
         self._patch(new_query=new_query)
     
     def set_query_param(self, param, value):
+        self.set_query_params([(param, value)])
+    
+    def set_query_params(self, params):
+        if isinstance(params, dict):
+            params = params.items()
+        replace = set([k for k, _ in params])
         tuples = urlparse.parse_qsl(self.parsed_url.query)
-        stripped = [(k,v) for k,v in tuples if k != param]
-        stripped.append((param, value))
+        stripped = [(k,v) for k,v in tuples if k not in replace]
+        stripped.extend(params)
         new_query = urllib.urlencode(stripped)
         self._patch(new_query=new_query)
     
@@ -38,11 +52,9 @@ class URL(object):
         return urlparse.urlunparse(self.parsed_url)
     
     def _patch(self, new_query=None):
-        scheme, netloc, path, params, query, fragment = self.parsed_url
+        # the parsed url is a namedtuple, so there's no need to unparse and re-parse it
         if new_query is not None:
-            query = new_query
-        url = urlparse.urlunparse((scheme, netloc, path, params, query, fragment))
-        self.parsed_url = urlparse.urlparse(url)
+            self.parsed_url = self.parsed_url._replace(query=new_query)
     
     def __str__(self):
         return self.url()
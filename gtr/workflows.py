@@ -1,75 +1,844 @@
-import logging, time
+import logging, time, threading, heapq, Queue, zlib
+from collections import namedtuple
+from lazy import LazyModule
 import native, cerif
+from instrument import ClientStats, Hooks
 
 log = logging.getLogger(__name__)
 
+# only needed for concurrent crawls
+multiprocessing_pool = LazyModule("multiprocessing.pool")
+json = LazyModule("json")
+
 def crawl(base_url, username=None, password=None, min_request_gap=0,
             project_callback=None, project_limit=None, pass_cerif_project=False,
             person_callback=None, person_limit=None, 
             organisation_callback=None, organisation_limit=None, 
-            publication_callback=None, publication_limit=None):
+            publication_callback=None, publication_limit=None, workers=1, stats=None, hooks=None,
+            profile=False, log_every=1, identity_map=False, sinks=None, transport=None,
+            pipeline=False, callback_workers=1, queue_size=100, ordered=True,
+            project_batch_callback=None, person_batch_callback=None, organisation_batch_callback=None,
+            publication_batch_callback=None, batch_size=100, batch_window=None, batch_per_page=False,
+            checkpoint_callback=None, limiter=None, hedge=None, fields=None):
+    """
+    crawl the API, passing each fully fetched entity to the relevant callback.
+    
+    workers is the number of concurrent requests used to fetch the detail (and, if
+    pass_cerif_project is set, CERIF) records for each page.  With 1 worker the native
+    records are fetched serially as before, although CERIF records are still fetched
+    in the background.  min_request_gap is the minimum time between the starts of 
+    successive detail and CERIF requests, however many workers make them
+    
+    stats may be True, or a ClientStats object, in which case the statistics for all of the
+    crawl's requests and callbacks are gathered there and it is returned.  hooks is an 
+    instrument.Hooks registry which is shared by the crawl's clients
+    
+    profile may be True, or a CrawlProfile object, in which case the crawl records where
+    its time went, and the profile is returned (instead of the stats).
+    
+    log_every controls the per-record logging, which happens for only one record in every
+    log_every (and not at all if the log level is above INFO)
+    
+    identity_map may be True, or an identity.IdentityMap, in which case the organisations,
+    funders and people embedded in the crawled records are shared between them
+    
+    sinks is a list of objects (such as a snapshot.SnapshotWriter) whose add(kind, entity)
+    method is passed every entity as it is crawled, in addition to any callback.  A sink
+    with a kinds attribute (e.g. ("project",)) takes just those types of entity, and they
+    are crawled for it even without a callback (unless their limit is 0); a sink whose
+    kinds is None, or which has none, takes the types which have a callback or a limit.  A
+    ValueError is raised if the crawl would pass nothing to one of the sinks
+    
+    transport is the transport.* object used by the crawl's clients to make their requests,
+    for example to record the crawl, or to replay a recorded one
+    
+    pipeline switches the crawl into a staged mode, in which listing and fetching (with
+    workers concurrent fetches) run ahead of the callbacks, putting fully fetched entities
+    on a queue of at most queue_size, from which callback_workers threads pass them to the 
+    callbacks.  With ordered, entities join the queue in list order (so with one callback
+    worker, the callbacks see them in list order); otherwise they join as they are fetched.
+    The first exception raised by a callback (or a fetch) stops the crawl, and is re-raised.
+    
+    The batch callbacks (e.g. project_batch_callback) are passed lists of entities (or of
+    (project, cerif project) tuples, with pass_cerif_project) instead of one at a time, and
+    may be used instead of or as well as the per-record callbacks.  A batch is delivered when 
+    it reaches batch_size, when its first entity has waited batch_window seconds (checked as
+    entities arrive and at the end of each page), at the end of each page if batch_per_page
+    is set (except in pipeline mode), and at the end of the crawl.  For an entity type with a
+    batch callback, min_request_gap is also the minimum time between batches (as well as 
+    between requests), and after each batch checkpoint_callback (if given) is called with 
+    the entity type, the number of entities delivered so far, and the id of the last of them
+    
+    limiter may be True, or a limiter.AdaptiveLimiter, which the crawl's clients share to
+    adapt the number of requests in flight (up to the number of workers) to the API's 
+    latency and errors; the limit and its history are gathered in the stats
+    
+    hedge may be True, or a hedge.Hedger, which the crawl's clients share to send a second 
+    request for any request which runs long, so that one slow response does not hold up a 
+    page; the hedges are counted against the limiter, and their outcomes are gathered in the
+    stats.  A hedger made for the crawl (with True) is closed at the end of it
+    
+    fields is a list of field names (or dotted paths, as for extract()) to project each 
+    crawled entity onto, or a dict of such lists by entity type ("project", "person", 
+    "organisation" or "publication").  The callbacks (and batch callbacks) of the projected
+    types are then passed compact records (namedtuples, as from extract()) instead of 
+    entities, and the checkpoint_callback is given the record's id field, if it has one.
+    The records are extracted straight from each parsed detail response, which is then 
+    dropped, so the entities are never built; the after_callback hook is passed the record.
+    A type which is crawled into any of the sinks cannot be projected, since the sinks take
+    whole entities (a ValueError is raised)
+    """
+    if stats is True:
+        stats = ClientStats()
+    if profile is True:
+        profile = CrawlProfile()
+    if profile:
+        if hooks is None:
+            hooks = Hooks()
+        profile.install(hooks)
+        profile.stats = stats
+    else:
+        profile = _NO_PROFILE
     
     # create a client which crawls json at 100 records per page
-    client = native.GtRNative(base_url, page_size=100, serialisation="json", username=username, password=password)
-    cerif_client = cerif.GtRCerif(base_url, page_size=100, serialisation="json", username=username, password=password)
-    
-    # do projects
-    if project_callback is not None and (project_limit > 0 or project_limit is None):
-        projects = client.projects()
-        _mine(projects, project_limit, project_callback, "project", min_request_gap, pass_cerif=pass_cerif_project, native_client=client, cerif_client=cerif_client)
-    
-    # do people
-    if person_callback is not None and (person_limit > 0 or person_limit is None):
-        people = client.people()
-        _mine(people, person_limit, person_callback, "person", min_request_gap)
-    
-    # do organisations
-    if organisation_callback is not None and (organisation_limit > 0 or organisation_limit is None):
-        organisations = client.organisations()
-        _mine(organisations, organisation_limit, organisation_callback, "organisation", min_request_gap)
-    
-    # do publications
-    if publication_callback is not None and (publication_limit > 0 or publication_limit is None):
-        publications = client.publications()
-        _mine(publications, publication_limit, publication_callback, "publication", min_request_gap)
+    client = native.GtRNative(base_url, page_size=100, serialisation="json", username=username, password=password,
+                                stats=stats, hooks=hooks, identity_map=identity_map, transport=transport,
+                                limiter=limiter, hedge=hedge)
+    cerif_client = cerif.GtRCerif(base_url, page_size=100, serialisation="json", username=username, password=password, 
+                                    warm_class_cache=pass_cerif_project, stats=stats, hooks=client.hooks,
+                                    transport=client.transport, limiter=client.limiter, hedge=client.hedger)
+    
+    pipelining = None
+    if pipeline:
+        pipelining = _Pipelining(max(callback_workers, 1), max(queue_size, 1), ordered)
+    
+    batching = (batch_size, batch_window, batch_per_page, min_request_gap, checkpoint_callback)
+    project_callback, project_batcher = _batching(project_callback, project_batch_callback, "project", *batching)
+    person_callback, person_batcher = _batching(person_callback, person_batch_callback, "person", *batching)
+    organisation_callback, organisation_batcher = _batching(organisation_callback, organisation_batch_callback, "organisation", *batching)
+    publication_callback, publication_batcher = _batching(publication_callback, publication_batch_callback, "publication", *batching)
+    
+    # the sinks need whole entities, so the types they take cannot be projected
+    if sinks:
+        crawled = [("project", project_callback, project_limit), ("person", person_callback, person_limit),
+                    ("organisation", organisation_callback, organisation_limit), 
+                    ("publication", publication_callback, publication_limit)]
+        for sink in sinks:
+            if not any([_takes(sink, kind, callback, limit) for kind, callback, limit in crawled]):
+                raise ValueError("the crawl would pass nothing to the sink %r: give it kinds, or a callback "
+                                    "or a limit for the types it should take" % (sink,))
+        project_callback = _sink_callback(project_callback, sinks, "project", project_limit, _fields_for(fields, "project"))
+        person_callback = _sink_callback(person_callback, sinks, "person", person_limit, _fields_for(fields, "person"))
+        organisation_callback = _sink_callback(organisation_callback, sinks, "organisation", organisation_limit, _fields_for(fields, "organisation"))
+        publication_callback = _sink_callback(publication_callback, sinks, "publication", publication_limit, _fields_for(fields, "publication"))
+    
+    # the client's hedger (if it made one) is stopped at the end of the crawl
+    try:
+        # do projects
+        if project_callback is not None and (project_limit > 0 or project_limit is None):
+            projects = client.projects()
+            _mine(projects, project_limit, project_callback, "project", min_request_gap, pass_cerif=pass_cerif_project, native_client=client, cerif_client=cerif_client, workers=workers,
+                    profile=profile, log_every=log_every, pipelining=pipelining, batcher=project_batcher,
+                    detail=_detail(client, "project", fields))
+        
+        # do people
+        if person_callback is not None and (person_limit > 0 or person_limit is None):
+            people = client.people()
+            _mine(people, person_limit, person_callback, "person", min_request_gap, native_client=client, workers=workers,
+                    profile=profile, log_every=log_every, pipelining=pipelining, batcher=person_batcher,
+                    detail=_detail(client, "person", fields))
+        
+        # do organisations
+        if organisation_callback is not None and (organisation_limit > 0 or organisation_limit is None):
+            organisations = client.organisations()
+            _mine(organisations, organisation_limit, organisation_callback, "organisation", min_request_gap, native_client=client, workers=workers,
+                    profile=profile, log_every=log_every, pipelining=pipelining, batcher=organisation_batcher,
+                    detail=_detail(client, "organisation", fields))
+        
+        # do publications
+        if publication_callback is not None and (publication_limit > 0 or publication_limit is None):
+            publications = client.publications()
+            _mine(publications, publication_limit, publication_callback, "publication", min_request_gap, native_client=client, workers=workers,
+                    profile=profile, log_every=log_every, pipelining=pipelining, batcher=publication_batcher,
+                    detail=_detail(client, "publication", fields))
+    finally:
+        client.close()
+    
+    profile.finish()
+    if profile is not _NO_PROFILE:
+        return profile
+    return stats
                 
-def _mine(iterable, limit, callback, name, min_request_gap=0, fetch=True, load_all_projects=False, pass_cerif=False, native_client=None, cerif_client=None):
+def watch(base_url, username=None, password=None, project_callback=None, person_callback=None,
+            organisation_callback=None, publication_callback=None, interval=300, polls=None, state=None,
+            seen_pages=1, max_pages=None, page_size=100, stats=None, hooks=None, transport=None, limiter=None):
+    """
+    poll the first pages of each list for new and changed records, every interval seconds
+    (for polls polls, or forever), passing each change to the relevant callback as
+    callback(event, entity), where event is "new" or "changed" and entity is built from the
+    record in the list (it is not fetched in full).
+    
+    A record is recognised by its id and a fingerprint of its content, which are kept in
+    state (a WatchState, which may be saved and loaded to resume watching).  Each poll of a
+    list stops after seen_pages pages in a row with no changes (or after max_pages pages),
+    so the first poll with an empty state reads the whole list, and later polls read only
+    as far as the changes go.  A record's fingerprint is only stored once its callback has
+    returned, so a change whose callback raised is passed on again by the next poll.
+    Records which are deleted from the API are not noticed
+    
+    returns the state
+    """
+    if stats is True:
+        stats = ClientStats()
+    if state is None:
+        state = WatchState()
+    
+    client = native.GtRNative(base_url, page_size=page_size, serialisation="json", username=username, password=password,
+                                stats=stats, hooks=hooks, transport=transport, limiter=limiter)
+    lists = [
+        (project_callback, "project", client.projects),
+        (person_callback, "person", client.people),
+        (organisation_callback, "organisation", client.organisations),
+        (publication_callback, "publication", client.publications)
+    ]
+    
+    poll = 0
+    while polls is None or poll < polls:
+        start = time.time()
+        for callback, name, listing in lists:
+            if callback is not None:
+                pages, changes = _poll(client, listing, name, callback, state, seen_pages, max_pages)
+                log.info("watch: " + str(changes) + " " + name + " changes in " + str(pages) + " pages")
+        poll += 1
+        if polls is not None and poll >= polls:
+            break
+        wait = interval - (time.time() - start)
+        if wait > 0:
+            time.sleep(wait)
+    return state
+
+def _poll(client, listing, name, callback, state, seen_pages, max_pages):
+    """
+    read the list from the first page until there have been seen_pages pages in a row with
+    no changes, passing the changes to the callback.  Returns the number of pages read and
+    the number of changes
+    """
+    first = listing()
+    if first is None:
+        return 0, 0
+    pages, changes, unchanged = 0, 0, 0
+    for raw, _ in first.iter_raw_pages(reset_pages=False):
+        pages += 1
+        list_dao = client.factory._load(client, raw, first.kind)
+        changed = []
+        for i, data in enumerate(list_dao.records()):
+            event, fingerprint = state.check(name, data)
+            if event is not None:
+                changed.append((i, event, data.get("id"), fingerprint))
+        if len(changed) > 0:
+            # only build entities for the pages which have changes
+            entities = getattr(list_dao, first.kind)(client)
+            for i, event, id, fingerprint in changed:
+                callback(event, entities[i])
+                state.seen(name, id, fingerprint)
+            changes += len(changed)
+            unchanged = 0
+        else:
+            unchanged += 1
+        if unchanged >= seen_pages or (max_pages is not None and pages >= max_pages):
+            break
+    return pages, changes
+
+class WatchState(object):
+    """
+    the fingerprint of every record seen by watch(), by entity type and id
+    """
+    def __init__(self, fingerprints=None):
+        self.fingerprints = fingerprints if fingerprints is not None else {}
+    
+    def check(self, name, data):
+        """
+        whether the record is "new", "changed" or (if it is unchanged) None, and its fingerprint
+        """
+        fingerprint = fingerprint_record(data)
+        previous = self.fingerprints.get(name, {}).get(data.get("id"))
+        if previous is None:
+            return "new", fingerprint
+        if previous != fingerprint:
+            return "changed", fingerprint
+        return None, fingerprint
+    
+    def seen(self, name, id, fingerprint):
+        self.fingerprints.setdefault(name, {})[id] = fingerprint
+    
+    def __len__(self):
+        return sum([len(f) for f in self.fingerprints.values()])
+    
+    def save(self, path):
+        with open(path, "wb") as f:
+            json.dump(self.fingerprints, f, separators=(",", ":"))
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(json.load(f))
+
+def fingerprint_record(data):
+    """
+    a checksum of the record's content, which does not depend on the order of its keys
+    """
+    return zlib.crc32(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")) & 0xffffffff
+
+def _sink_callback(callback, sinks, name, limit=None, fields=None):
+    """
+    a callback which passes each entity to the sinks which take its type as well as to the
+    callback (if there is one).  Sinks without kinds only take the types which were asked
+    for, with a callback or a limit.  A type which the sinks take cannot be projected onto
+    fields
+    """
+    taking = [sink for sink in sinks if _takes(sink, name, callback, limit)]
+    if len(taking) == 0:
+        return callback
+    if fields is not None:
+        raise ValueError("the sinks take whole %s entities, so they cannot be projected onto fields" % name)
+    def f(entity, *args):
+        for sink in taking:
+            sink.add(name, entity)
+        if callback is not None:
+            callback(entity, *args)
+    return f
+                
+def _takes(sink, name, callback, limit):
+    """
+    whether the sink takes the entities of the given type from a crawl with the given 
+    callback and limit for it
+    """
+    if limit == 0:
+        return False
+    kinds = getattr(sink, "kinds", None)
+    if kinds is not None:
+        return name in kinds
+    return callback is not None or (limit is not None and limit > 0)
+
+def _mine(iterable, limit, callback, name, min_request_gap=0, fetch=True, load_all_projects=False, pass_cerif=False, native_client=None, cerif_client=None, workers=1,
+            profile=None, log_every=1, pipelining=None, batcher=None, detail=None):
+    """
+    pass each of the listed entities to the callback.  If fetch is set, detail(entity) 
+    fetches what is passed in its place (by default, the entity itself, fully fetched), or 
+    returns None if it could not be fetched
+    """
     if limit == 0:
         return
     
     if callback is None:
         return
-        
+    
+    if detail is None:
+        detail = _fetch_entity
+    
+    if pipelining is not None:
+        _pipeline(iterable, limit, callback, name, min_request_gap, fetch, load_all_projects, pass_cerif, native_client, cerif_client, workers,
+                    profile, log_every, pipelining, detail)
+        if batcher is not None:
+            batcher.flush()
+        return
+    
+    instrumented = native_client is not None and (native_client.stats is not None or native_client.hooks.active)
+    if profile is None:
+        profile = _NO_PROFILE
+    log_every = max(log_every, 1)
+    
+    pool = None
+    if workers > 1 or pass_cerif:
+        pool = multiprocessing_pool.ThreadPool(max(workers, 1))
+    
+    # the detail and CERIF requests are spaced out by min_request_gap, in whichever thread
+    pacer = _Pacer(min_request_gap)
+    mine_start = time.time()
     count = 0
-    for p in iterable:
-        start = time.time()
-        
-        count += 1
-        if limit is not None and count > limit:
-            break
+    delivered = 0
+    try:
+        total = len(iterable)
+        pages = profile.staged("list", iterable.page_iterator)
+        while True:
+            page = profile.staged("list", next, pages, None)
+            if page is None:
+                break
+            if limit is not None:
+                page = page[:max(limit - count, 0)]
+            if len(page) == 0:
+                break
+            
+            # issue the detail and CERIF requests for the whole page up front, so that
+            # they proceed while we work through the page in order
+            fetches, cerifs = _prefetch(page, pool, detail if fetch and workers > 1 else None, pass_cerif, cerif_client, profile, pacer)
+            
+            for i, p in enumerate(page):
+                start = time.time()
+                count += 1
+                logging_record = count % log_every == 0 and log.isEnabledFor(logging.INFO)
+                
+                item = p
+                if fetch:
+                    item = fetches[i].get() if i in fetches else _paced(pacer, profile, "detail", detail, p)
+                    if item is None:
+                        log.info("skipping %s %s (%s of %s)", name, p.id(), count, total)
+                        continue
+                
+                if logging_record:
+                    log.info("processing %s %s (%s of %s)", name, p.id(), count, total)
+                
+                if load_all_projects:
+                    log.info("loading all projects for this entity")
+                    item.load_all_projects()
+                
+                if pass_cerif:
+                    c = None
+                    if p.id() in cerifs:
+                        c = cerifs[p.id()].get()
+                    callback_start = time.time()
+                    callback(item, c)
+                else:
+                    callback_start = time.time()
+                    callback(item)
+                
+                end = time.time()
+                delivered += 1
+                profile.add("callback", end - callback_start)
+                profile.record(name, p.id(), end - start)
+                if instrumented:
+                    native_client.record_callback(name, item, end - callback_start)
+            
+            if batcher is not None:
+                batcher.page_done()
         
+        if batcher is not None:
+            batcher.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        profile.entity_done(name, delivered, time.time() - mine_start)
+
+def _fields_for(fields, name):
+    if isinstance(fields, dict):
+        return fields.get(name)
+    return fields
+
+def _fetch_entity(entity):
+    return entity if entity.fetch() else None
+
+def _detail(client, name, fields):
+    """
+    the detail function for _mine: with fields for the type, each entity's detail record is
+    fetched straight into a compact record of those fields, and the response is then dropped
+    """
+    fields = _fields_for(fields, name)
+    if fields is None:
+        return _fetch_entity
+    fields = tuple(fields)
+    def f(entity):
+        return client.record(name, entity.id(), fields)
+    return f
+
+def _batching(callback, batch_callback, name, size, window, per_page, min_gap, checkpoint):
+    """
+    if there is a batch callback, a _Batcher for it, and a callback which passes each entity
+    to the batcher as well as to the callback (if there is one)
+    """
+    if batch_callback is None:
+        return callback, None
+    batcher = _Batcher(name, batch_callback, size, window, per_page, min_gap, checkpoint)
+    def f(entity, *args):
+        if callback is not None:
+            callback(entity, *args)
+        batcher.add(entity, *args)
+    return f, batcher
+
+class _Batcher(object):
+    """
+    collects crawled entities into batches for a batch callback (see crawl)
+    """
+    def __init__(self, name, callback, size=100, window=None, per_page=False, min_gap=0, checkpoint=None):
+        self.name = name
+        self.callback = callback
+        self.size = size
+        self.window = window
+        self.per_page = per_page
+        self.checkpoint = checkpoint
+        self.delivered = 0
+        self._pacer = _Pacer(min_gap)
+        self._batch = []
+        self._started = None
+        self._lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+    
+    def add(self, entity, *args):
+        with self._lock:
+            if len(self._batch) == 0:
+                self._started = time.time()
+            self._batch.append((entity,) + args if len(args) > 0 else entity)
+            full = self.size is not None and len(self._batch) >= self.size
+            batch = self._take() if full or self._waited() else None
+        if batch is not None:
+            self._deliver(batch)
+    
+    def page_done(self):
+        with self._lock:
+            batch = self._take() if self.per_page or self._waited() else None
+        if batch is not None:
+            self._deliver(batch)
+    
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch is not None:
+            self._deliver(batch)
+    
+    def _waited(self):
+        return self.window is not None and self._started is not None and time.time() - self._started >= self.window
+    
+    def _take(self):
+        if len(self._batch) == 0:
+            return None
+        batch, self._batch, self._started = self._batch, [], None
+        return batch
+    
+    def _deliver(self, batch):
+        # batches are delivered one at a time, so that the checkpoints are in order
+        with self._deliver_lock:
+            self._pacer.wait()
+            self.callback(batch)
+            self.delivered += len(batch)
+            if self.checkpoint is not None:
+                last = batch[-1]
+                if isinstance(last, tuple) and not hasattr(last, "_fields"):
+                    last = last[0]
+                self.checkpoint(self.name, self.delivered, _id(last))
+
+def _id(entity):
+    """
+    the id of an entity, or of a record projected from one (None if it has no id field)
+    """
+    if hasattr(entity, "_fields"):
+        return getattr(entity, "id", None)
+    return entity.id()
+
+_Pipelining = namedtuple("_Pipelining", ["callback_workers", "queue_size", "ordered"])
+
+_DONE = object()
+
+def _pipeline(iterable, limit, callback, name, min_request_gap=0, fetch=True, load_all_projects=False, pass_cerif=False, native_client=None, cerif_client=None, workers=1,
+                profile=None, log_every=1, pipelining=None, detail=None):
+    """
+    the pipelined version of _mine: this thread lists the pages and fetches their entities
+    (with a pool of workers if there is more than one), putting them on a bounded queue, which
+    the callback workers drain.  When the queue is full, listing and fetching wait
+    """
+    instrumented = native_client is not None and (native_client.stats is not None or native_client.hooks.active)
+    if profile is None:
+        profile = _NO_PROFILE
+    if pipelining is None:
+        pipelining = _Pipelining(1, 100, True)
+    log_every = max(log_every, 1)
+    
+    entities = Queue.Queue(pipelining.queue_size)
+    stop = threading.Event()
+    errors = []
+    lock = threading.Lock()
+    counts = {"count" : 0, "delivered" : 0}
+    pacer = _Pacer(min_request_gap)
+    mine_start = time.time()
+    total = len(iterable)
+    
+    def prepare(p):
+        # runs in the fetch workers
+        item = p
         if fetch:
-            if not p.fetch():
-                log.info("skipping " + str(name) + " " + str(p.id()) + " (" + str(count) + " of " + str(len(iterable)) + ")")
-                continue
-        
-        log.info("processing " + str(name) + " " + str(p.id()) + " (" + str(count) + " of " + str(len(iterable)) + ")")
-        
+            item = _paced(pacer, profile, "detail", detail, p)
+            if item is None:
+                return p, None, None
         if load_all_projects:
-            log.info("loading all projects for this entity")
-            p.load_all_projects()
-        
-        if pass_cerif:
-            c = None
-            if isinstance(p, native.Project):
-                c = cerif_client.project(p.id())
-            callback(p, c)
-        else:
-            callback(p)
-        
-        end = time.time()
-        diff = end - start
-        if diff < min_request_gap:
-            wait = min_request_gap - diff
-            log.debug("sleeping for " + str(wait) + "s")
+            item.load_all_projects()
+        c = None
+        if pass_cerif and isinstance(p, native.Project):
+            c = _paced(pacer, profile, "cerif", cerif_client.project, p.id())
+        return p, item, c
+    
+    def failed(e):
+        with lock:
+            errors.append(e)
+        stop.set()
+    
+    def consume():
+        while True:
+            item = entities.get()
+            if item is _DONE:
+                break
+            if stop.is_set():
+                continue # keep draining, so that the producer is never stuck
+            p, fetched, c = item
+            try:
+                with lock:
+                    counts["count"] += 1
+                    count = counts["count"]
+                if count % log_every == 0 and log.isEnabledFor(logging.INFO):
+                    log.info("processing %s %s (%s of %s)", name, p.id(), count, total)
+                
+                callback_start = time.time()
+                if pass_cerif:
+                    callback(fetched, c)
+                else:
+                    callback(fetched)
+                end = time.time()
+                
+                with lock:
+                    counts["delivered"] += 1
+                profile.add("callback", end - callback_start)
+                profile.record(name, p.id(), end - callback_start)
+                if instrumented:
+                    native_client.record_callback(name, fetched, end - callback_start)
+            except Exception as e:
+                failed(e)
+    
+    consumers = [threading.Thread(target=consume) for _ in range(pipelining.callback_workers)]
+    for t in consumers:
+        t.daemon = True
+        t.start()
+    
+    pool = None
+    if workers > 1:
+        pool = multiprocessing_pool.ThreadPool(workers)
+    try:
+        listed = 0
+        pages = profile.staged("list", iterable.page_iterator)
+        while not stop.is_set():
+            page = profile.staged("list", next, pages, None)
+            if page is None:
+                break
+            if limit is not None:
+                page = page[:max(limit - listed, 0)]
+            if len(page) == 0:
+                break
+            listed += len(page)
+            
+            if pool is None:
+                prepared = (prepare(p) for p in page)
+            elif pipelining.ordered:
+                prepared = pool.imap(prepare, page)
+            else:
+                prepared = pool.imap_unordered(prepare, page)
+            
+            for p, fetched, c in prepared:
+                if fetched is None:
+                    log.info("skipping %s %s", name, p.id())
+                    continue
+                if not _put(entities, (p, fetched, c), stop):
+                    break
+    except Exception as e:
+        failed(e)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for t in consumers:
+            entities.put(_DONE)
+        for t in consumers:
+            t.join()
+        profile.entity_done(name, counts["delivered"], time.time() - mine_start)
+    
+    if len(errors) > 0:
+        raise errors[0]
+
+def _put(q, item, stop):
+    """
+    put the item on the queue, waiting for space unless the pipeline is stopped
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+class _Pacer(object):
+    """
+    spaces out events (across threads) so that successive ones start at least gap seconds apart
+    """
+    def __init__(self, gap):
+        self.gap = gap
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        if self.gap <= 0:
+            return 0
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next)
+            self._next = at + self.gap
+        wait = at - now
+        if wait > 0:
             time.sleep(wait)
+        return wait
+
+def _paced(pacer, profile, stage, fn, *args):
+    """
+    wait for the pacer (if any), then call fn, which makes a request, in the given profile
+    stage
+    """
+    if pacer is not None:
+        wait = pacer.wait()
+        if wait > 0:
+            profile.add("rate_limit_wait", wait)
+    return profile.staged(stage, fn, *args)
+
+def _prefetch(page, pool, detail, pass_cerif, cerif_client, profile=None, pacer=None):
+    """
+    submit the detail fetch (if there is a detail function) for each element of the page 
+    (keyed by position) and the CERIF
+    lookup for each project (keyed by project id) to the pool, returning the pending results.
+    Each request waits for the pacer (if any) when its turn comes
+    """
+    if profile is None:
+        profile = _NO_PROFILE
+    fetches = {}
+    cerifs = {}
+    for i, p in enumerate(page):
+        if detail is not None:
+            fetches[i] = pool.apply_async(_paced, (pacer, profile, "detail", detail, p))
+        if pass_cerif and isinstance(p, native.Project):
+            pid = p.id()
+            if pid not in cerifs:
+                cerifs[pid] = pool.apply_async(_paced, (pacer, profile, "cerif", cerif_client.project, pid))
+    return fetches, cerifs
+
+class CrawlProfile(object):
+    """
+    Breakdown of where the time in a crawl goes, gathered via the clients' hooks:
+    
+    list_fetch, detail_fetch, cerif_fetch: time waiting on the API for list pages, detail
+        records and CERIF records (other_fetch is anything else, such as the CERIF classes)
+    parse: time spent parsing responses
+    wrap: time spent building the entity objects for each list page
+    callback: time spent in the callbacks
+    rate_limit_wait: time spent sleeping to honour min_request_gap
+    
+    Detail and CERIF fetches may run concurrently, in which case their times are summed
+    across threads and may exceed the elapsed time.  The profile also records the
+    throughput for each entity type, and the slowest records
+    """
+    
+    stages = ("list_fetch", "detail_fetch", "cerif_fetch", "other_fetch", "parse", "wrap", "callback", "rate_limit_wait")
+    
+    def __init__(self, slowest=10):
+        self.slowest_count = slowest
+        self.stats = None
+        self.times = dict([(stage, 0.0) for stage in self.stages])
+        self.entities = {}
+        self.started = time.time()
+        self.finished = None
+        self._slowest = []
+        self._list_wall = 0.0
+        self._list_io = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+    
+    def install(self, hooks):
+        hooks.add("after_request", self._after_request)
+        hooks.add("after_parse", self._after_parse)
+    
+    def staged(self, stage, fn, *args):
+        """
+        call fn, attributing any requests it makes (in this thread) to the given stage
+        """
+        previous = getattr(self._local, "stage", None)
+        self._local.stage = stage
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self._local.stage = previous
+            if stage == "list":
+                with self._lock:
+                    self._list_wall += time.time() - start
+    
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.times[stage] += elapsed
+    
+    def record(self, entity, record_id, elapsed):
+        with self._lock:
+            item = (elapsed, entity, record_id)
+            if len(self._slowest) < self.slowest_count:
+                heapq.heappush(self._slowest, item)
+            elif elapsed > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+    
+    def entity_done(self, entity, records, elapsed):
+        with self._lock:
+            e = self.entities.setdefault(entity, {"records" : 0, "elapsed" : 0.0})
+            e["records"] += records
+            e["elapsed"] += elapsed
+    
+    def finish(self):
+        self.finished = time.time()
+    
+    def _after_request(self, info):
+        stage = getattr(self._local, "stage", None)
+        key = stage + "_fetch" if stage in ("list", "detail", "cerif") else "other_fetch"
+        with self._lock:
+            self.times[key] += info["elapsed"]
+            if stage == "list":
+                self._list_io += info["elapsed"]
+    
+    def _after_parse(self, info):
+        with self._lock:
+            self.times["parse"] += info["elapsed"]
+            if getattr(self._local, "stage", None) == "list":
+                self._list_io += info["elapsed"]
+    
+    def report(self):
+        with self._lock:
+            times = dict(self.times)
+            times["wrap"] = max(self._list_wall - self._list_io, 0.0)
+            entities = {}
+            for k, v in self.entities.items():
+                rate = v["records"] / v["elapsed"] if v["elapsed"] > 0 else None
+                entities[k] = {"records" : v["records"], "elapsed" : v["elapsed"], "records_per_s" : rate}
+            slowest = [{"entity" : e, "id" : i, "elapsed" : t} for t, e, i in sorted(self._slowest, reverse=True)]
+        end = self.finished if self.finished is not None else time.time()
+        return {"elapsed" : end - self.started, "stages" : times, "entities" : entities, "slowest" : slowest}
+    
+    def __str__(self):
+        r = self.report()
+        lines = ["crawl took %.2fs" % r["elapsed"]]
+        for stage in self.stages:
+            lines.append("  %-16s %10.3fs" % (stage, r["stages"][stage]))
+        for entity, e in sorted(r["entities"].items()):
+            lines.append("  %-16s %10d records %10.1f/s" % (entity, e["records"], e["records_per_s"] or 0))
+        for s in r["slowest"]:
+            lines.append("  slow: %s %s %.3fs" % (s["entity"], s["id"], s["elapsed"]))
+        return "\n".join(lines)
+
+class _NullProfile(object):
+    """
+    stands in for a CrawlProfile when profiling is switched off
+    """
+    def staged(self, stage, fn, *args):
+        return fn(*args)
+    
+    def add(self, stage, elapsed):
+        pass
+    
+    def record(self, entity, record_id, elapsed):
+        pass
+    
+    def entity_done(self, entity, records, elapsed):
+        pass
+    
+    def finish(self):
+        pass
+
+_NO_PROFILE = _NullProfile()
@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name = 'gtr',
     version = '0.0.1',
-    packages = find_packages(),
+    packages = find_packages(exclude=["benchmarks", "benchmarks.*", "tests", "tests.*"]),
     install_requires = [
         "requests==1.1.0",
         "lxml"
@@ -0,0 +1,190 @@
+import copy, os, shutil, tempfile, threading, time, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import cerif
+from gtr.cerif import CerifClassCache
+
+def _class(i, term):
+    return {"cfClassId" : "class-%d" % i, "cfDescrOrCfDescrSrcOrCfTerm" : [
+                {"JAXBElement" : {"name" : cerif.TERM_RELATION, "value" : {"value" : term}}}]}
+
+class Loader(object):
+    """
+    a class loader which answers with each of the given results in turn (the last one
+    for ever), raising any which is an exception, and counts its calls
+    """
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results[0] if len(self.results) == 1 else self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class CerifClassCacheTest(unittest.TestCase):
+
+    def test_loaded_once(self):
+        loader = Loader([_class(1, "Funder"), None])
+        cache = CerifClassCache(loader)
+        self.assertEqual(cache.term("class-1"), "Funder")
+        self.assertEqual(cache.get("class-1")["cfClassId"], "class-1")
+        self.assertIsNone(cache.term("class-2"))
+        self.assertEqual(loader.calls, 1)
+
+    def test_failures_back_off(self):
+        loader = Loader(None)
+        cache = CerifClassCache(loader, retry_delay=0.2, max_retry_delay=0.3)
+        self.assertIsNone(cache.term("class-1"))
+        self.assertIsNone(cache.term("class-1"))
+        self.assertEqual(loader.calls, 1)
+        time.sleep(0.25)
+        self.assertIsNone(cache.term("class-1"))
+        self.assertEqual(loader.calls, 2)
+        # the delay doubles, up to the maximum
+        time.sleep(0.2)
+        cache.term("class-1")
+        self.assertEqual(loader.calls, 2)
+        time.sleep(0.15)
+        cache.term("class-1")
+        self.assertEqual(loader.calls, 3)
+
+    def test_errors_back_off(self):
+        loader = Loader(IOError("down"), [_class(1, "Funder")])
+        cache = CerifClassCache(loader, retry_delay=0.1)
+        self.assertRaises(IOError, cache.term, "class-1")
+        self.assertIsNone(cache.term("class-1"))
+        self.assertEqual(loader.calls, 1)
+        time.sleep(0.12)
+        self.assertEqual(cache.term("class-1"), "Funder")
+        self.assertEqual(loader.calls, 2)
+
+    def test_stale_data_kept_on_failure(self):
+        loader = Loader([_class(1, "Funder")], None)
+        cache = CerifClassCache(loader, ttl=0.05, retry_delay=10)
+        self.assertEqual(cache.term("class-1"), "Funder")
+        time.sleep(0.06)
+        self.assertEqual(cache.term("class-1"), "Funder")
+        self.assertEqual(cache.term("class-1"), "Funder")
+        self.assertEqual(loader.calls, 2)
+
+    def test_warm(self):
+        loader = Loader([_class(1, "Funder")])
+        cache = CerifClassCache(loader)
+        cache.warm().join(5)
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(cache.term("class-1"), "Funder")
+        self.assertEqual(loader.calls, 1)
+
+    def test_warm_failure_is_not_raised(self):
+        loader = Loader(IOError("down"))
+        cache = CerifClassCache(loader, retry_delay=10)
+        cache.warm().join(5)
+        # the failure is remembered, so the lookup does not try again yet
+        self.assertIsNone(cache.term("class-1"))
+        self.assertEqual(loader.calls, 1)
+
+    def test_persisted(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "classes.json")
+            CerifClassCache(Loader([_class(1, "Funder")]), path=path).classes()
+            loader = Loader(None)
+            self.assertEqual(CerifClassCache(loader, path=path).term("class-1"), "Funder")
+            self.assertEqual(loader.calls, 0)
+        finally:
+            shutil.rmtree(directory)
+
+def _relation(name, **value):
+    return {"JAXBElement" : {"name" : name, "value" : value}}
+
+class RelationIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # no requests are made, so the client needs no server
+        self.client = cerif.GtRCerif("http://localhost:1", warm_class_cache=False)
+        self.raw = {"cfClassOrCfClassSchemeOrCfClassSchemeDescr" : [{"cfProj" : {"cfProjId" : "p1",
+                        "cfTitleOrCfAbstrOrCfKeyw" : [
+                            _relation(cerif.CERIF_NS + "cfTitle", value="A project"),
+                            _relation(cerif.PROJ_ORGUNIT_RELATION, cfOrgUnitId="o1", cfClassId="lead"),
+                            _relation(cerif.PROJ_ORGUNIT_RELATION, cfOrgUnitId="o2", cfClassId="partner"),
+                            {"cfOther" : {}}]}}]}
+
+    def test_by_name_and_key(self):
+        project = cerif.Project(self.client, self.raw)
+        self.assertEqual([r.class_id() for r in project.org_cerif_relations()], ["lead", "partner"])
+        self.assertEqual([r.class_id() for r in project.org_cerif_relations("o2")], ["partner"])
+        self.assertEqual(project.org_cerif_relations("o3"), [])
+        self.assertIsNone(project.dao.cerif_relations(self.client))
+
+    def test_built_once(self):
+        project = cerif.Project(self.client, self.raw)
+        project.org_cerif_relations()
+        index = project.dao._index
+        # the lookups hand out copies, which do not change the index
+        project.org_cerif_relations().pop()
+        self.assertEqual(len(project.org_cerif_relations()), 2)
+        self.assertIs(project.dao._index, index)
+
+    def test_rebuilt_for_new_data(self):
+        project = cerif.Project(self.client, self.raw)
+        project.org_cerif_relations()
+        raw = copy.deepcopy(self.raw)
+        raw["cfClassOrCfClassSchemeOrCfClassSchemeDescr"][0]["cfProj"]["cfTitleOrCfAbstrOrCfKeyw"].pop()
+        raw["cfClassOrCfClassSchemeOrCfClassSchemeDescr"][0]["cfProj"]["cfTitleOrCfAbstrOrCfKeyw"].pop()
+        project.dao.raw = raw
+        self.assertEqual([r.class_id() for r in project.org_cerif_relations()], ["lead"])
+
+    def test_class_term(self):
+        cls = cerif.CerifClass(self.client, _class(1, "Funder"))
+        self.assertEqual([r.value() for r in cls.term_cerif_relations()], ["Funder"])
+        self.assertEqual(cls.dao.cerif_relations(self.client, name=cerif.TERM_RELATION)[0].value(), "Funder")
+
+class WarmUpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(projects=10).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def wait_for_requests(self, n, timeout=5):
+        deadline = time.time() + timeout
+        while self.server.requests < n and time.time() < deadline:
+            time.sleep(0.01)
+        return self.server.requests
+
+    def test_warmed_on_first_use(self):
+        client = cerif.GtRCerif(self.server.base_url)
+        time.sleep(0.1)
+        self.assertEqual(self.server.requests, 0)
+        self.assertIsNotNone(client.project(uuid("project", 0)))
+        # the class listing is loaded in the background, without a term lookup
+        self.assertEqual(self.wait_for_requests(2), 2)
+        self.assertEqual(client.cerif_term(uuid("class", 0)), "Lead Research Organisation")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_lookup_during_warm_up(self):
+        client = cerif.GtRCerif(self.server.base_url)
+        client.project(uuid("project", 0))
+        terms = []
+        threads = [threading.Thread(target=lambda: terms.append(client.cerif_term(uuid("class", 3))))
+                        for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(terms, ["Funder"] * 4)
+        # one project and one class listing, however the lookups and the warm-up overlap
+        self.assertEqual(self.wait_for_requests(2), 2)
+
+    def test_not_warmed(self):
+        client = cerif.GtRCerif(self.server.base_url, warm_class_cache=False)
+        client.project(uuid("project", 0))
+        time.sleep(0.1)
+        self.assertEqual(self.server.requests, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import copy, threading, time, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+from gtr.common import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+    
+    def call_together(self, flight, fn, n=4, copier=None):
+        """
+        make n calls to flight.do at once, the first of which leads, returning the results
+        (or exceptions) in order
+        """
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def leader():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return fn()
+        results = [None] * n
+        def run(i):
+            try:
+                results[i] = flight.do("key", leader if i == 0 else None, copier)
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=run, args=(0,))]
+        threads[0].start()
+        started.wait()
+        threads.extend([threading.Thread(target=run, args=(i,)) for i in range(1, n)])
+        for t in threads[1:]:
+            t.start()
+        while flight._calls["key"].waiters < n - 1:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        return results
+    
+    def test_coalesced(self):
+        flight = SingleFlight()
+        result = {"a" : [1]}
+        results = self.call_together(flight, lambda: result)
+        self.assertTrue(all([r is result for r in results]))
+        self.assertEqual(flight.saved, 3)
+        self.assertEqual(flight.in_flight(), 0)
+    
+    def test_waiters_get_copies(self):
+        flight = SingleFlight()
+        results = self.call_together(flight, lambda: {"a" : [1]}, copier=copy.deepcopy)
+        for r in results:
+            r["a"].append(2)
+        self.assertEqual([r["a"] for r in results], [[1, 2]] * 4)
+        self.assertEqual(len(set([id(r) for r in results])), 4)
+    
+    def test_no_copy_without_waiters(self):
+        copies = []
+        def copier(x):
+            copies.append(x)
+            return x
+        result = {}
+        self.assertTrue(SingleFlight().do("key", lambda: result, copier) is result)
+        self.assertEqual(copies, [])
+    
+    def test_errors_are_shared(self):
+        def fail():
+            raise IOError("failed")
+        results = self.call_together(SingleFlight(), fail, copier=copy.deepcopy)
+        self.assertTrue(all([isinstance(r, IOError) for r in results]))
+
+class CoalescedRequestTest(unittest.TestCase):
+    
+    def test_own_copies(self):
+        server = StubServer(projects=10, latency=0.2).start()
+        try:
+            client = native.GtRNative(server.base_url)
+            organisations = [None, None]
+            def get(i):
+                organisations[i] = client.organisation(uuid("organisation", 0))
+            threads = [threading.Thread(target=get, args=(i,)) for i in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(client.coalesced_requests(), 1)
+            a, b = organisations
+            self.assertFalse(a.dao.raw is b.dao.raw)
+            self.assertEqual(a.dao.raw, b.dao.raw)
+            # adding projects to one does not add them to the other
+            count = len(b.projects())
+            a.dao.add_projects(a.projects())
+            self.assertEqual(len(a.projects()), 2 * count)
+            self.assertEqual(len(b.projects()), count)
+        finally:
+            server.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import gzip, io, unittest, zlib
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+from gtr.compression import CompressedBody, BodyCache, decompress, read_response
+
+CONTENT = b'{"projectOverview" : {"projectComposition" : {}}}' * 20
+
+def _gzip(data):
+    out = io.BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb")
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+def _raw_deflate(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+class Raw(object):
+    """
+    the raw stream of a requests response
+    """
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size, decode_content=True):
+        return self.stream.read(size)
+
+class Response(object):
+    def __init__(self, data, encoding=None):
+        self.raw = Raw(data)
+        self.headers = {"content-encoding" : encoding} if encoding is not None else {}
+
+class DecompressTest(unittest.TestCase):
+
+    def test_encodings(self):
+        self.assertEqual(decompress(_gzip(CONTENT), "gzip"), CONTENT)
+        self.assertEqual(decompress(zlib.compress(CONTENT), "deflate"), CONTENT)
+        self.assertEqual(decompress(_raw_deflate(CONTENT), "deflate"), CONTENT)
+        self.assertEqual(decompress(CONTENT, "identity"), CONTENT)
+
+    def test_read_response_in_chunks(self):
+        for data, encoding in [(_gzip(CONTENT), "gzip"), (_raw_deflate(CONTENT), "deflate"), (CONTENT, None)]:
+            body, content = read_response(Response(data, encoding), chunk_size=7)
+            self.assertEqual(content, CONTENT)
+            self.assertEqual(body.data, data)
+            self.assertEqual(body.size, len(CONTENT))
+            self.assertEqual(body.bytes(), CONTENT)
+
+    def test_empty_deflate(self):
+        body, content = read_response(Response(b"", "deflate"))
+        self.assertEqual(content, b"")
+
+class CompressedBodyTest(unittest.TestCase):
+
+    def test_compress(self):
+        body = CompressedBody.compress(CONTENT)
+        self.assertTrue(len(body) < len(CONTENT))
+        self.assertEqual(body.bytes(), CONTENT)
+        self.assertIs(body.compressed(), body)
+        self.assertEqual(CompressedBody(CONTENT).compressed().bytes(), CONTENT)
+
+class BodyCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = BodyCache(2)
+        for key in ["a", "b"]:
+            cache.put(key, CompressedBody(CONTENT))
+        cache.get("a")
+        cache.put("c", CompressedBody(CONTENT))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a").bytes(), CONTENT)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.decompressed_size(), 2 * len(CONTENT))
+        self.assertTrue(cache.compressed_size() < cache.decompressed_size())
+
+class ClientCompressionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=5).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_compressed_transfer(self):
+        sizes = {}
+        for compression in [True, False]:
+            client = native.GtRNative(self.server.base_url, compression=compression, stats=True)
+            self.assertIsNotNone(client.project(uuid("project", 0)))
+            d = client.stats.as_dict()
+            sizes[compression] = (d["bytes"], d["decoded_bytes"])
+        self.assertTrue(sizes[True][0] < sizes[True][1])
+        self.assertEqual(sizes[False][0], sizes[False][1])
+        self.assertEqual(sizes[True][1], sizes[False][1])
+
+    def test_kept_bodies(self):
+        client = native.GtRNative(self.server.base_url, keep_bodies=1)
+        p = client.project(uuid("project", 0))
+        body = client.raw_body(client.project_base + uuid("project", 0))
+        self.assertIsNotNone(body)
+        self.assertIn(p.id(), body.text())
+        client.project(uuid("project", 1))
+        self.assertIsNone(client.raw_body(client.project_base + uuid("project", 0)))
+        self.assertIsNone(native.GtRNative(self.server.base_url).raw_body(client.project_base))
+
+if __name__ == "__main__":
+    unittest.main()
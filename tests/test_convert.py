@@ -0,0 +1,52 @@
+import unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import convert, native
+
+KINDS = ["project", "organisation", "person", "publication"]
+
+class ConvertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=20).start()
+        cls.json_client = native.GtRNative(cls.server.base_url)
+        cls.xml_client = native.GtRNative(cls.server.base_url, serialisation="xml")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_round_trip(self):
+        for kind in KINDS:
+            d = getattr(self.json_client, kind)(uuid(kind, 1)).as_dict()
+            self.assertEqual(convert.to_dict(convert.to_xml(d, kind), kind), d, kind)
+
+    def test_matches_the_api_xml(self):
+        for kind in KINDS:
+            d = getattr(self.json_client, kind)(uuid(kind, 1)).as_dict()
+            el = getattr(self.xml_client, kind)(uuid(kind, 1)).dao.raw
+            self.assertEqual(convert.to_dict(el, kind), d, kind)
+
+    def test_page(self):
+        raw = self.json_client.projects().dao.raw
+        self.assertEqual(convert.to_dict(convert.to_xml(raw, "projects"), "projects"), raw)
+        el = self.xml_client.projects().dao.raw
+        self.assertEqual(convert.to_dict(el, "projects")["project"], raw["project"])
+
+    def test_no_requests(self):
+        p = self.json_client.project(uuid("project", 2))
+        x = self.xml_client.project(uuid("project", 2))
+        self.server.reset_counters()
+        self.assertIn("projectOverview", p.xml())
+        self.assertEqual(x.as_dict(), p.as_dict())
+        self.assertEqual(self.server.requests, 0)
+
+    def test_values(self):
+        el = convert.to_xml({"id" : "p1", "active" : True, "fund" : {"valuePounds" : 1.5}, "code" : "007",
+                                "end" : None}, "project")
+        self.assertEqual(convert.to_dict(el, "project"),
+                            {"id" : "p1", "active" : True, "fund" : {"valuePounds" : 1.5}, "code" : "007"})
+
+if __name__ == "__main__":
+    unittest.main()
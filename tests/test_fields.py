@@ -0,0 +1,56 @@
+import unittest
+
+from gtr.fields import FieldSet, record_type
+
+RAW = {
+    "project" : {
+        "id" : "p1",
+        "title" : "Birdsong",
+        "fund" : {"funder" : {"id" : "f1", "name" : "EPSRC"}, "valuePounds" : 100}
+    },
+    "lead" : {"id" : "o1", "name" : "Somewhere"}
+}
+
+FIELDS = FieldSet("Test", [
+    ("id", ("project", "id")),
+    ("title", ("project", "title")),
+    ("funder_name", ("project", "fund", "funder", "name")),
+    ("lead_name", ("lead", "name"))
+])
+
+class FieldSetTest(unittest.TestCase):
+    
+    def test_all_fields(self):
+        r = FIELDS.extract(RAW)
+        self.assertEqual(r._fields, ("id", "title", "funder_name", "lead_name"))
+        self.assertEqual(tuple(r), ("p1", "Birdsong", "EPSRC", "Somewhere"))
+    
+    def test_subset(self):
+        r = FIELDS.extract(RAW, ["lead_name", "id"])
+        self.assertEqual(r.lead_name, "Somewhere")
+        self.assertEqual(r.id, "p1")
+    
+    def test_extractors_are_cached(self):
+        self.assertTrue(FIELDS.extractor(["id", "title"]) is FIELDS.extractor(["id", "title"]))
+    
+    def test_missing_paths_are_none(self):
+        r = FIELDS.extract({"project" : {"fund" : None}})
+        self.assertEqual(tuple(r), (None, None, None, None))
+        self.assertEqual(tuple(FIELDS.extract(None)), (None, None, None, None))
+    
+    def test_dotted_paths(self):
+        r = FIELDS.extract(RAW, ["id", "project.fund.valuePounds", "lead.id"])
+        self.assertEqual(r._fields, ("id", "project_fund_valuePounds", "lead_id"))
+        self.assertEqual(r.project_fund_valuePounds, 100)
+        self.assertEqual(r.lead_id, "o1")
+    
+    def test_invalid_names_are_rejected(self):
+        for names in [["id", "1st.name"], ["id", "_private"], ["lead.name", "lead_name"], ["id", "id"]]:
+            self.assertRaises(ValueError, FIELDS.extractor, names)
+    
+    def test_record_type(self):
+        self.assertEqual(record_type("Test", ["a", "b.c"])._fields, ("a", "b_c"))
+        self.assertRaises(ValueError, record_type, "Test", ["a b"])
+
+if __name__ == "__main__":
+    unittest.main()
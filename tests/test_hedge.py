@@ -0,0 +1,134 @@
+import subprocess, sys, threading, time, unittest
+
+from gtr import hedge
+
+def attempts(delays):
+    """
+    an attempt function whose successive calls take the given times, returning their 
+    tokens and the order of the call
+    """
+    calls = []
+    lock = threading.Lock()
+    def attempt(token):
+        with lock:
+            n = len(calls)
+            calls.append(token)
+        time.sleep(delays[n] if n < len(delays) else 0)
+        return (n, token)
+    return attempt, calls
+
+class HedgerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.hedger = hedge.Hedger(min_delay=0.02, min_samples=5, workers=4)
+    
+    def tearDown(self):
+        self.hedger.close()
+    
+    def warm(self, n=5):
+        attempt, _ = attempts([0] * n)
+        for _ in range(n):
+            self.hedger.call(attempt)
+    
+    def test_no_hedging_without_history(self):
+        self.assertEqual(self.hedger.delay(), None)
+        attempt, calls = attempts([0.1])
+        self.assertEqual(self.hedger.call(attempt, "t"), (0, "t"))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.hedger.report()["sent"], 0)
+    
+    def test_slow_request_is_hedged(self):
+        self.warm()
+        self.assertEqual(self.hedger.delay(), 0.02)
+        attempt, calls = attempts([1.0, 0])
+        start = time.time()
+        self.assertEqual(self.hedger.call(attempt, "first", lambda: "second"), (1, "second"))
+        self.assertTrue(time.time() - start < 0.5)
+        report = self.hedger.report()
+        self.assertEqual((report["sent"], report["won"], report["lost"]), (1, 1, 0))
+    
+    def test_hedge_refused_by_permit(self):
+        self.warm()
+        attempt, calls = attempts([0.1])
+        self.assertEqual(self.hedger.call(attempt, "first", lambda: None), (0, "first"))
+        self.assertEqual(calls, ["first"])
+        self.assertEqual(self.hedger.report()["denied"], 1)
+    
+    def test_budget(self):
+        self.hedger.close()
+        self.hedger = hedge.Hedger(percentile=50, min_delay=0.02, min_samples=5, budget=0, burst=1, workers=4)
+        self.warm()
+        for _ in range(2):
+            attempt, _ = attempts([0.1, 0.1])
+            self.hedger.call(attempt)
+        report = self.hedger.report()
+        self.assertEqual((report["sent"], report["denied"]), (1, 1))
+    
+    def test_failures(self):
+        self.warm()
+        def attempt(token):
+            raise IOError("no response")
+        self.assertRaises(IOError, self.hedger.call, attempt)
+
+class WorkersTest(unittest.TestCase):
+    
+    def test_bounded(self):
+        workers = hedge._Workers(3)
+        running = []
+        lock = threading.Lock()
+        release = threading.Event()
+        done = threading.Semaphore(0)
+        def task():
+            with lock:
+                running.append(threading.current_thread())
+            release.wait()
+            done.release()
+        for _ in range(10):
+            workers.submit(task)
+        time.sleep(0.1)
+        self.assertEqual(len(workers._threads), 3)
+        self.assertEqual(len(running), 3)
+        release.set()
+        for _ in range(10):
+            done.acquire()
+        self.assertEqual(len(set(running)), 3)
+        workers.close()
+    
+    def test_idle_threads_are_reused(self):
+        workers = hedge._Workers(8)
+        done = threading.Semaphore(0)
+        for _ in range(20):
+            workers.submit(done.release)
+            done.acquire()
+            # let the thread get back to waiting for the next task
+            time.sleep(0.01)
+        self.assertEqual(len(workers._threads), 1)
+        workers.close()
+    
+    def test_close(self):
+        workers = hedge._Workers(4)
+        finished = []
+        for i in range(6):
+            workers.submit(lambda i=i: (time.sleep(0.01), finished.append(i)))
+        threads = list(workers._threads)
+        workers.close()
+        # the submitted tasks are finished first
+        self.assertEqual(sorted(finished), range(6))
+        self.assertFalse(any([t.is_alive() for t in threads]))
+        self.assertRaises(RuntimeError, workers.submit, lambda: None)
+        workers.close()
+    
+    def test_quiet_exit(self):
+        # the idle threads are stopped at exit, without tracebacks from the interpreter's
+        # shutdown
+        code = ("from gtr import hedge\n"
+                "h = hedge.Hedger(min_samples=0)\n"
+                "for i in range(5):\n"
+                "    h.call(lambda t: t, i)\n")
+        p = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        self.assertEqual(p.returncode, 0)
+        self.assertEqual(err, "")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import gc, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+from gtr.identity import IdentityMap
+
+class Entity(object):
+    def __init__(self, data):
+        self.dao = type("DAO", (object,), {})()
+        self.dao.raw = {"wrapped" : data}
+
+class IdentityMapTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.map = IdentityMap()
+    
+    def get(self, data):
+        return self.map.get("organisation", data.get("id"), data, lambda: Entity(data))
+    
+    def test_equal_data_is_shared(self):
+        a = self.get({"id" : "o1", "name" : "A", "roles" : ["LEAD", "FUNDER"]})
+        b = self.get({"name" : "A", "roles" : ["LEAD", "FUNDER"], "id" : "o1"})
+        self.assertTrue(a is b)
+        self.assertEqual(self.map.stats()["hits"], 1)
+    
+    def test_different_data_is_not_shared(self):
+        a = self.get({"id" : "p1", "roles" : ["PI_PER"]})
+        b = self.get({"id" : "p1", "roles" : ["COI_PER"]})
+        self.assertFalse(a is b)
+        self.assertTrue(self.get({"id" : "p1", "roles" : ["COI_PER"]}) is b)
+    
+    def test_no_id(self):
+        self.assertFalse(self.get({"name" : "A"}) is self.get({"name" : "A"}))
+    
+    def test_entities_are_kept(self):
+        first = id(self.get({"id" : "o1"}))
+        gc.collect()
+        self.assertEqual(id(self.get({"id" : "o1"})), first)
+        self.assertEqual(len(self.map), 1)
+    
+    def test_intern(self):
+        a = {"id" : "o1", "name" : "A"}
+        b = {"id" : "o1", "name" : "A"}
+        self.assertTrue(self.map.intern("organisation", a) is a)
+        self.assertTrue(self.map.intern("organisation", b) is a)
+        self.assertTrue(self.map.intern("organisation", {"id" : "o1", "name" : "B"}) is not a)
+        self.assertEqual(self.map.stats()["interned"], 1)
+        # an entity for the interned data is found by identity
+        self.assertTrue(self.get(a) is self.get(b))
+    
+    def test_fetched_entities_are_not_handed_out(self):
+        a = self.get({"id" : "o1"})
+        a.dao.raw = {"fetched" : True}
+        b = self.get({"id" : "o1"})
+        self.assertFalse(a is b)
+        self.assertTrue(self.get({"id" : "o1"}) is b)
+    
+    def test_clear(self):
+        a = self.get({"id" : "o1"})
+        self.map.clear()
+        self.assertEqual(len(self.map), 0)
+        self.assertFalse(self.get({"id" : "o1"}) is a)
+
+class ClientIdentityTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=200).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def projects(self, client):
+        return [client.project(uuid("project", i)) for i in range(200)]
+    
+    def test_embedded_entities_are_shared(self):
+        client = native.GtRNative(self.server.base_url, identity_map=True)
+        by_lead = {}
+        for p in self.projects(client):
+            by_lead.setdefault(p.lead().id(), []).append(p)
+        shared = [ps for ps in by_lead.values() if len(ps) > 1]
+        self.assertTrue(len(shared) > 0)
+        for ps in shared:
+            self.assertEqual(len(set([id(p.lead()) for p in ps])), 1)
+            # the projects hold one copy of the lead's data between them
+            self.assertEqual(len(set([id(p.dao.raw["projectComposition"]["leadResearchOrganisation"]) for p in ps])), 1)
+    
+    def test_same_data_without_the_map(self):
+        shared = native.GtRNative(self.server.base_url, identity_map=True)
+        plain = native.GtRNative(self.server.base_url)
+        for a, b in zip(self.projects(shared), self.projects(plain)):
+            self.assertEqual(a.as_dict(), b.as_dict())
+            self.assertEqual([o.id() for o in a.orgs()], [o.id() for o in b.orgs()])
+            self.assertEqual([x.dao.raw for x in a.people()], [x.dao.raw for x in b.people()])
+    
+    def test_fetch_of_a_shared_entity(self):
+        client = native.GtRNative(self.server.base_url, identity_map=True)
+        a, b = [client.project(uuid("project", i)) for i in range(2)]
+        funder = a.funder()
+        self.assertTrue(b.funder() is funder or b.funder().id() != funder.id())
+        self.assertTrue(funder.fetch())
+        self.assertFalse(a.funder() is funder)
+
+if __name__ == "__main__":
+    unittest.main()
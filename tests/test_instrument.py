@@ -0,0 +1,119 @@
+import unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+from gtr.instrument import Hooks, ClientStats
+
+class HooksTest(unittest.TestCase):
+
+    def test_fire(self):
+        hooks = Hooks()
+        seen = []
+        self.assertFalse(hooks.active)
+        hooks.fire("before_request", {"url" : "x"})
+        hooks.add("before_request", seen.append)
+        self.assertTrue(hooks.active)
+        hooks.fire("before_request", {"url" : "x"})
+        hooks.fire("after_request", {"url" : "y"})
+        self.assertEqual(seen, [{"url" : "x"}])
+
+    def test_remove(self):
+        hooks = Hooks()
+        fn = lambda info: None
+        hooks.add("after_parse", fn)
+        hooks.remove("after_parse", fn)
+        hooks.remove("after_parse", fn)
+        self.assertFalse(hooks.active)
+
+    def test_unknown_event(self):
+        self.assertRaises(ValueError, Hooks().add, "before_everything", lambda info: None)
+
+class ClientStatsTest(unittest.TestCase):
+
+    def test_totals(self):
+        stats = ClientStats()
+        stats.record_request("project", 200, 100, 0.5, 400)
+        stats.record_request("project", 404, 10, 0.25)
+        stats.record_request("person", 200, 50, 0.25)
+        stats.record_parse("project", 0.125)
+        stats.record_callback("project", 0.5)
+        stats.record_coalesced()
+        stats.record_hedge("won")
+        stats.record_hedge("denied")
+        d = stats.as_dict()
+        self.assertEqual(d["requests"], 3)
+        self.assertEqual(d["bytes"], 160)
+        self.assertEqual(d["decoded_bytes"], 460)
+        self.assertEqual(d["network_time"], 1.0)
+        self.assertEqual(d["status_codes"], {200 : 2, 404 : 1})
+        self.assertEqual(d["entities"]["project"]["requests"], 2)
+        self.assertEqual(d["entities"]["project"]["callbacks"], 1)
+        self.assertEqual(d["entities"]["person"]["parse_time"], 0.0)
+        self.assertEqual(d["coalesced"], 1)
+        self.assertEqual(d["hedges"], {"sent" : 1, "won" : 1, "lost" : 0, "denied" : 1})
+        self.assertIsNone(d["concurrency_limit"])
+
+    def test_as_dict_is_a_copy(self):
+        stats = ClientStats()
+        stats.record_request("project", 200, 1, 0.1)
+        d = stats.as_dict()
+        d["entities"]["project"]["requests"] = 10
+        self.assertEqual(stats.as_dict()["entities"]["project"]["requests"], 1)
+
+    def test_reset(self):
+        stats = ClientStats()
+        stats.record_request("project", 200, 1, 0.1)
+        stats.record_limit(4, 0)
+        stats.reset()
+        d = stats.as_dict()
+        self.assertEqual((d["requests"], d["entities"], d["concurrency_history"]), (0, {}, []))
+
+    def test_prometheus(self):
+        stats = ClientStats()
+        stats.record_request("project", 200, 100, 0.5)
+        stats.record_limit(8, 0)
+        text = stats.prometheus(prefix="test")
+        self.assertIn('test_requests_total{entity="project"} 1', text)
+        self.assertIn('test_responses_total{code="200"} 1', text)
+        self.assertIn("# TYPE test_concurrency_limit gauge", text)
+        self.assertIn("test_concurrency_limit 8", text)
+        self.assertTrue(text.endswith("\n"))
+
+class ClientInstrumentationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=10).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_stats(self):
+        client = native.GtRNative(self.server.base_url, stats=True)
+        client.project(uuid("project", 0))
+        client.project(uuid("project", 1000))
+        d = client.stats.as_dict()
+        self.assertEqual(d["requests"], 2)
+        self.assertEqual(d["status_codes"], {200 : 1, 404 : 1})
+        self.assertEqual(d["entities"]["project"]["requests"], 2)
+        self.assertTrue(d["bytes"] > 0)
+
+    def test_hooks(self):
+        events = []
+        hooks = Hooks()
+        for event in ["before_request", "after_request", "after_parse"]:
+            hooks.add(event, lambda info, event=event: events.append((event, info["entity"])))
+        client = native.GtRNative(self.server.base_url, hooks=hooks)
+        client.project(uuid("project", 0))
+        self.assertEqual(events, [("before_request", "project"), ("after_request", "project"),
+                                    ("after_parse", "project")])
+
+    def test_shared_stats(self):
+        stats = ClientStats()
+        native.GtRNative(self.server.base_url, stats=stats).project(uuid("project", 0))
+        native.GtRNative(self.server.base_url, stats=stats).person(uuid("person", 0))
+        self.assertEqual(stats.as_dict()["requests"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
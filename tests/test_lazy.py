@@ -0,0 +1,58 @@
+import sys, unittest
+
+from gtr.lazy import LazyModule
+
+def _owner(name):
+    """
+    the globals of a module which makes a stand-in for the named module, as "mod"
+    """
+    namespace = {"LazyModule" : LazyModule}
+    exec("mod = LazyModule(%r)" % name, namespace)
+    return namespace
+
+class LazyModuleTest(unittest.TestCase):
+
+    def setUp(self):
+        # a small module which nothing else here imports
+        sys.modules.pop("colorsys", None)
+
+    def test_loaded_on_first_use(self):
+        owner = _owner("colorsys")
+        lazy = owner["mod"]
+        self.assertFalse(lazy.loaded())
+        self.assertNotIn("colorsys", sys.modules)
+        self.assertEqual(lazy.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertTrue(lazy.loaded())
+        self.assertIn("colorsys", sys.modules)
+
+    def test_owner_gets_the_module(self):
+        owner = _owner("colorsys")
+        lazy = owner["mod"]
+        lazy.ONE_THIRD
+        self.assertIs(owner["mod"], sys.modules["colorsys"])
+
+    def test_patches_are_seen(self):
+        owner = _owner("colorsys")
+        lazy = owner["mod"]
+        lazy.rgb_to_hsv(0, 0, 0)
+        module = sys.modules["colorsys"]
+        original = module.rgb_to_hsv
+        module.rgb_to_hsv = lambda r, g, b: "patched"
+        try:
+            self.assertEqual(lazy.rgb_to_hsv(0, 0, 0), "patched")
+            self.assertEqual(owner["mod"].rgb_to_hsv(0, 0, 0), "patched")
+        finally:
+            module.rgb_to_hsv = original
+        self.assertEqual(lazy.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+
+    def test_set_is_passed_on(self):
+        lazy = _owner("colorsys")["mod"]
+        lazy.EXTRA = 1
+        try:
+            self.assertEqual(sys.modules["colorsys"].EXTRA, 1)
+            self.assertNotIn("EXTRA", lazy.__dict__)
+        finally:
+            del sys.modules["colorsys"].EXTRA
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import threading, time, unittest
+from email.utils import formatdate
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import instrument, native, workflows
+from gtr.limiter import AdaptiveLimiter
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_increase(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=3)
+        for i in range(10):
+            limiter.release(limiter.acquire(), 200, 0.01)
+        self.assertEqual(limiter.limit(), 3)
+        self.assertEqual(limiter.in_flight(), 0)
+        self.assertEqual([limit for _, limit in limiter.history], [2, 3])
+
+    def test_cut_once_for_the_requests_in_flight(self):
+        limiter = AdaptiveLimiter(initial=8, minimum=1)
+        tokens = [limiter.acquire() for i in range(4)]
+        for token in tokens:
+            limiter.release(token, 429, 0.01)
+        self.assertEqual(limiter.limit(), 4)
+        self.assertEqual(limiter.decreases, 1)
+        self.assertEqual(limiter.throttled, 4)
+        # a request made after the cut can cut again, down to the minimum
+        for i in range(3):
+            limiter.release(limiter.acquire(), None, 0.01)
+        self.assertEqual(limiter.limit(), 1)
+
+    def test_errors_and_slow_responses(self):
+        limiter = AdaptiveLimiter(initial=8, latency_target=0.5)
+        limiter.release(limiter.acquire(), 500, 0.01)
+        self.assertEqual(limiter.limit(), 4)
+        limiter.release(limiter.acquire(), 200, 1.0)
+        self.assertEqual(limiter.limit(), 2)
+        limiter.release(limiter.acquire(), 404, 0.01)
+        self.assertEqual(limiter.limit(), 2)
+
+    def test_try_acquire(self):
+        limiter = AdaptiveLimiter(initial=1)
+        token = limiter.try_acquire()
+        self.assertIsNotNone(token)
+        self.assertIsNone(limiter.try_acquire())
+        limiter.release(token, 200, 0.01)
+        self.assertIsNotNone(limiter.try_acquire())
+
+    def test_acquire_waits_for_a_release(self):
+        limiter = AdaptiveLimiter(initial=1)
+        token = limiter.acquire()
+        acquired = []
+        t = threading.Thread(target=lambda: acquired.append(limiter.acquire()))
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(acquired, [])
+        limiter.release(token, 200, 0.01)
+        t.join(5)
+        self.assertEqual(len(acquired), 1)
+
+    def test_retry_after(self):
+        for retry_after in ["0.2", formatdate(time.time() + 1.5, usegmt=True)]:
+            limiter = AdaptiveLimiter(initial=4)
+            limiter.release(limiter.acquire(), 503, 0.01, retry_after)
+            self.assertIsNone(limiter.try_acquire())
+            start = time.time()
+            limiter.release(limiter.acquire(), 200, 0.01)
+            self.assertTrue(time.time() - start >= 0.15, retry_after)
+            self.assertTrue(limiter.held > 0)
+
+    def test_bad_retry_after(self):
+        limiter = AdaptiveLimiter(initial=4)
+        limiter.release(limiter.acquire(), 429, 0.01, "soon")
+        self.assertIsNotNone(limiter.try_acquire())
+
+class ClientLimiterTest(unittest.TestCase):
+
+    def test_hook_errors_do_not_leak_tokens(self):
+        server = StubServer(projects=5).start()
+        try:
+            hooks = instrument.Hooks()
+            def fail(info):
+                raise ValueError("hook")
+            hooks.add("before_request", fail)
+            limiter = AdaptiveLimiter(initial=1)
+            client = native.GtRNative(server.base_url, hooks=hooks, limiter=limiter)
+            self.assertRaises(ValueError, client.project, uuid("project", 0))
+            self.assertEqual(limiter.in_flight(), 0)
+            hooks.remove("before_request", fail)
+            self.assertIsNotNone(client.project(uuid("project", 0)))
+            self.assertEqual(limiter.in_flight(), 0)
+        finally:
+            server.stop()
+
+    def test_crawl_backs_off(self):
+        server = StubServer(projects=60, max_concurrency=2, latency=0.02).start()
+        try:
+            stats = workflows.crawl(server.base_url, project_callback=lambda p: None, workers=8,
+                                        limiter=AdaptiveLimiter(initial=8), stats=True)
+            d = stats.as_dict()
+            self.assertTrue(d["concurrency_limit"] < 8)
+            self.assertTrue(len(d["concurrency_history"]) > 0)
+            self.assertEqual(d["status_codes"].get(200), d["requests"] - server.throttled)
+        finally:
+            server.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import threading, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+
+class ExpandTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=40).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        self.client = native.GtRNative(self.server.base_url, serialisation="json")
+    
+    def projects(self, n):
+        return [self.client.project(uuid("project", i)) for i in range(n)]
+    
+    def test_lead(self):
+        projects = self.projects(5)
+        leads = self.client.expand(projects, "lead", workers=4)
+        self.assertEqual(sorted(leads.keys()), sorted([p.id() for p in projects]))
+        for p in projects:
+            self.assertEqual([o.id() for o in leads[p.id()]], [p.lead().id()])
+            self.assertTrue(leads[p.id()][0].fetched)
+    
+    def test_unknown_relation(self):
+        self.assertRaises(ValueError, self.client.expand, self.projects(1), "friends")
+    
+    def test_failed_fetches_are_not_cached(self):
+        projects = self.projects(10)
+        organisation = self.client.organisation
+        failing = set([projects[0].lead().id()])
+        def flaky(uid, page_size=None):
+            if uid in failing:
+                return None
+            return organisation(uid, page_size)
+        self.client.organisation = flaky
+        
+        cache = {}
+        leads = self.client.expand(projects, "lead", cache=cache)
+        self.assertEqual(leads[projects[0].id()], [])
+        self.assertFalse(projects[0].lead().id() in cache)
+        
+        # the next call tries it again
+        failing.clear()
+        leads = self.client.expand(projects, "lead", cache=cache)
+        self.assertEqual(len(leads[projects[0].id()]), 1)
+        self.assertTrue(projects[0].lead().id() in cache)
+    
+    def test_list_entities_are_fetched_first(self):
+        listed = self.client.projects().projects()[:5]
+        self.assertFalse(any([p.fetched for p in listed]))
+        people = self.client.expand(listed, "people", workers=4)
+        self.assertTrue(all([p.fetched for p in listed]))
+        for p in listed:
+            self.assertTrue(len(people[p.id()]) > 0)
+            self.assertEqual(sorted([x.id() for x in people[p.id()]]), sorted([x.id() for x in p.people()]))
+    
+    def test_unfetchable_entities_are_left_out(self):
+        listed = self.client.projects().projects()[:3]
+        project = self.client.project
+        missing = listed[1].id()
+        self.client.project = lambda uid: None if uid == missing else project(uid)
+        leads = self.client.expand(listed, "lead")
+        self.assertEqual(sorted(leads.keys()), sorted([listed[0].id(), listed[2].id()]))
+    
+    def test_no_threads_left_behind(self):
+        before = threading.active_count()
+        self.client.expand(self.projects(6), "people", workers=4)
+        self.assertEqual(threading.active_count(), before)
+
+class IterRecordsTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=60).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def check(self, serialisation):
+        client = native.GtRNative(self.server.base_url, page_size=25, serialisation=serialisation)
+        records = list(client.projects().iter_records(["id", "title"]))
+        self.assertEqual(len(records), 60)
+        self.assertEqual(records[0]._fields, ("id", "title"))
+        expected = []
+        for page in client.projects().page_iterator():
+            expected.extend([(p.id(), p.title()) for p in page])
+        self.assertEqual([tuple(r) for r in records], expected)
+    
+    def test_json(self):
+        self.check("json")
+    
+    def test_xml(self):
+        self.check("xml")
+    
+    def test_from_the_current_page(self):
+        client = native.GtRNative(self.server.base_url, page_size=25)
+        projects = client.projects()
+        projects.next_page()
+        self.server.reset_counters()
+        records = list(projects.iter_records(["id"], reset_pages=False))
+        self.assertEqual([r.id for r in records], [uuid("project", i) for i in range(25, 60)])
+        self.assertEqual(self.server.requests, 2)
+
+class RawIteratorTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=60).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def test_json_records(self):
+        client = native.GtRNative(self.server.base_url, page_size=25)
+        records = list(client.projects().iter_raw_records())
+        self.assertEqual([r["id"] for r in records], [uuid("project", i) for i in range(60)])
+    
+    def test_xml_records(self):
+        client = native.GtRNative(self.server.base_url, page_size=25, serialisation="xml")
+        records = list(client.projects().iter_raw_records())
+        self.assertEqual(len(records), 60)
+        self.assertEqual(records[0].get("url"), client.projects().projects()[0].url())
+    
+    def test_pages(self):
+        client = native.GtRNative(self.server.base_url, page_size=25)
+        projects = client.projects()
+        projects.next_page()
+        pages = [paging.current_page() for _, paging in projects.iter_raw_pages()]
+        self.assertEqual(pages, [1, 2, 3])
+        # the list stays on its page
+        self.assertEqual(projects.current_page(), 2)
+        pages = [paging.current_page() for _, paging in projects.iter_raw_pages(reset_pages=False)]
+        self.assertEqual(pages, [2, 3])
+        self.server.reset_counters()
+        self.assertEqual(len(list(projects.iter_raw_pages(False, stop_at_page_boundary=True))), 1)
+        self.assertEqual(self.server.requests, 0)
+    
+    def test_only_lists(self):
+        client = native.GtRNative(self.server.base_url)
+        org = client.organisation(uuid("organisation", 0))
+        self.assertFalse(hasattr(org, "iter_raw_records"))
+        self.assertFalse(hasattr(org, "iter_records"))
+
+class FetchedTest(unittest.TestCase):
+    
+    def test_fetched(self):
+        server = StubServer(projects=5).start()
+        try:
+            client = native.GtRNative(server.base_url, serialisation="json")
+            self.assertTrue(client.project(uuid("project", 0)).fetched)
+            self.assertTrue(client.organisation(uuid("organisation", 0)).fetched)
+            listed = client.projects().projects()[0]
+            self.assertFalse(listed.fetched)
+            self.assertFalse(client.project(uuid("project", 0)).lead().fetched)
+            self.assertTrue(listed.fetch())
+            self.assertTrue(listed.fetched)
+        finally:
+            server.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os, shutil, tempfile, unittest
+
+from gtr.search import SearchIndex, tokenise
+
+class TokeniseTest(unittest.TestCase):
+
+    def test_tokenise(self):
+        self.assertEqual(tokenise(u"The Effects of CO2 on 2 Coral-Reefs, in 2010"), [u"effects", u"co2", u"coral", u"reefs"])
+        self.assertEqual(tokenise(None), [])
+
+class SearchIndexTest(unittest.TestCase):
+
+    def index(self):
+        index = SearchIndex()
+        index.add_document("p1", u"Coral reef ecology", u"A study of reefs in the Pacific.")
+        index.add_document("p2", u"Ocean acidification", u"The effect of acidification on coral.")
+        index.add_document("p3", u"Medieval poetry", u"Manuscripts and their readers.")
+        return index
+
+    def ids(self, results):
+        return [uuid for uuid, _, _ in results]
+
+    def test_search(self):
+        index = self.index()
+        # a match in the title ranks above a match in the abstract
+        self.assertEqual(self.ids(index.search("coral")), ["p1", "p2"])
+        self.assertEqual(self.ids(index.search("poetry manuscripts")), ["p3"])
+        self.assertEqual(index.search("the"), [])
+        self.assertEqual(index.search("nothing"), [])
+        self.assertEqual(self.ids(index.search("coral", limit=1)), ["p1"])
+        self.assertEqual(SearchIndex().search("coral"), [])
+
+    def test_replace(self):
+        index = self.index()
+        self.assertFalse(index.add_document("p1", u"Coral reef ecology", u"A study of reefs in the Pacific."))
+        self.assertTrue(index.add_document("p1", u"Deep sea vents", u"Hydrothermal vents."))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(self.ids(index.search("coral")), ["p2"])
+        self.assertEqual(self.ids(index.search("vents")), ["p1"])
+
+    def test_remove(self):
+        index = self.index()
+        self.assertTrue(index.remove("p2"))
+        self.assertFalse(index.remove("p2"))
+        self.assertEqual(self.ids(index.search("coral")), ["p1"])
+        self.assertEqual(index.stats()["deleted"], 1)
+
+    def test_compact(self):
+        index = self.index()
+        index.remove("p1")
+        index.add_document("p3", u"Medieval poetry", u"Manuscripts, readers and scribes.")
+        before = index.search("coral scribes")
+        index.compact()
+        self.assertEqual(index.search("coral scribes"), before)
+        self.assertEqual(index.stats()["deleted"], 0)
+        index.add_document("p4", u"Coral spawning", None)
+        self.assertEqual(self.ids(index.search("coral")), ["p4", "p2"])
+
+    def test_many_documents(self):
+        # document numbers and frequencies which take more than one byte to encode
+        index = SearchIndex()
+        for i in range(300):
+            index.add_document("p%d" % i, u"project %d" % i, u" ".join([u"common"] * (i + 1)) + (u" rare" if i == 299 else u""))
+        self.assertEqual(self.ids(index.search("rare")), ["p299"])
+        self.assertEqual(len(index.search("common", limit=500)), 300)
+
+class PersistenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        index = SearchIndex(title_weight=3)
+        index.add_document("p1", u"Coral reef ecology", u"Reefs.")
+        index.add_document("p2", u"Ocean acidification", u"Coral.")
+        index.add_document("p3", u"Replaced", u"Coral.")
+        index.remove("p3")
+        index.save(self.path)
+        loaded = SearchIndex.load(self.path)
+        self.assertEqual(loaded.title_weight, 3)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.search("coral"), index.search("coral"))
+        loaded.add_document("p4", u"Coral", None)
+        self.assertEqual(loaded.search("coral")[0][0], "p4")
+
+    def test_not_an_index(self):
+        with open(self.path, "wb") as f:
+            f.write(b"something else")
+        self.assertRaises(ValueError, SearchIndex.load, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os, shutil, tempfile, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import snapshot, workflows
+
+class SnapshotTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=60).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "gtr.snap")
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def write(self, **kwargs):
+        writer = snapshot.SnapshotWriter(self.path, kwargs.pop("kinds", None))
+        with writer:
+            workflows.crawl(self.server.base_url, sinks=[writer], **kwargs)
+        return writer
+    
+    def test_round_trip(self):
+        writer = snapshot.SnapshotWriter(self.path)
+        writer.add_raw("project", uuid("project", 1), {"id" : "b"})
+        writer.add_raw("project", uuid("project", 0), {"id" : "a"})
+        writer.add_raw("person", uuid("person", 0), {"id" : "c"})
+        writer.add_raw("project", uuid("project", 1), {"id" : "b2"})
+        writer.close()
+        with snapshot.SnapshotReader(self.path) as reader:
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader.count("project"), 2)
+            self.assertEqual(reader.get("project", uuid("project", 1)), {"id" : "b2"})
+            self.assertEqual(reader.get("project", uuid("project", 2)), None)
+            self.assertEqual(reader.uuids("project"), [uuid("project", 0), uuid("project", 1)])
+            self.assertEqual([d["id"] for _, d in reader.scan("project")], ["b", "a", "b2"])
+    
+    def test_bad_records(self):
+        with snapshot.SnapshotWriter(self.path) as writer:
+            self.assertRaises(snapshot.SnapshotError, writer.add_raw, "grant", uuid("project", 0), {})
+            self.assertRaises(snapshot.SnapshotError, writer.add_raw, "project", "short", {})
+    
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as f:
+            f.write("not a snapshot at all, but long enough to have a footer")
+        self.assertRaises(snapshot.SnapshotError, snapshot.SnapshotReader, self.path)
+    
+    def test_crawl(self):
+        writer = self.write(project_limit=30)
+        self.assertEqual(len(writer), 30)
+        client = snapshot.SnapshotClient(self.path)
+        try:
+            projects = client.projects()
+            self.assertEqual(len(projects), 30)
+            p = client.project(uuid("project", 3))
+            self.assertEqual(p.id(), uuid("project", 3))
+            self.assertEqual(client.person(uuid("person", 0)), None)
+        finally:
+            client.close()
+    
+    def test_kinds(self):
+        writer = self.write(kinds=("project", "organisation"), project_limit=10, organisation_limit=5)
+        self.assertEqual(len(writer), 15)
+    
+    def test_nothing_to_write(self):
+        # a writer with no kinds, and a crawl with no callbacks or limits, would write an
+        # empty snapshot
+        self.assertRaises(ValueError, self.write)
+        self.assertRaises(ValueError, self.write, kinds=("project",), project_limit=0)
+    
+    def test_page_sizes(self):
+        self.write(project_limit=60)
+        client = snapshot.SnapshotClient(self.path)
+        try:
+            for size, expected in [(0, 25), (-1, 25), (10, 25), (50, 50), (500, 100)]:
+                data, paging = client._lookup(client.project_base + "?page=1&fetchSize=%d" % size)
+                self.assertEqual(len(data["project"]), min(expected, 60))
+                self.assertEqual(data["size"], expected)
+            data, paging = client._lookup(client.project_base + "?page=1")
+            self.assertEqual(data["size"], 25)
+            self.assertEqual(client._lookup(client.project_base + "?page=9&fetchSize=25"), (None, None))
+        finally:
+            client.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os, shutil, tempfile, time, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import native
+from gtr.transport import Headers, RecordingTransport, ReplayTransport, TransportError
+
+class HeadersTest(unittest.TestCase):
+
+    def test_case(self):
+        headers = Headers({"Link-Pages" : "3"})
+        self.assertEqual(headers["link-pages"], "3")
+        self.assertEqual(headers.get("LINK-PAGES"), "3")
+        self.assertTrue("link-Pages" in headers)
+        self.assertIsNone(headers.get("link"))
+
+class RecordReplayTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=60).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cassette")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, fn, append=False, **kwargs):
+        transport = RecordingTransport(self.path, append=append)
+        try:
+            return fn(native.GtRNative(self.server.base_url, transport=transport, **kwargs))
+        finally:
+            transport.close()
+
+    def project_ids(self, client):
+        ids = []
+        for page in client.projects().page_iterator():
+            ids.extend([p.id() for p in page])
+        return ids
+
+    def test_replay(self):
+        recorded = self.record(self.project_ids, page_size=25)
+        self.assertEqual(len(recorded), 60)
+        self.server.reset_counters()
+        replay = ReplayTransport(self.path)
+        client = native.GtRNative(self.server.base_url, transport=replay, page_size=25)
+        self.assertEqual(self.project_ids(client), recorded)
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual((replay.replayed, replay.misses), (len(replay), 0))
+
+    def test_compressed_bodies(self):
+        as_dict = lambda client: client.project(uuid("project", 0)).as_dict()
+        recorded = self.record(as_dict)
+        replay = ReplayTransport(self.path)
+        self.assertEqual(replay._responses.values()[0][2].encoding, "gzip")
+        self.assertEqual(as_dict(native.GtRNative(self.server.base_url, transport=replay)), recorded)
+
+    def test_append(self):
+        self.record(lambda client: client.project(uuid("project", 0)))
+        self.record(lambda client: client.project(uuid("project", 1)), append=True)
+        self.record(lambda client: client.project(uuid("project", 1)), append=True)
+        self.assertEqual(len(ReplayTransport(self.path)), 2)
+
+    def test_misses(self):
+        self.record(lambda client: client.project(uuid("project", 0)))
+        client = native.GtRNative(self.server.base_url, transport=ReplayTransport(self.path))
+        self.assertRaises(TransportError, client.project, uuid("project", 1))
+        replay = ReplayTransport(self.path, strict=False)
+        client = native.GtRNative(self.server.base_url, transport=replay)
+        self.assertIsNone(client.project(uuid("project", 1)))
+        self.assertEqual(replay.misses, 1)
+
+    def test_latency(self):
+        self.record(lambda client: client.project(uuid("project", 0)))
+        client = native.GtRNative(self.server.base_url, transport=ReplayTransport(self.path, latency=0.1))
+        start = time.time()
+        client.project(uuid("project", 0))
+        self.assertTrue(time.time() - start >= 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
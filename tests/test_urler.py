@@ -0,0 +1,88 @@
+import unittest
+
+from benchmarks.stub_server import StubServer
+from gtr import native, urler
+from gtr.common import Paging
+
+class Response(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+class UrlerTest(unittest.TestCase):
+
+    def test_set_query_params(self):
+        url = urler.set_query_params("http://host/api/projects?page=2&q=x", [("page", 3), ("fetchSize", 50)])
+        self.assertEqual(urler.get_query_param(url, "page"), "3")
+        self.assertEqual(urler.get_query_param(url, "fetchSize"), "50")
+        self.assertEqual(urler.get_query_param(url, "q"), "x")
+        self.assertTrue(url.startswith("http://host/api/projects?"))
+
+    def test_set_query_params_from_dict(self):
+        url = urler.set_query_params("http://host/api", {"page" : 1})
+        self.assertEqual(url, "http://host/api?page=1")
+
+    def test_set_query_param(self):
+        url = urler.set_query_param("http://host/api?page=1#top", "page", 2)
+        self.assertEqual(url, "http://host/api?page=2#top")
+
+    def test_missing_param(self):
+        self.assertIsNone(urler.get_query_param("http://host/api", "page"))
+        self.assertEqual(urler.URL("http://host/api?a=1&a=2").get_query_param("a", True), ["1", "2"])
+
+class PagingTest(unittest.TestCase):
+
+    def paging(self, first, previous, next, last, pages=5):
+        return Paging(100, pages, first, previous, next, last)
+
+    def test_middle_page(self):
+        p = self.paging("/p?page=1&fetchSize=20", "/p?page=2&fetchSize=20", "/p?page=4&fetchSize=20", "/p?page=5&fetchSize=20")
+        self.assertEqual(p.current_page(), 3)
+        self.assertEqual(p.current_page_size(), 20)
+
+    def test_first_and_last_pages(self):
+        self.assertEqual(self.paging("/p?page=1", None, "/p?page=2", "/p?page=5").current_page(), 1)
+        self.assertEqual(self.paging("/p?page=1", "/p?page=4", "", "/p?page=5").current_page(), 5)
+
+    def test_page_from_next(self):
+        self.assertEqual(self.paging("/p", "/p?page=x", "/p?page=4", "/p").current_page(), 3)
+
+    def test_unknown(self):
+        p = self.paging("/p", "/p", "/p", "/p")
+        self.assertEqual(p.current_page(), -1)
+        self.assertEqual(p.current_page_size(), -1)
+
+    def test_extract_paging(self):
+        client = native.GtRNative("http://localhost:1")
+        link = ("<http://host/p?page=1&fetchSize=25>; rel=first, <http://host/p?page=1&fetchSize=25>; rel=previous, "
+                "<http://host/p?page=3&fetchSize=25>; rel=next, <http://host/p?page=4&fetchSize=25>; rel=last")
+        p = client._extract_paging(Response({"link-records" : "100", "link-pages" : "4", "link" : link}))
+        self.assertEqual((p.record_count, p.pages), (100, 4))
+        self.assertEqual(p.next, "http://host/p?page=3&fetchSize=25")
+        self.assertEqual(p.current_page(), 2)
+        self.assertEqual(p.current_page_size(), 25)
+
+    def test_extract_paging_without_headers(self):
+        client = native.GtRNative("http://localhost:1")
+        self.assertIsNone(client._extract_paging(Response({"link-records" : "x", "link-pages" : "4", "link" : ""})))
+        self.assertIsNone(client._extract_paging(Response({"link-records" : "1", "link-pages" : "1"})))
+
+class SkipToPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(projects=60).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_skip_to_page(self):
+        projects = native.GtRNative(self.server.base_url, page_size=25).projects()
+        pages = projects.paging.pages
+        self.assertEqual(pages, 3)
+        self.assertTrue(projects.skip_to_page(pages))
+        self.assertEqual(projects.current_page(), pages)
+        self.assertFalse(projects.skip_to_page(pages + 1))
+        self.assertFalse(projects.skip_to_page(0))
+        self.assertEqual(projects.current_page(), pages)
+
+if __name__ == "__main__":
+    unittest.main()
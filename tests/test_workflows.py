@@ -0,0 +1,286 @@
+import os, shutil, tempfile, threading, time, unittest
+
+from benchmarks.stub_server import StubServer, uuid
+from gtr import workflows, instrument, native, search
+
+class CrawlTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=30).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def crawl(self, **kwargs):
+        """
+        crawl the stub, returning the start times of the detail and CERIF requests
+        """
+        starts = []
+        lock = threading.Lock()
+        def before(info):
+            if "?" not in info["url"] and info["entity"] != "cerif_cfclass":
+                with lock:
+                    starts.append(time.time())
+        hooks = instrument.Hooks()
+        hooks.add("before_request", before)
+        workflows.crawl(self.server.base_url, hooks=hooks, **kwargs)
+        return sorted(starts)
+    
+    def assertPaced(self, starts, gap):
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(len(gaps) > 0)
+        # the requests are timed from the hooks, a little after the pacer lets them go, so
+        # allow for some scheduling jitter on any one gap, but none overall
+        self.assertTrue(starts[-1] - starts[0] >= gap * len(gaps) * 0.95, "%d requests in %.3fs" % (len(starts), starts[-1] - starts[0]))
+        self.assertTrue(min(gaps) >= gap * 0.5, "requests %.3fs apart" % min(gaps))
+    
+    def test_min_request_gap_serial(self):
+        starts = self.crawl(project_callback=lambda p: None, project_limit=5, min_request_gap=0.05)
+        self.assertEqual(len(starts), 5)
+        self.assertPaced(starts, 0.05)
+    
+    def test_min_request_gap_with_workers_and_cerif(self):
+        starts = self.crawl(project_callback=lambda p, c: None, project_limit=6, pass_cerif_project=True,
+                                workers=4, min_request_gap=0.05)
+        self.assertEqual(len(starts), 12)
+        self.assertPaced(starts, 0.05)
+    
+    def test_min_request_gap_pipeline(self):
+        starts = self.crawl(project_callback=lambda p: None, project_limit=6, workers=4, pipeline=True,
+                                callback_workers=2, min_request_gap=0.05)
+        self.assertEqual(len(starts), 6)
+        self.assertPaced(starts, 0.05)
+
+    def test_min_request_gap_with_batch_callback(self):
+        # the batches are spaced out, and so are the requests for the per-record callback
+        batches = []
+        starts = self.crawl(project_callback=lambda p: None, project_batch_callback=lambda b: batches.append(time.time()),
+                                project_limit=6, batch_size=2, min_request_gap=0.05)
+        self.assertEqual(len(starts), 6)
+        self.assertPaced(starts, 0.05)
+        self.assertEqual(len(batches), 3)
+        self.assertPaced(batches, 0.05)
+    
+    def test_batches_and_checkpoints(self):
+        batches = []
+        checkpoints = []
+        self.crawl(project_batch_callback=batches.append, project_limit=25, batch_size=10,
+                    checkpoint_callback=lambda *args: checkpoints.append(args))
+        self.assertEqual([len(b) for b in batches], [10, 10, 5])
+        self.assertEqual([(c[0], c[1]) for c in checkpoints], [("project", 10), ("project", 20), ("project", 25)])
+        self.assertEqual(checkpoints[-1][2], batches[-1][-1].id())
+
+    def test_fields(self):
+        records = []
+        hooked = []
+        hooks = instrument.Hooks()
+        hooks.add("after_callback", lambda info: hooked.append(info["record"]))
+        workflows.crawl(self.server.base_url, project_callback=records.append, project_limit=5, hooks=hooks,
+                            fields=["id", "title", "lead_name", "projectComposition.project.fund.valuePounds"])
+        self.assertEqual(len(records), 5)
+        self.assertEqual(hooked, records)
+        client = native.GtRNative(self.server.base_url, serialisation="json")
+        for r in records:
+            self.assertEqual(r._fields, ("id", "title", "lead_name", "projectComposition_project_fund_valuePounds"))
+            p = client.project(r.id)
+            self.assertEqual(r, p.extract(["id", "title", "lead_name", "projectComposition.project.fund.valuePounds"]))
+    
+    def test_fields_by_type_with_workers_and_cerif(self):
+        projects = []
+        people = []
+        workflows.crawl(self.server.base_url, project_callback=lambda r, c: projects.append((r, c)), project_limit=4,
+                            pass_cerif_project=True, person_callback=people.append, person_limit=3, workers=3,
+                            fields={"project" : ["id", "title"]})
+        self.assertEqual([type(r).__name__ for r, _ in projects], ["ProjectRecord"] * 4)
+        for r, c in projects:
+            self.assertEqual(c.id(), r.id)
+        # people are not projected
+        self.assertEqual([type(p) for p in people], [native.Person] * 3)
+    
+    def test_fields_in_pipeline(self):
+        records = []
+        workflows.crawl(self.server.base_url, project_callback=records.append, project_limit=5, workers=2,
+                            pipeline=True, fields=["id"])
+        self.assertEqual(sorted([r.id for r in records]), sorted([uuid("project", i) for i in range(5)]))
+    
+    def test_fields_with_sink(self):
+        index = search.SearchIndex()
+        self.assertRaises(ValueError, workflows.crawl, self.server.base_url, sinks=[index], fields=["id"])
+        # the sink only takes projects, so the other types may be projected
+        people = []
+        workflows.crawl(self.server.base_url, sinks=[index], project_limit=2, person_callback=people.append,
+                            person_limit=2, fields={"person" : ["id"]})
+        self.assertEqual(len(index), 2)
+        self.assertEqual([type(p).__name__ for p in people], ["PersonRecord"] * 2)
+
+class PipelineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=60).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_ordered(self):
+        ids = []
+        workflows.crawl(self.server.base_url, project_callback=lambda p: ids.append(p.id()), workers=4,
+                            pipeline=True)
+        self.assertEqual(ids, [uuid("project", i) for i in range(60)])
+
+    def test_unordered(self):
+        ids = []
+        lock = threading.Lock()
+        def callback(p):
+            with lock:
+                ids.append(p.id())
+        workflows.crawl(self.server.base_url, project_callback=callback, workers=4, pipeline=True,
+                            callback_workers=3, ordered=False, project_limit=40)
+        self.assertEqual(sorted(ids), sorted([uuid("project", i) for i in range(40)]))
+
+    def test_callback_error_stops_the_crawl(self):
+        seen = []
+        def callback(p):
+            seen.append(p)
+            if len(seen) == 3:
+                raise KeyError("stop")
+        self.assertRaises(KeyError, workflows.crawl, self.server.base_url, project_callback=callback,
+                            workers=2, pipeline=True)
+        self.assertEqual(len(seen), 3)
+
+    def test_bounded_queue(self):
+        # with the queue full, the next page is not listed until the callbacks catch up
+        lists = []
+        hooks = instrument.Hooks()
+        hooks.add("before_request", lambda info: lists.append(1) if "?" in info["url"] else None)
+        listed = []
+        def callback(p):
+            if len(listed) == 0:
+                time.sleep(1)
+                listed.append(len(lists))
+        server = StubServer(projects=210).start()
+        try:
+            workflows.crawl(server.base_url, project_callback=callback, workers=4, pipeline=True,
+                                queue_size=2, hooks=hooks)
+        finally:
+            server.stop()
+        # the last two of the three pages were listed after the first callback
+        self.assertEqual(listed, [len(lists) - 2])
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(projects=60).start()
+        self.events = []
+
+    def tearDown(self):
+        self.server.stop()
+
+    def callback(self, event, p):
+        self.events.append((event, p.id()))
+
+    def watch(self, state=None, **kwargs):
+        self.events = []
+        self.server.reset_counters()
+        return workflows.watch(self.server.base_url, project_callback=self.callback, interval=0, polls=1,
+                                    state=state, page_size=25, **kwargs)
+
+    def change(self, i):
+        """
+        change the title of the ith project in the stub's listing
+        """
+        summary = self.server.dataset.summary
+        def changed(kind, j):
+            d = summary(kind, j)
+            if kind == "project" and j == i:
+                d["title"] = "Changed"
+            return d
+        self.server.dataset.summary = changed
+
+    def test_changes(self):
+        state = self.watch()
+        self.assertEqual(self.events, [("new", uuid("project", i)) for i in range(60)])
+        self.assertEqual(len(state), 60)
+        # with nothing changed, only the first page is read
+        self.watch(state)
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.server.requests, 1)
+        self.change(30)
+        self.watch(state, seen_pages=2)
+        self.assertEqual(self.events, [("changed", uuid("project", 30))])
+        self.watch(state, seen_pages=2)
+        self.assertEqual(self.events, [])
+
+    def test_max_pages(self):
+        state = self.watch(max_pages=1)
+        self.assertEqual(len(state), 25)
+
+    def test_failed_callback_is_retried(self):
+        state = self.watch(max_pages=1)
+        self.change(3)
+        def fail(event, p):
+            raise ValueError("callback")
+        self.assertRaises(ValueError, workflows.watch, self.server.base_url, project_callback=fail, interval=0,
+                            polls=1, state=state, page_size=25)
+        self.watch(state, max_pages=1)
+        self.assertEqual(self.events, [("changed", uuid("project", 3))])
+
+    def test_save_and_load(self):
+        state = self.watch(max_pages=1)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "state")
+            state.save(path)
+            loaded = workflows.WatchState.load(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(loaded), 25)
+        self.watch(loaded, max_pages=1)
+        self.assertEqual(self.events, [])
+
+    def test_fingerprint(self):
+        self.assertEqual(workflows.fingerprint_record({"a" : 1, "b" : [1, 2]}),
+                            workflows.fingerprint_record({"b" : [1, 2], "a" : 1}))
+        self.assertNotEqual(workflows.fingerprint_record({"a" : 1}), workflows.fingerprint_record({"a" : 2}))
+
+class CrawlProfileTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(projects=30).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_crawl_profile(self):
+        profile = workflows.crawl(self.server.base_url, project_callback=lambda p, c: None, project_limit=5,
+                                    pass_cerif_project=True, workers=2, profile=True)
+        self.assertTrue(isinstance(profile, workflows.CrawlProfile))
+        r = profile.report()
+        for stage in ["list_fetch", "detail_fetch", "cerif_fetch", "parse", "callback"]:
+            self.assertTrue(r["stages"][stage] > 0, stage)
+        self.assertEqual(r["entities"]["project"]["records"], 5)
+        self.assertEqual(len(r["slowest"]), 5)
+        self.assertTrue(r["elapsed"] > 0)
+        self.assertIn("crawl took", str(profile))
+
+    def test_slowest(self):
+        profile = workflows.CrawlProfile(slowest=2)
+        for i, elapsed in enumerate([0.3, 0.1, 0.5, 0.2]):
+            profile.record("project", "p%d" % i, elapsed)
+        self.assertEqual([(s["id"], s["elapsed"]) for s in profile.report()["slowest"]], [("p2", 0.5), ("p0", 0.3)])
+
+    def test_rates(self):
+        profile = workflows.CrawlProfile()
+        profile.entity_done("project", 10, 2.0)
+        profile.entity_done("person", 0, 0.0)
+        entities = profile.report()["entities"]
+        self.assertEqual(entities["project"]["records_per_s"], 5.0)
+        self.assertIsNone(entities["person"]["records_per_s"])
+
+if __name__ == "__main__":
+    unittest.main()